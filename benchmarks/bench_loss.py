@@ -0,0 +1,157 @@
+"""
+Times a forward and backward pass through the YOLOv2 loss alone, on random
+net outputs and targets shaped by a .cfg, and reports the peak memory the
+session allocated for it. The net itself is left out so the numbers only
+move with the loss graph; run it before and after a change to the loss.
+
+With --full it times whole training steps of the net instead, the forward
+pass, the loss and the optimizer update, on a batch taken from the usual
+dataset and annotation flags. Run that from the top level directory of a
+project that can already train.
+
+usage: python benchmarks/bench_loss.py --model data/cfg/tiny-yolov2.cfg
+           [--batch N] [--steps N] [--objects N] [--full]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from libs.net.yolov2 import train, data
+from libs.utils.process import cfg_yielder
+from libs.net.build import TFNet
+from libs.utils.flags import Flags, FlagIO
+
+
+class LossOnly(object):
+    """The little of a framework that building the loss needs"""
+
+    def __init__(self, meta):
+        self.meta = meta
+        self.flags = Flags()
+        self.fetch = list()
+        self.logger = logging.getLogger('bench_loss')
+
+
+def read_meta(model):
+    """returns the meta of a .cfg with its output size filled in"""
+    layers = cfg_yielder(model, False)
+    meta = next(layers)
+    for _ in layers:
+        pass
+    return meta
+
+
+def random_objs(meta, n, objects, rng):
+    """returns n compact object arrays of at most objects each"""
+    H, W, _ = meta['out_size']
+    objs = list()
+    for _ in range(n):
+        cells = rng.choice(H * W, min(objects, H * W), replace=False)
+        rows = np.empty((len(cells), 6))
+        rows[:, 0] = cells
+        rows[:, 1] = rng.randint(meta['classes'], size=len(cells))
+        rows[:, 2:] = rng.uniform(.05, .95, (len(cells), 4))
+        objs.append(rows)
+    return objs
+
+
+def peak_bytes(run_metadata):
+    """
+    returns the most bytes any allocator held at once during a traced
+    run, replaying every allocation and release in time order
+    """
+    records = dict()
+    for device in run_metadata.step_stats.dev_stats:
+        for node in device.node_stats:
+            for memory in node.memory:
+                records.setdefault(memory.allocator_name, []).extend(
+                    (r.alloc_micros, r.alloc_bytes)
+                    for r in memory.allocation_records)
+    peak = 0
+    for allocations in records.values():
+        allocations.sort()
+        in_use = np.cumsum([size for _, size in allocations])
+        peak = max([peak] + in_use.tolist())
+    return peak
+
+
+def loss_step(args):
+    """returns a session, the loss with its gradient and random inputs"""
+    meta = read_meta(args.model)
+    fw = LossOnly(meta)
+    H, W, _ = meta['out_size']
+    size = H * W * meta['num'] * (5 + meta['classes'])
+    net_out = tf.placeholder(tf.float32, [None, H, W, size // (H * W)])
+    train.loss(fw, net_out)
+    grad = tf.gradients(fw.loss, net_out)[0]
+
+    rng = np.random.RandomState(0)
+    targets = data._targets(fw, random_objs(meta, args.batch,
+                                            args.objects, rng))
+    feed_dict = {fw.placeholders[key]: targets[key]
+                 for key in fw.placeholders}
+    feed_dict[net_out] = rng.randn(args.batch, H, W,
+                                   size // (H * W)).astype(np.float32)
+    return tf.Session(), [fw.loss, grad], feed_dict
+
+
+def full_step(args):
+    """returns the net's session, its training step and a real batch"""
+    flags = Flags()
+    flags.model = args.model
+    flags.dataset = args.dataset
+    flags.annotation = args.annotation
+    flags.batch = args.batch
+    flags.train = True
+    flags.load = 0
+    flags.summary = ''
+    flags.cli = True
+    io = FlagIO()
+    io.flags = flags
+    io.send_flags()
+    net = TFNet(flags)
+    x_batch, datum = next(net.framework.shuffle())
+    loss_ph = net.framework.placeholders
+    feed_dict = {loss_ph[key]: datum[key] for key in loss_ph}
+    feed_dict[net.inp] = x_batch
+    feed_dict.update(net.feed)
+    return net.sess, [net.framework.loss, net.train_op], feed_dict
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--objects', type=int, default=8)
+    parser.add_argument('--full', action='store_true',
+                        help='time whole training steps of the net')
+    parser.add_argument('--dataset', default=Flags().dataset)
+    parser.add_argument('--annotation', default=Flags().annotation)
+    args = parser.parse_args()
+
+    step = full_step if args.full else loss_step
+    sess, fetches, feed_dict = step(args)
+    with sess:
+        sess.run(fetches, feed_dict)  # warm up
+        start = time.time()
+        for _ in range(args.steps):
+            loss = sess.run(fetches, feed_dict)[0]
+        elapsed = time.time() - start
+        run_metadata = tf.RunMetadata()
+        sess.run(fetches, feed_dict, options=tf.RunOptions(
+            trace_level=tf.RunOptions.FULL_TRACE), run_metadata=run_metadata)
+
+    print('{} | batch {} | loss {:.6f} | {:.2f} ms/step | peak {:.1f} MB'
+          .format(os.path.basename(args.model), args.batch, loss,
+                  elapsed / args.steps * 1e3,
+                  peak_bytes(run_metadata) / float(1 << 20)))
+
+
+if __name__ == '__main__':
+    main()
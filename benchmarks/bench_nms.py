@@ -0,0 +1,83 @@
+"""
+Times the sorted, candidate-only NMS against the all-pairs scan it
+replaced, on synthetic region outputs with a given number of objects,
+and reports how many boxes above threshold each one keeps.
+
+usage: python benchmarks/bench_nms.py [--side 13 19] [--classes 20 80]
+           [--objects N] [--runs N]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from libs.cython_utils.nms import NMS, legacy_nms
+from libs.cython_utils.cy_yolo2_findboxes import decode
+
+B = 5
+ANCHORS = [1.08, 1.19, 3.42, 4.41, 6.63, 11.38, 9.42, 5.11, 16.62, 10.52]
+
+
+def region_output(side, classes, objects, rng):
+    """returns a random [side, side, B * (5 + classes)] region output with
+    objects clusters of confident, overlapping anchors"""
+    out = rng.randn(side * side * B, 5 + classes).astype(np.float32)
+    for cell in rng.choice(side * side, objects, replace=False):
+        rows = slice(cell * B, cell * B + B)
+        out[rows, 4] += 5.
+        out[rows, 5 + rng.randint(classes)] += 8.
+    return out.reshape(side, side, -1)
+
+
+def timed(runs, nms, *args):
+    start = time.time()
+    for _ in range(runs):
+        boxes = nms(*[np.array(a) for a in args])
+    return (time.time() - start) / runs * 1e3, boxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--side', type=int, nargs='+', default=[13, 19])
+    parser.add_argument('--classes', type=int, nargs='+', default=[20, 80])
+    parser.add_argument('--objects', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=.4)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    form = '{:>4} | {:>7} | {:>14} | {:>14} | {:>14}'
+    print(form.format('side', 'classes', 'legacy grid ms', 'new grid ms',
+                      'new cand. ms'))
+    for side in args.side:
+        for classes in args.classes:
+            meta = {'out_size': [side, side, B * (5 + classes)],
+                    'classes': classes, 'num': B, 'anchors': ANCHORS,
+                    'thresh': args.threshold}
+            probs, bbox = decode(meta, region_output(
+                side, classes, args.objects, rng))
+            # the legacy path saw every anchor of the grid
+            grid_probs = np.zeros((side * side * B, classes), np.float32)
+            grid_bbox = np.zeros((side * side * B, 5), np.float32)
+            grid_probs[:len(probs)], grid_bbox[:len(bbox)] = probs, bbox
+
+            def kept(boxes):
+                if isinstance(boxes, np.ndarray):
+                    return int(np.sum(boxes['score'] > args.threshold))
+                return sum(box.probs.max() > args.threshold
+                           for box in boxes)
+
+            legacy = timed(args.runs, legacy_nms, grid_probs, grid_bbox)
+            grid = timed(args.runs, NMS, grid_probs, grid_bbox)
+            cand = timed(args.runs, NMS, probs, bbox)
+            print(form.format(
+                side, classes,
+                '{:.2f} ({})'.format(legacy[0], kept(legacy[1])),
+                '{:.2f} ({})'.format(grid[0], kept(grid[1])),
+                '{:.2f} ({})'.format(cand[0], kept(cand[1]))))
+
+
+if __name__ == '__main__':
+    main()
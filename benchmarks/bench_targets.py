@@ -0,0 +1,140 @@
+"""
+Times per-batch loss target assembly for the yolo and yolov2 frameworks,
+comparing the former per-object loops + np.concatenate batching with the
+preallocated, vectorized scatter in libs.net.yolo.data, and checks that
+both produce the same targets.
+
+usage: python benchmarks/bench_targets.py [--batch N] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from libs.net.yolo import data as yolo_data
+from libs.net.yolov2 import data as yolov2_data
+
+LABELS = ['label{}'.format(i) for i in range(20)]
+
+
+def legacy_targets(meta, allobj, w, h, v2):
+    """The per-object loop formerly in yolo(v2).data._batch"""
+    if v2:
+        H, W, _ = meta['out_size']
+    else:
+        H = W = meta['side']
+    C, B = meta['classes'], meta['num']
+    cellx = 1. * w / W
+    celly = 1. * h / H
+    allobj = [list(obj) for obj in allobj]
+    for obj in allobj:
+        centerx = .5 * (obj[1] + obj[3])
+        centery = .5 * (obj[2] + obj[4])
+        cx = centerx / cellx
+        cy = centery / celly
+        obj[3] = np.sqrt(float(obj[3] - obj[1]) / w)
+        obj[4] = np.sqrt(float(obj[4] - obj[2]) / h)
+        obj[1] = cx - np.floor(cx)
+        obj[2] = cy - np.floor(cy)
+        obj += [int(np.floor(cy) * W + np.floor(cx))]
+    probs = np.zeros([H*W, B, C] if v2 else [H*W, C])
+    confs = np.zeros([H*W, B])
+    coord = np.zeros([H*W, B, 4])
+    proid = np.zeros([H*W, B, C] if v2 else [H*W, C])
+    prear = np.zeros([H*W, 4])
+    for obj in allobj:
+        probs[obj[5]] = 0.
+        probs[obj[5], ..., LABELS.index(obj[0])] = 1.
+        proid[obj[5]] = 1.
+        coord[obj[5], :, :] = [obj[1:5]] * B
+        prear[obj[5], 0] = obj[1] - obj[3]**2 * .5 * W
+        prear[obj[5], 1] = obj[2] - obj[4]**2 * .5 * H
+        prear[obj[5], 2] = obj[1] + obj[3]**2 * .5 * W
+        prear[obj[5], 3] = obj[2] + obj[4]**2 * .5 * H
+        confs[obj[5], :] = [1.] * B
+    upleft = np.expand_dims(prear[:, 0:2], 1)
+    botright = np.expand_dims(prear[:, 2:4], 1)
+    wh = botright - upleft
+    area = wh[:, :, 0] * wh[:, :, 1]
+    return {
+        'probs': probs, 'confs': confs, 'coord': coord, 'proid': proid,
+        'areas': np.concatenate([area] * B, 1),
+        'upleft': np.concatenate([upleft] * B, 1),
+        'botright': np.concatenate([botright] * B, 1)
+    }
+
+
+def legacy_batch(meta, samples, v2):
+    feed_batch = dict()
+    for w, h, allobj in samples:
+        new_feed = legacy_targets(meta, allobj, w, h, v2)
+        for key in new_feed:
+            new = new_feed[key]
+            old_feed = feed_batch.get(key, np.zeros((0,) + new.shape))
+            feed_batch[key] = np.concatenate([old_feed, [new]])
+    return feed_batch
+
+
+def vectorized_batch(meta, samples, v2):
+    if v2:
+        H, W, _ = meta['out_size']
+        module = yolov2_data
+    else:
+        H = W = meta['side']
+        module = yolo_data
+
+    class _Framework(object):
+        pass
+    framework = _Framework()
+    framework.meta = meta
+    objs = [yolo_data._compact(allobj, LABELS, w, h, W, H)
+            for w, h, allobj in samples]
+    return module._targets(framework, objs)
+
+
+def samples(n, rng):
+    out = list()
+    for _ in range(n):
+        w, h = 640, 480
+        allobj = list()
+        for _ in range(rng.randint(1, 6)):
+            x1, y1 = rng.randint(0, w - 50), rng.randint(0, h - 50)
+            allobj.append([LABELS[rng.randint(len(LABELS))], x1, y1,
+                           rng.randint(x1 + 1, w), rng.randint(y1 + 1, h)])
+        out.append((w, h, allobj))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch', default=16, type=int)
+    parser.add_argument('--repeat', default=20, type=int)
+    args = parser.parse_args()
+    rng = np.random.RandomState(0)
+    frameworks = [
+        ('yolo    S=7  B=2 C=20', False,
+         {'side': 7, 'num': 2, 'classes': 20, 'labels': LABELS}),
+        ('yolov2 13x13 B=5 C=20', True,
+         {'out_size': [13, 13, 125], 'num': 5, 'classes': 20,
+          'labels': LABELS})]
+    for name, v2, meta in frameworks:
+        batch = samples(args.batch, rng)
+        old = legacy_batch(meta, batch, v2)
+        new = vectorized_batch(meta, batch, v2)
+        for key in old:
+            assert np.array_equal(old[key].astype(np.float32), new[key]), key
+        timings = list()
+        for assemble in [legacy_batch, vectorized_batch]:
+            start = time.time()
+            for _ in range(args.repeat):
+                assemble(meta, batch, v2)
+            timings.append((time.time() - start) / args.repeat * 1000)
+        print('{} batch {:>4}: legacy {:8.2f} ms  vectorized {:8.2f} ms'
+              '  ({:.1f}x)'.format(name, args.batch, timings[0], timings[1],
+                                   timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
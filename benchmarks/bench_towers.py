@@ -0,0 +1,81 @@
+"""
+Times training steps of a model built with 1, 2, 4 ... CPU towers on the
+same batch and reports throughput and its scaling against a single tower.
+The model, dataset and annotations are taken from the usual flags, so run
+it from the top level directory of a project that can already train.
+Each tower count is timed in a process of its own because TF sets up the
+thread pools of CPU devices once per process.
+
+usage: python benchmarks/bench_towers.py --model data/cfg/tiny-yolo-voc.cfg
+           [--towers 1 2 4] [--batch N] [--steps N]
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from libs.net.build import TFNet
+from libs.utils.flags import Flags, FlagIO
+
+
+def time_steps(flags, steps):
+    """returns images per second for flags.towers towers"""
+    io = FlagIO()
+    io.flags = flags
+    io.send_flags()
+    net = TFNet(flags)
+    x_batch, datum = next(net.framework.shuffle())
+    loss_ph = net.framework.placeholders
+    feed_dict = {loss_ph[key]: datum[key] for key in loss_ph}
+    feed_dict[net.inp] = x_batch
+    feed_dict.update(net.feed)
+    fetches = [net.train_op, net.framework.loss]
+
+    net.sess.run(fetches, feed_dict)  # warm up
+    start = time.time()
+    for _ in range(steps):
+        net.sess.run(fetches, feed_dict)
+    elapsed = time.time() - start
+    net.sess.close()
+    return steps * len(x_batch) / elapsed
+
+
+def time_isolated(flags, steps):
+    """time_steps in a fresh process"""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(time_steps, (flags, steps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--towers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--dataset', default=Flags().dataset)
+    parser.add_argument('--annotation', default=Flags().annotation)
+    args = parser.parse_args()
+
+    base = None
+    print('{:>6} | {:>10} | {:>7}'.format('towers', 'images/s', 'scaling'))
+    for towers in args.towers:
+        flags = Flags()
+        flags.model = args.model
+        flags.dataset = args.dataset
+        flags.annotation = args.annotation
+        flags.batch = args.batch
+        flags.towers = towers
+        flags.train = True
+        flags.load = 0
+        flags.summary = ''
+        flags.cli = True
+        rate = time_isolated(flags, args.steps)
+        base = base or rate
+        print('{:>6} | {:>10.2f} | {:>6.2f}x'.format(towers, rate,
+                                                     rate / base))
+
+
+if __name__ == '__main__':
+    main()
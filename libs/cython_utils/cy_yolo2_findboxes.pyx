@@ -1,98 +1,55 @@
 import numpy as np
 cimport numpy as np
 cimport cython
-from cython.parallel import prange
-ctypedef np.float_t DTYPE_t
-from libc.math cimport exp
-from ..utils.box import BoundBox
-from nms cimport NMS
-
-#expit
-@cython.boundscheck(False) # turn off bounds-checking for entire function
-@cython.wraparound(False)  # turn off negative index wrapping for entire function
-@cython.cdivision(True)
-cdef float expit_c(float x):
-    cdef float y= 1/(1+exp(-x))
-    return y
-
-#MAX
-@cython.boundscheck(False) # turn off bounds-checking for entire function
-@cython.wraparound(False)  # turn off negative index wrapping for entire function
-@cython.cdivision(True)
-cdef float max_c(float a, float b):
-    if(a>b):
-        return a
-    return b
-
-"""
-#SOFTMAX!
-@cython.cdivision(True)
-@cython.boundscheck(False) # turn off bounds-checking for entire function
-@cython.wraparound(False)  # turn off negative index wrapping for entire function
-cdef void _softmax_c(float* x, int classes):
-    cdef:
-        float sum = 0
-        np.intp_t k
-        float arr_max = 0
-    with nogil, parallel():
-        for k in prange(classes, schedule='guided'):
-            arr_max = max(arr_max,x[k])
-
-        for k in prange(classes, schedule='guided'):
-            x[k] = exp(x[k]-arr_max)
-            sum += x[k]
-
-        for k in prange(classes, schedule='guided'):
-            x[k] = x[k]/sum
-"""
-        
-        
-
-#BOX CONSTRUCTOR
-@cython.cdivision(True)
-@cython.boundscheck(False) # turn off bounds-checking for entire function
-@cython.wraparound(False)  # turn off negative index wrapping for entire function
-def box_constructor(meta,np.ndarray[float,ndim=3] net_out_in):
+from .nms import NMS
+
+#DECODER
+def decode(meta, np.ndarray[float, ndim=3] net_out_in):
+    """
+    Takes a [H, W, B * (5 + C)] region layer output
+    returns the [N, C] thresholded class probabilities and [N, 5]
+    (x, y, w, h, c) boxes of the N anchors, in anchor order, whose
+    objectness times best class probability clears meta['thresh'].
+    Sigmoid, exp and softmax run over all anchors at once and box
+    coordinates are only worked out for the anchors that are kept.
+    net_out_in is left untouched.
+    """
     cdef:
-        np.intp_t H, W, _, C, B, row, col, box_loop, class_loop
-        np.intp_t row1, col1, box_loop1,index,index2
-        float  threshold = meta['thresh']
-        float tempc,arr_max=0,sum=0
-        double[:] anchors = np.asarray(meta['anchors'])
-        list boxes = list()
+        float threshold = meta['thresh']
+        np.intp_t H, W, _, C, B
 
     H, W, _ = meta['out_size']
     C = meta['classes']
     B = meta['num']
-    
-    cdef:
-        float[:, :, :, ::1] net_out = net_out_in.reshape([H, W, B, net_out_in.shape[2]/B])
-        float[:, :, :, ::1] Classes = net_out[:, :, :, 5:]
-        float[:, :, :, ::1] Bbox_pred =  net_out[:, :, :, :5]
-        float[:, :, :, ::1] probs = np.zeros((H, W, B, C), dtype=np.float32)
 
-    for row in range(H):
-        for col in range(W):
-            for box_loop in range(B):
-                arr_max=0
-                sum=0;
-                Bbox_pred[row, col, box_loop, 4] = expit_c(Bbox_pred[row, col, box_loop, 4])
-                Bbox_pred[row, col, box_loop, 0] = (col + expit_c(Bbox_pred[row, col, box_loop, 0])) / W
-                Bbox_pred[row, col, box_loop, 1] = (row + expit_c(Bbox_pred[row, col, box_loop, 1])) / H
-                Bbox_pred[row, col, box_loop, 2] = exp(Bbox_pred[row, col, box_loop, 2]) * anchors[2 * box_loop + 0] / W
-                Bbox_pred[row, col, box_loop, 3] = exp(Bbox_pred[row, col, box_loop, 3]) * anchors[2 * box_loop + 1] / H
-                #SOFTMAX BLOCK, no more pointer juggling
-                for class_loop in range(C):
-                    arr_max=max_c(arr_max,Classes[row,col,box_loop,class_loop])
-                    for class_loop in range(C):
-                        Classes[row,col,box_loop,class_loop]=exp(Classes[row,col,box_loop,class_loop]-arr_max)
-                        sum+=Classes[row,col,box_loop,class_loop]
+    net_out = net_out_in.reshape([H * W * B, 5 + C])
+    conf = 1. / (1. + np.exp(-net_out[:, 4]))
+
+    # softmax over the classes of every anchor
+    classes = net_out[:, 5:]
+    probs = np.exp(classes - classes.max(1, keepdims=True))
+    probs *= (conf / probs.sum(1))[:, None]
+
+    keep = np.flatnonzero(probs.max(1) > threshold)
+    probs = probs[keep]
+    probs[probs <= threshold] = 0.
 
-                    for class_loop in range(C):
-                        tempc = Classes[row, col, box_loop, class_loop] * Bbox_pred[row, col, box_loop, 4]/sum
-                        if(tempc > threshold):
-                            probs[row, col, box_loop, class_loop] = tempc
-    
-    
-    #NMS                    
-    return NMS(np.ascontiguousarray(probs).reshape(H*W*B,C), np.ascontiguousarray(Bbox_pred).reshape(H*B*W,5))
+    anchors = np.asarray(meta['anchors'], np.float32).reshape([B, 2])
+    cell, box = np.divmod(keep, B)
+    row, col = np.divmod(cell, W)
+    coords = 1. / (1. + np.exp(-net_out[keep, 0:2]))
+    bbox = np.empty((len(keep), 5), np.float32)
+    bbox[:, 0] = (col + coords[:, 0]) / W
+    bbox[:, 1] = (row + coords[:, 1]) / H
+    bbox[:, 2] = np.exp(net_out[keep, 2]) * anchors[box, 0] / W
+    bbox[:, 3] = np.exp(net_out[keep, 3]) * anchors[box, 1] / H
+    bbox[:, 4] = conf[keep]
+    return np.ascontiguousarray(probs, np.float32), bbox
+
+
+#BOX CONSTRUCTOR
+def box_constructor(meta, np.ndarray[float, ndim=3] net_out_in):
+    probs, bbox = decode(meta, net_out_in)
+    #NMS
+    return NMS(probs, bbox, meta.get('nms_iou', .4),
+               meta.get('nms_mode', 'class'), meta['thresh'])
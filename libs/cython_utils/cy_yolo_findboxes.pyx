@@ -4,7 +4,7 @@ cimport cython
 ctypedef np.float_t DTYPE_t
 from libc.math cimport exp
 from ..utils.box import BoundBox
-from nms cimport NMS
+from .nms import NMS
 
 
 
@@ -48,4 +48,7 @@ def yolo_box_constructor(meta,np.ndarray[float] net_out, float threshold):
                     final_probs[grid, b, class_loop] = probs[grid, class_loop]
     
     
-    return NMS(np.ascontiguousarray(final_probs).reshape(SS*B, C) , np.ascontiguousarray(coords).reshape(SS*B, 4))
+    return NMS(np.ascontiguousarray(final_probs).reshape(SS*B, C),
+               np.ascontiguousarray(coords).reshape(SS*B, 4),
+               meta.get('nms_iou', .4), meta.get('nms_mode', 'class'),
+               threshold)
@@ -1,11 +0,0 @@
-import numpy as np
-cimport numpy as np
-cimport cython
-ctypedef np.float_t DTYPE_t
-from libc.math cimport exp
-from utils.box import BoundBox
-
-
-cdef NMS(float[:, ::1] , float[:, ::1] )
-
-
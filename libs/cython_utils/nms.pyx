@@ -2,7 +2,7 @@ import numpy as np
 cimport numpy as np
 cimport cython
 from libc.math cimport exp
-from ..utils.box import BoundBox
+from ..utils.box import BoundBox, DETECTION
 
 
 
@@ -57,10 +57,148 @@ cdef float box_iou_c(float ax, float ay, float aw, float ah, float bx, float by,
 
 
 #NMS
+# class aware, class agnostic or gaussian soft suppression
+MODES = ('class', 'agnostic', 'soft')
+
+
+#CORNERS
+def _corners(bbox):
+    """returns [N, 5] (left, top, right, bottom, area) of (x, y, w, h)"""
+    bbox = np.asarray(bbox, np.float32)
+    half = bbox[:, 2:4] * .5
+    corners = np.empty((len(bbox), 5), np.float32)
+    corners[:, 0:2] = bbox[:, 0:2] - half
+    corners[:, 2:4] = bbox[:, 0:2] + half
+    corners[:, 4] = bbox[:, 2] * bbox[:, 3]
+    return corners
+
+
+#CORNER IOU
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+@cython.cdivision(True)
+cdef inline float corner_iou_c(float[:, ::1] corners, np.intp_t i, np.intp_t j) nogil:
+    cdef float w, h, inter, union
+    w = min(corners[i, 2], corners[j, 2]) - max(corners[i, 0], corners[j, 0])
+    if w <= 0: return 0
+    h = min(corners[i, 3], corners[j, 3]) - max(corners[i, 1], corners[j, 1])
+    if h <= 0: return 0
+    inter = w * h
+    union = corners[i, 4] + corners[j, 4] - inter
+    if union <= 0: return 0
+    return inter / union
+
+
+#GREEDY
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void greedy_c(np.intp_t[::1] order, float[:, ::1] corners,
+                   float iou_threshold, unsigned char[::1] alive) nogil:
+    cdef np.intp_t a, b, n = order.shape[0]
+    for a in range(n):
+        if not alive[a]: continue
+        for b in range(a + 1, n):
+            if alive[b] and corner_iou_c(corners, order[a], order[b]) >= iou_threshold:
+                alive[b] = 0
+
+
+#SOFT
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+@cython.cdivision(True)
+cdef void soft_c(np.intp_t[::1] idx, float[::1] scores, float[:, ::1] corners,
+                 float threshold, float sigma, unsigned char[::1] done) nogil:
+    cdef np.intp_t a, best, n = idx.shape[0]
+    cdef float iou
+    while True:
+        best = -1
+        for a in range(n):
+            if not done[a] and scores[a] > threshold and \
+                    (best < 0 or scores[a] > scores[best]):
+                best = a
+        if best < 0: return
+        done[best] = 1
+        for a in range(n):
+            if done[a] or scores[a] <= threshold: continue
+            iou = corner_iou_c(corners, idx[best], idx[a])
+            scores[a] *= exp(-iou * iou / sigma)
+            if scores[a] <= threshold:
+                scores[a] = 0
+
+
+def _kept(scores, idx, corners, float iou_threshold):
+    """returns the idx greedy NMS keeps on scores, visited best first"""
+    order = np.ascontiguousarray(idx[np.argsort(-scores, kind='stable')])
+    alive = np.ones(len(order), np.uint8)
+    greedy_c(order, corners, iou_threshold, alive)
+    return order[alive.astype(bool)]
+
+
+def suppress(probs, bbox, float iou_threshold=.4, mode='class',
+             float threshold=0., float sigma=.5):
+    """
+    Takes [N, C] class probabilities, zero where a class was not
+    detected, and the [N, >=4] (x, y, w, h, ...) boxes they belong to
+    returns the probabilities that survive NMS, others set to zero.
+    Only rows with a detection take part and candidates are visited
+    best score first. 'class' suppresses overlaps within each class,
+    'agnostic' lets a box suppress every overlapping box of lower best
+    score whatever its class, 'soft' decays overlapping scores of each
+    class by exp(-iou ** 2 / sigma) until they fall to threshold.
+    """
+    if mode not in MODES:
+        raise ValueError('NMS mode {} is not one of {}'.format(mode, MODES))
+    probs = np.asarray(probs, np.float32)
+    out = np.zeros_like(probs)
+    rows = np.flatnonzero(probs.any(1))
+    if not len(rows):
+        return out
+    cand = probs[rows]
+    corners = _corners(np.asarray(bbox)[rows, :4])
+    if mode == 'agnostic':
+        keep = _kept(cand.max(1), np.arange(len(rows)), corners,
+                     iou_threshold)
+        out[rows[keep]] = cand[keep]
+        return out
+    for c in np.flatnonzero(cand.any(0)):
+        idx = np.flatnonzero(cand[:, c])
+        if mode == 'soft':
+            scores = np.ascontiguousarray(cand[idx, c])
+            soft_c(idx, scores, corners, threshold, sigma,
+                   np.zeros(len(idx), np.uint8))
+            out[rows[idx], c] = scores
+        else:
+            keep = _kept(cand[idx, c], idx, corners, iou_threshold)
+            out[rows[keep], c] = cand[keep, c]
+    return out
+
+
+def NMS(final_probs, final_bbox, float iou_threshold=.4, mode='class',
+        float threshold=0., float sigma=.5):
+    """
+    returns a DETECTION array with a row for every box that keeps a
+    class after suppress, in the order of final_bbox, labelled with
+    the best class it kept
+    """
+    final_probs = suppress(final_probs, final_bbox, iou_threshold, mode,
+                           threshold, sigma)
+    rows = np.flatnonzero(final_probs.any(1))
+    bbox = np.asarray(final_bbox)[rows]
+    probs = final_probs[rows]
+    detections = np.zeros(len(rows), DETECTION)
+    for k, field in enumerate(['x', 'y', 'w', 'h', 'conf'][:bbox.shape[1]]):
+        detections[field] = bbox[:, k]
+    detections['class'] = probs.argmax(1)
+    detections['score'] = probs[np.arange(len(rows)), detections['class']]
+    return detections
+
+
+#LEGACY NMS
+# the all pairs scan NMS replaced, kept for benchmarks/bench_nms.py
 @cython.boundscheck(False) # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
 @cython.cdivision(True)
-cdef NMS(float[:, ::1] final_probs , float[:, ::1] final_bbox):
+def legacy_nms(float[:, ::1] final_probs , float[:, ::1] final_bbox):
     cdef list boxes = list()
     cdef set indices = set()
     cdef:
@@ -92,40 +230,3 @@ cdef NMS(float[:, ::1] final_probs , float[:, ::1] final_bbox):
                 boxes.append(bb)
                 indices.add(index)
     return boxes
-
-# cdef NMS(float[:, ::1] final_probs , float[:, ::1] final_bbox):
-#     cdef list boxes = list()
-#     cdef:
-#         np.intp_t pred_length,class_length,class_loop,index,index2, i, j
-
-  
-#     pred_length = final_bbox.shape[0]
-#     class_length = final_probs.shape[1]
-
-#     for class_loop in range(class_length):
-#         order = np.argsort(final_probs[:,class_loop])[::-1]
-#         # First box
-#         for i in range(pred_length):
-#             index = order[i]
-#             if final_probs[index, class_loop] == 0.: 
-#                 continue
-#             # Second box
-#             for j in range(i+1, pred_length):
-#                 index2 = order[j]
-#                 if box_iou_c(
-#                     final_bbox[index,0],final_bbox[index,1],
-#                     final_bbox[index,2],final_bbox[index,3],
-#                     final_bbox[index2,0],final_bbox[index2,1],
-#                     final_bbox[index2,2],final_bbox[index2,3]) >= 0.4:
-#                     final_probs[index2, class_loop] = 0.
-                    
-#             bb = BoundBox(class_length)
-#             bb.x = final_bbox[index, 0]
-#             bb.y = final_bbox[index, 1]
-#             bb.w = final_bbox[index, 2]
-#             bb.h = final_bbox[index, 3]
-#             bb.c = final_bbox[index, 4]
-#             bb.probs = np.asarray(final_probs[index,:])
-#             boxes.append(bb)
-  
-#     return boxes
@@ -81,19 +81,41 @@ class ScientificDoubleSpinBox(QDoubleSpinBox):
 class FlowThread(QThread, FlagIO):
     """Needed so the long-running train ops don't block Qt UI"""
 
-    def __init__(self, parent, proc, flags, rate=.2):
+    def __init__(self, parent, proc, flags, rate=.2, grace=10):
         super(FlowThread, self).__init__(parent)
         self.connection = Connection()
         self.rate = rate
+        self.grace = grace
         self.proc = proc
         self.flags = flags
+        self.control = self.open_control()
+        self.deadline = None  # set by stop()
         self.send_flags()
 
+    def _grace(self):
+        """
+        seconds a stopped flow gets to exit on its own: training watches
+        the control slot and saves a checkpoint, annotation checks the
+        kill flag and closes its video, other flows never look
+        """
+        if self.flags.train:
+            return self.grace
+        if self.flags.fbf and not self.flags.freeze and not self.flags.demo:
+            return self.grace
+        return 0
+
     def stop(self):
+        """Asks the flow to stop, run() terminates it once its grace is up"""
         if not self.flags.done:
             self.flags.kill = True
+            # lets training save a checkpoint before it exits
+            self.control.kill = True
         self.io_flags()
-        self.proc.terminate()
+        self.deadline = time.time() + self._grace()
+        if self.isFinished():  # the flow exited before run() saw the stop
+            self._cleanup()
+
+    def _cleanup(self):
         if os.stat(self.logfile.baseFilename).st_size > 0:
             self.logfile.doRollover()
         if os.stat(self.tf_logfile.baseFilename).st_size > 0:
@@ -102,12 +124,25 @@ class FlowThread(QThread, FlagIO):
 
     def run(self):
         prg = 0
+        last_read = time.time()
         while self.proc.poll() is None:
-            prg_old, prg = prg, self.flags.progress
+            # waiting on a stopped flow here keeps the Qt UI responsive
+            if self.deadline is not None and time.time() >= self.deadline:
+                self.proc.terminate()
+                self.proc.wait()
+                break
+            # training publishes to the control slot every step, other
+            # flows only through the flags file which is read less often
+            prg_old, prg = prg, max(self.control.progress,
+                                    self.flags.progress)
             if prg > prg_old:
                 self.connection.progressUpdate.emit(prg)
             time.sleep(self.rate)
-            self.read_flags()
+            if time.time() - last_read >= self.flags.progress_interval:
+                last_read = time.time()
+                self.read_flags()
+        if self.deadline is not None:
+            self._cleanup()
 
 
 class MultiCamThread(QThread):
@@ -294,6 +329,40 @@ class FlowDialog(QDialog):
         self.saveSpb.setWrapping(True)
         layout3.addRow(QLabel("Save Every"), self.saveSpb)
 
+        self.workersSpb = QSpinBox()
+        self.workersSpb.setRange(0, os.cpu_count() or 1)
+        self.workersSpb.setValue(self.flags.workers)
+        self.workersSpb.setToolTip("Number of processes preparing batches "
+                                   "while the model trains")
+        layout3.addRow(QLabel("Data Loader Workers"), self.workersSpb)
+
+        self.frameCacheChb = QCheckBox()
+        self.frameCacheChb.setChecked(self.flags.frame_cache)
+        self.frameCacheChb.setToolTip("Decode training frames once into a "
+                                      "memory-mapped cache")
+        layout3.addRow(QLabel("Cache Decoded Frames"), self.frameCacheChb)
+
+        self.trainableSpb = QSpinBox()
+        self.trainableSpb.setRange(0, 999)
+        self.trainableSpb.setValue(self.flags.trainable)
+        self.trainableSpb.setSpecialValueText("All")
+        self.trainableSpb.setToolTip("Train only this many of the last "
+                                     "layers, keeping the others frozen")
+        layout3.addRow(QLabel("Layers to Train"), self.trainableSpb)
+
+        self.featureCacheChb = QCheckBox()
+        self.featureCacheChb.setChecked(self.flags.feature_cache)
+        self.featureCacheChb.setToolTip("Run the frozen layers once per "
+                                        "frame and train the rest from their "
+                                        "cached outputs, without augmentation")
+        layout3.addRow(QLabel("Cache Frozen Layers"), self.featureCacheChb)
+
+        self.tfdataChb = QCheckBox()
+        self.tfdataChb.setChecked(self.flags.tfdata)
+        self.tfdataChb.setToolTip("Prefetch training batches into the "
+                                  "session with a tf.data pipeline")
+        layout3.addRow(QLabel("Use tf.data Pipeline"), self.tfdataChb)
+
         self.clipLayout = QHBoxLayout()
         self.clipNorm = QSpinBox()
         self.clipNorm.setValue(5)
@@ -482,6 +551,11 @@ class FlowDialog(QDialog):
         self.flags.batch = self.batchSpb.value()
         self.flags.save = self.saveSpb.value()
         self.flags.epoch = self.epochSpb.value()
+        self.flags.workers = self.workersSpb.value()
+        self.flags.frame_cache = bool(self.frameCacheChb.checkState())
+        self.flags.tfdata = bool(self.tfdataChb.checkState())
+        self.flags.trainable = self.trainableSpb.value()
+        self.flags.feature_cache = bool(self.featureCacheChb.checkState())
         self.flags.labels = self.labelfile  # use labelfile set by slgrSuite
         if self.jsonChb.isChecked():
             self.flags.output_type.append("json")
@@ -4,9 +4,13 @@ import cv2
 import json
 import time
 import math
+import itertools
 import pickle
+import socket
+import hashlib
+import glob
+import multiprocessing
 from datetime import datetime
-from multiprocessing.pool import ThreadPool
 from threading import Thread
 import numpy as np
 import tensorflow as tf
@@ -14,12 +18,17 @@ from tensorflow.python.platform import tf_logging
 from tensorflow.python.framework import ops
 from tensorflow.python.ops import math_ops
 from tensorflow.python.eager import context
+from tensorflow.contrib import graph_editor
 from .ops import op_create, identity
 from .ops import HEADER, LINE
 from .framework import create_framework
 from ..dark.darknet import Darknet
 from ..utils.loader import create_loader
-from ..utils.flags import FlagIO
+from ..utils.flags import FlagIO, thread_profile
+from ..utils.losslog import LossLog
+from ..utils.featcache import FeatureCache
+from ..utils.pipeline import Pipeline, Stage
+from ..utils.imhandle import ImageHandle
 
 train_stats = (
     'Training statistics - '
@@ -28,9 +37,10 @@ train_stats = (
     'Epoch number: {}  '
     'Backup every: {}  '
 )
-pool = ThreadPool()
 
 old_graph_msg = 'Resolving old graph def {} (no guarantee)'
+# kept out of the default summaries so they can run on their own cadence
+HISTOGRAMS = 'histogram_summaries'
 
 
 class GradientNaN(Exception):
@@ -45,6 +55,30 @@ class GradientNaN(Exception):
                    option))
 
 
+def _time_threads(graph_def, names, config, batches, passes):
+    """
+    returns the images per second of each batch size through the net in
+    graph_def, run by a session made with config in a process of its own.
+    names are those of the initializer, input and output.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(tf.GraphDef.FromString(graph_def), name='')
+    init, inp, out = names
+    inp_size = graph.get_tensor_by_name(inp).shape.as_list()[1:]
+    rates = list()
+    with tf.Session(graph=graph, config=tf.ConfigProto(**config)) as sess:
+        sess.run(init)
+        for batch in batches:
+            feed_dict = {inp: np.random.uniform(size=[batch] + inp_size)}
+            sess.run(out, feed_dict)  # warm up
+            start = time.time()
+            for _ in range(passes):
+                sess.run(out, feed_dict)
+            rates.append(passes * batch / (time.time() - start))
+    return rates
+
+
 class TFNet(FlagIO):
     _TRAINER = dict({
         'rmsprop': tf.train.RMSPropOptimizer,
@@ -95,7 +129,9 @@ class TFNet(FlagIO):
 
         if darknet is None:
             darknet = Darknet(flags)
-            self.ntrain = len(darknet.layers)
+            # train the last flags.trainable layers, all of them if 0
+            self.ntrain = min(flags.trainable, len(darknet.layers)) or \
+                len(darknet.layers)
 
         self.darknet = darknet
         args = [darknet.meta, flags]
@@ -148,6 +184,7 @@ class TFNet(FlagIO):
         # Build the forward pass
         state = identity(self.inp)
         roof = self.num_layer - self.ntrain
+        self.boundary = None  # output of the last frozen layer
         self.logger.info(LINE)
         self.logger.info(HEADER)
         self.logger.info(LINE)
@@ -155,6 +192,8 @@ class TFNet(FlagIO):
             scope = '{}-{}'.format(str(i), layer.type)
             args = [layer, state, i, roof, self.feed]
             state = op_create(*args)
+            if i == roof - 1:
+                self.boundary = state.out
             mess = state.verbalise()
             if mess:
                 self.logger.info(mess)
@@ -165,12 +204,104 @@ class TFNet(FlagIO):
         self.top = state
         self.out = tf.identity(state.out, name='output')
 
+    def _forward(self, inp):
+        """Build another copy of the net on inp sharing its variables"""
+        state = identity(inp)
+        roof = self.num_layer - self.ntrain
+        for i, layer in enumerate(self.darknet.layers):
+            state = op_create(layer, state, i, roof, self.feed)
+        return state.out
+
+    def _tower_device(self, k):
+        if self.flags.towers < 2 or self.flags.gpu > 0.0:
+            return None
+        return '/cpu:{}'.format(k)
+
+    @staticmethod
+    def _split(tensor, k, n, rows=False):
+        """
+        returns every n-th sample of a batch starting at k, or for rows
+        of (sample, ...) the rows of those samples renumbered from 0
+        """
+        if not rows:
+            return tf.gather(tensor, tf.range(k, tf.shape(tensor)[0], n))
+        mine = tf.boolean_mask(tensor, tf.equal(
+            tf.floormod(tensor[:, 0], n), k))
+        return tf.concat([tf.floor(mine[:, :1] / n), mine[:, 1:]], 1)
+
+    def build_towers(self):
+        """
+        Builds flags.towers copies of the net and the loss, each taking
+        every towers-th sample of the batch and pinned to its own CPU
+        returns the loss of each tower weighted by its share of the batch
+        """
+        fw = self.framework
+        n = self.flags.towers
+        if self.flags.batch < n:
+            self.flags.error = 'A batch of {} leaves some of the {} towers ' \
+                               'without samples'.format(self.flags.batch, n)
+            self.logger.error(self.flags.error)
+            self.send_flags()
+            raise ValueError(self.flags.error)
+        self.logger.info('Building {} towers'.format(n))
+        batch = tf.cast(tf.shape(self.inp)[0], tf.float32)
+        losses, tower_ph = list(), list()
+        for k in range(n):
+            with tf.device(self._tower_device(k)):
+                with tf.variable_scope(tf.get_variable_scope(),
+                                       reuse=tf.AUTO_REUSE):
+                    with tf.name_scope('tower_{}'.format(k)):
+                        inp = self._split(self.inp, k, n)
+                        out = self._forward(inp)
+                        # fw.loss is the previous tower's loss tensor now
+                        type(fw).loss(fw, out)
+                        # the loss is a mean over the tower's samples, so
+                        # weighting it by their share of the batch sums
+                        # the towers up to the mean over the whole batch.
+                        # A short batch can still leave a tower empty and
+                        # the mean of nothing is NaN.
+                        rows = tf.shape(inp)[0]
+                        loss = tf.where(rows > 0, fw.loss,
+                                        tf.zeros_like(fw.loss))
+                        losses.append(
+                            loss * tf.cast(rows, tf.float32) / batch)
+            tower_ph.append(fw.placeholders)
+
+        # one set of placeholders for the whole batch feeds every tower
+        fw.placeholders = {key: tf.placeholder(ph.dtype, ph.shape)
+                           for key, ph in tower_ph[0].items()}
+        for k, placeholders in enumerate(tower_ph):
+            keys = sorted(placeholders)
+            with tf.device(self._tower_device(k)):
+                graph_editor.reroute_ts(
+                    [self._split(fw.placeholders[key], k, n, key == 'objs')
+                     for key in keys],
+                    [placeholders[key] for key in keys])
+        fw.loss = tf.add_n(losses)
+        return losses
+
+    @staticmethod
+    def _sum_gradients(tower_grads):
+        """
+        Sum each variable's gradient over the towers, whose losses are
+        already weighted by their share of the batch
+        """
+        if len(tower_grads) == 1:
+            return tower_grads[0]
+        summed = list()
+        for pairs in zip(*tower_grads):
+            grads = [grad for grad, _ in pairs if grad is not None]
+            grad = tf.add_n(grads) if grads else None
+            summed.append((grad, pairs[0][1]))
+        return summed
+
     def setup_meta_ops(self):
         cfg = dict({
             'allow_soft_placement': False,
             'log_device_placement': False
         })
 
+        env = dict()  # set only while the session creates its devices
         utility = min(self.flags.gpu, 1.)
         if utility > 0.0:
             self.logger.info('GPU mode with {} usage'.format(utility))
@@ -180,21 +311,52 @@ class TFNet(FlagIO):
         else:
             self.logger.info('Running entirely on CPU')
             cfg['device_count'] = {'GPU': 0}
+            if self.flags.train and self.flags.towers > 1:
+                # one CPU device per tower, each with its own share of
+                # the cores instead of one global pool
+                towers = self.flags.towers
+                cfg['device_count']['CPU'] = towers
+                cfg['intra_op_parallelism_threads'] = max(
+                    1, (os.cpu_count() or 1) // towers)
+                # TF reads this once per process, when the first session
+                # creates its CPU devices, so later sessions keep whatever
+                # the first one saw
+                env['TF_OVERRIDE_GLOBAL_THREADPOOL'] = '1'
+
+        threads = self.threading()
+        if threads is not None:
+            self.logger.info('Using {} intra and {} inter op threads'.format(
+                *threads))
+            cfg['intra_op_parallelism_threads'] = threads[0]
+            cfg['inter_op_parallelism_threads'] = threads[1]
 
         if self.flags.train:
             self.build_train_op()
 
         if self.flags.summary:
             self.summary_op = tf.summary.merge_all()
+            self.histogram_op = tf.summary.merge_all(HISTOGRAMS)
             self.writer = tf.summary.FileWriter(
                 self.flags.summary + self.flags.project_name)
 
-        self.sess = tf.Session(config=tf.ConfigProto(**cfg))
+        saved = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        try:
+            self.sess = tf.Session(config=tf.ConfigProto(**cfg))
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
         # uncomment next 3 lines to enable tb debugger
         # from tensorflow.python import debug as tf_debug
         # self.sess = tf_debug.TensorBoardDebugWrapperSession(self.sess,
         #                                                     'localhost:6064')
         self.sess.run(tf.global_variables_initializer())
+        if self.flags.train:
+            # checkpoint shadows and gradient accumulators
+            self.sess.run(tf.local_variables_initializer())
 
         if not self.ntrain:
             return
@@ -251,202 +413,478 @@ class TFNet(FlagIO):
         self.flags.progress = 90
         self.flags.done = True
 
-    def _save_ckpt(self, step, loss_profile):
+    def _save_ckpt(self, step, loss_log, state=None):
+        """
+        Snapshot the variables and write them to a checkpoint on a
+        background thread, waiting for the previous write if needed.
+        The loss history lives in loss_log, read_profile in
+        utils.losslog rebuilds the old <model>-<step>.profile from it.
+        state is written next to the checkpoint as <ckpt>.state.
+        """
         file = '{}-{}{}'
         model = self.meta['name']
-
-        profile = file.format(model, step, '.profile')
-        profile = os.path.join(self.flags.backup, profile)
-        with open(profile, 'wb') as profile_ckpt:
-            pickle.dump(loss_profile, profile_ckpt)
+        loss_log.flush()
+        self._join_ckpt()
 
         ckpt = file.format(model, step, '')
         ckpt = os.path.join(self.flags.backup, ckpt)
-        self.logger.info('Checkpoint at step {}'.format(step))
-        self.saver.save(self.sess, ckpt)
+        self.sess.run(self.snapshot_op)
+        self.ckpt_thread = Thread(target=self._write_ckpt,
+                                  args=(ckpt, step, state))
+        self.ckpt_thread.start()
+
+    def _write_ckpt(self, ckpt, step, state=None):
+        try:
+            self.snapshot_saver.save(self.sess, ckpt)
+            if state is not None:
+                temp = '{}.state.{}.tmp'.format(ckpt, os.getpid())
+                with open(temp, 'w') as f:
+                    json.dump(state, f, indent=2, sort_keys=True)
+                os.replace(temp, ckpt + '.state')
+            # forget the states of checkpoints the saver let go of
+            prefix = ckpt.rsplit('-', 1)[0]
+            for old in glob.glob('{}-*.state'.format(prefix)):
+                old_ckpt = old[:-len('.state')]
+                if old_ckpt[len(prefix) + 1:].isdigit() and \
+                        not os.path.exists(old_ckpt + '.index'):
+                    os.remove(old)
+            self.logger.info('Checkpoint at step {}'.format(step))
+        except Exception as e:
+            self.ckpt_error = e
+
+    def _resume(self):
+        """
+        returns the seed ordering the data, the (epoch, batch) to start
+        from and the loss moving average to carry on with, taken from
+        the state saved with the loaded checkpoint if flags.resume is set
+        """
+        fresh = (self.flags.seed or int(np.random.randint(1, 2 ** 31)),
+                 (0, 0), None)
+        if not self.flags.resume:
+            return fresh
+        path = os.path.join(self.flags.backup, '{}-{}.state'.format(
+            self.meta['name'], self.flags.load))
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            self.logger.warning('No training state in {}, starting from '
+                                'the first batch'.format(path))
+            return fresh
+        if self.flags.tfdata:
+            self.logger.warning('The tf.data pipeline can not skip ahead, '
+                                'only the loss average is resumed')
+            return state['seed'], (0, 0), state['loss_mva']
+        # a changed batch size keeps the frames seen, not the batches
+        batch = state['batch'] * state['batch_size'] // self.flags.batch
+        self.logger.info('Resuming at batch {} of epoch {}'.format(
+            batch + 1, state['epoch'] + 1))
+        return state['seed'], (state['epoch'], batch), state['loss_mva']
+
+    def _join_ckpt(self):
+        """Wait for a pending checkpoint and raise anything it raised"""
+        if self.ckpt_thread is not None:
+            self.ckpt_thread.join()
+            self.ckpt_thread = None
+        if self.ckpt_error is not None:
+            e, self.ckpt_error = self.ckpt_error, None
+            self.flags.error = str(e)
+            self.logger.error(str(e))
+            self.send_flags()
+            raise e
+
+    def _summaries(self, step):
+        """
+        returns the summary ops due at step: scalars every summary_every
+        and gradient histograms every histogram_every steps (0 for never)
+        """
+        due = list()
+        for op, every in [(self.summary_op, self.flags.summary_every),
+                          (self.histogram_op, self.flags.histogram_every)]:
+            if op is not None and every > 0 and not step % every:
+                due.append(op)
+        return due
 
     def train(self):
         self.io_flags()
+        # stop requests and progress go through the control slot,
+        # the flags file is only written every progress_interval seconds
+        control = self.open_control()
+        published = time.time()
         loss_ph = self.framework.placeholders
-        loss_mva = None
-        profile = list()
+        seed, start, loss_mva = self._resume()
+        epoch, done = start
+        loss_log = LossLog(os.path.join(
+            self.flags.backup, '{}.losslog'.format(self.meta['name'])))
         goal = None
         total_steps = None
         step_pad = None
-        batches = self.framework.shuffle()
+        features = self.feature_cache() if self.flags.feature_cache else None
+        if self.flags.tfdata:
+            # batches come from the pipeline until it runs out
+            batches = itertools.repeat((None, None))
+        elif features is not None:
+            # batches of frozen layer outputs are fed past those layers
+            batches = self.framework.shuffle_features(
+                features, self._extract, start, seed)
+        else:
+            batches = self.framework.shuffle(start, seed)
+        inp = self.inp if features is None else self.boundary
         loss_op = self.framework.loss
+        # with accumulation every batch is a micro-batch and a step is
+        # only taken, logged and counted for every accumulate of them
+        accumulate = max(1, self.flags.accumulate)
+        save_every = max(1, self.flags.save // (self.flags.batch * accumulate))
+        micro_losses = list()
+        ckpt = 0
 
-        for i, (x_batch, datum) in enumerate(batches):
-            self.flags = self.read_flags()
-            feed_dict = {
-                loss_ph[key]: datum[key]
-                for key in loss_ph}
-            feed_dict[self.inp] = x_batch
-            feed_dict.update(self.feed)
-            fetches = [self.train_op, loss_op]
-            if self.flags.summary:
-                fetches.append(self.summary_op)
-
-            # Start the session
-            try:
-                fetched = self.sess.run(fetches, feed_dict)
-            except tf.errors.OpError as oe:
-                if oe.error_code == 3 and "nan" in oe.message.lower():
+        try:
+            for i, (x_batch, datum) in enumerate(batches):
+                feed_dict = dict(self.feed)
+                if x_batch is not None:
+                    feed_dict.update({
+                        loss_ph[key]: datum[key]
+                        for key in loss_ph})
+                    feed_dict[inp] = x_batch
+                applying = not (i + 1) % accumulate
+                fetches = [self.train_op if applying else self.accum_op,
+                           loss_op]
+                step_now = self.flags.load + (i + 1) // accumulate
+                if self.flags.summary and applying:
+                    fetches += self._summaries(step_now)
+
+                # Start the session
+                try:
+                    fetched = self.sess.run(fetches, feed_dict)
+                except tf.errors.OutOfRangeError:
+                    break
+                except tf.errors.OpError as oe:
+                    if oe.error_code == 3 and "nan" in oe.message.lower():
+                        try:
+                            raise GradientNaN(self.flags)
+                        except GradientNaN as e:
+                            form = "{}\nOriginal Tensorflow Error: {}"
+                            self.flags.error = form.format(str(e), oe.message)
+                            self.logger.error(str(e))
+                            self.send_flags()
+                            raise
+                    self.flags.error = str(oe.message)
+                    self.send_flags()
+                    raise
+                loss = fetched[1]
+
+                # single shot calculations
+                if not i:
+                    # the data source settled the dataset and batch size
+                    self.flags.size = self.framework.flags.size
+                    self.flags.batch = self.framework.flags.batch
+                    batch_per_epoch = max(
+                        1, self.flags.size // self.flags.batch)
+                    self.logger.info(train_stats.format(
+                        self.flags.lr, self.flags.batch,
+                        self.flags.epoch, self.flags.save
+                    ))
+                    if accumulate > 1:
+                        self.logger.info(
+                            'Accumulating {} micro-batches per step'.format(
+                                accumulate))
+                    count = (epoch * batch_per_epoch + done) * self.flags.batch
+                if not goal:
+                    goal = self.flags.size * self.flags.epoch
+                if not total_steps:
+                    total_steps = goal // (self.flags.batch * accumulate)
+                    step_pad = len(str(total_steps))
+                if not loss_mva:
+                    loss_mva = loss
+
+                # Check for exploding/vanishing gradient
+                if math.isnan(loss) or math.isinf(loss):
                     try:
                         raise GradientNaN(self.flags)
                     except GradientNaN as e:
-                        form = "{}\nOriginal Tensorflow Error: {}"
-                        self.flags.error = form.format(str(e), oe.message)
+                        self.flags.error = str(e)
                         self.logger.error(str(e))
                         self.send_flags()
                         raise
-                self.flags.error = str(oe.message)
-                self.send_flags()
-                raise
-            loss = fetched[1]
-
-            # single shot calculations
-            if not i:
-                self.logger.info(train_stats.format(
-                    self.flags.lr, self.flags.batch,
-                    self.flags.epoch, self.flags.save
-                ))
-                count = 0
-            if not goal:
-                goal = self.flags.size * self.flags.epoch
-            if not total_steps:
-                total_steps = goal // self.flags.batch
-                step_pad = len(str(total_steps))
-            if not loss_mva:
-                loss_mva = loss
-
-            # Check for exploding/vanishing gradient
-            if math.isnan(loss) or math.isinf(loss):
-                try:
-                    raise GradientNaN(self.flags)
-                except GradientNaN as e:
-                    self.flags.error = str(e)
-                    self.logger.error(str(e))
-                    self.send_flags()
-                    raise
 
-            loss_mva = .9 * loss_mva + .1 * loss
-            step_now = self.flags.load + i + 1
+                loss_mva = .9 * loss_mva + .1 * loss
+                micro_losses.append(loss)
+
+                if applying:
+                    assign_op = self.global_step.assign(step_now)
+                    self.sess.run(assign_op)
+
+                # Calculate and send progress
+                # noinspection PyUnboundLocalVariable
+                count += self.flags.batch
+                done += 1
+                # noinspection PyUnboundLocalVariable
+                if done == batch_per_epoch:
+                    epoch, done = epoch + 1, 0
+                self.flags.progress = count / goal * 100
+                control.step = step_now
+                control.progress = self.flags.progress
+                if time.time() - published >= self.flags.progress_interval:
+                    published = time.time()
+                    self.send_flags()
 
-            assign_op = self.global_step.assign(step_now)
-            self.sess.run(assign_op)
+                for summary in fetched[2:]:
+                    self.writer.add_summary(summary, step_now)
+
+                if applying:
+                    # one line per step taken, with the loss over all
+                    # of its micro-batches
+                    step_loss = np.mean(micro_losses)
+                    form = 'step {} - loss {} - moving ave loss {} - ' \
+                           'progress {}'
+                    self.logger.info(
+                        form.format(str(step_now).zfill(step_pad),
+                                    format(step_loss, '.14f'),
+                                    format(loss_mva, '.14f'),
+                                    "{:=6.2f}%".format(self.flags.progress)))
+                    loss_log.append(step_now, step_loss, loss_mva)
+                    micro_losses = list()
+
+                    ckpt = ((i + 1) // accumulate) % save_every
+                    # where the data order stands, for --resume
+                    state = {'step': step_now, 'epoch': epoch, 'batch': done,
+                             'batch_size': self.flags.batch, 'seed': seed,
+                             'loss_mva': float(loss_mva)}
+                    args = [step_now, loss_log, state]
+
+                    if not ckpt:
+                        self._save_ckpt(*args)
+
+                if control.kill:
+                    self.logger.info(
+                        'Stop requested at step {}'.format(step_now))
+                    break
 
-            # Calculate and send progress
+            if micro_losses:
+                self.logger.info(
+                    'Dropped the gradients of {} micro-batch(es) short of '
+                    'a step'.format(len(micro_losses)))
             # noinspection PyUnboundLocalVariable
-            count += self.flags.batch
-            self.flags.progress = count / goal * 100
-            self.io_flags()
-
-            if self.flags.summary:
-                self.writer.add_summary(fetched[2], step_now)
+            if ckpt:
+                # noinspection PyUnboundLocalVariable
+                self._save_ckpt(*args)
+            self._join_ckpt()
+        finally:
+            loss_log.close()
+        self.send_flags()
 
-            form = 'step {} - loss {} - moving ave loss {} - progress {}'
-            self.logger.info(
-                form.format(str(step_now).zfill(step_pad),
-                            format(loss, '.14f'),
-                            format(loss_mva, '.14f'),
-                            "{:=6.2f}%".format(self.flags.progress)))
-            profile += [(loss, loss_mva)]
+    def _frozen_key(self):
+        """returns a digest of the model, input size and frozen weights"""
+        roof = self.num_layer - self.ntrain
+        digest = hashlib.sha1('{}|{}|{}'.format(
+            self.meta['name'], roof, self.meta['inp_size']).encode())
+        for layer in self.darknet.layers[:roof]:
+            for name in sorted(layer.w):
+                value = layer.w[name]
+                if isinstance(value, np.ndarray):
+                    digest.update(name.encode())
+                    digest.update(np.ascontiguousarray(value).data)
+        return digest.hexdigest()[:16]
+
+    def _feeds_past_boundary(self):
+        """True if the output depends on the input only via the boundary"""
+        seen, todo = set(), [self.out.op]
+        while todo:
+            op = todo.pop()
+            if op is self.boundary.op or op in seen:
+                continue
+            if op is self.inp.op:
+                return False
+            seen.add(op)
+            todo += [t.op for t in op.inputs]
+        return True
 
-            ckpt = (i + 1) % (self.flags.save // self.flags.batch)
-            args = [step_now, profile]
+    def _extract(self, x_batch):
+        """returns the frozen layers' output for a batch of frames"""
+        return self.sess.run(self.boundary, {self.inp: x_batch})
 
-            if not ckpt:
-                self._save_ckpt(*args)
-
-        # noinspection PyUnboundLocalVariable
-        if ckpt:
-            # noinspection PyUnboundLocalVariable
-            self._save_ckpt(*args)
+    def feature_cache(self):
+        """
+        returns the FeatureCache of the frozen layers' outputs to train
+        the rest of the net from, or None if they can't stand in for
+        the frames, in which case training falls back to the frames
+        """
+        reason = None
+        if self.boundary is None:
+            reason = 'every layer is trained'
+        elif self.flags.tfdata or self.flags.towers > 1:
+            reason = 'it does not work with --tfdata or --towers'
+        elif not self._feeds_past_boundary():
+            reason = 'a trained layer reads from a frozen layer before ' \
+                     'the last one'
+        if reason is not None:
+            self.logger.warning('Not caching frozen layer outputs, {}'
+                                .format(reason))
+            return None
+        self.logger.info('Training the last {} layer(s) from cached outputs '
+                         'of the first {} without augmentation'.format(
+                             self.ntrain, self.num_layer - self.ntrain))
+        root = self.flags.shards or self.flags.dataset
+        shape = self.boundary.shape.as_list()[1:]
+        return FeatureCache(root, self._frozen_key(), shape)
 
     def return_predict(self, im):
-        assert isinstance(im, np.ndarray), \
-            'Image is not a np.ndarray'
-        h, w, _ = im.shape
-        im = self.framework.resize_input(im)
-        this_inp = np.expand_dims(im, 0)
+        return self.return_predict_batch([im])[0]
+
+    def return_predict_batch(self, images):
+        """
+        Forwards a list of images, of any sizes, in a single session run
+        returns a list of detections for each image, in the order given
+        """
+        for im in images:
+            assert isinstance(im, np.ndarray), \
+                'Image is not a np.ndarray'
+        if not len(images):
+            return list()
+        sizes = [im.shape[:2] for im in images]
+        this_inp = np.stack([self.framework.resize_input(im)
+                             for im in images])
         feed_dict = {self.inp: this_inp}
 
-        out = self.sess.run(self.out, feed_dict)[0]
-        boxes = self.framework.findboxes(out)
+        out = self.sess.run(self.out, feed_dict)
         threshold = self.flags.threshold
-        boxesInfo = list()
-        for box in boxes:
-            tmpBox = self.framework.process_box(box, h, w, threshold)
-            if tmpBox is None:
-                continue
-            boxesInfo.append({
-                "label": tmpBox[4],
-                "confidence": tmpBox[6],
-                "topleft": {
-                    "x": tmpBox[0],
-                    "y": tmpBox[2]},
-                "bottomright": {
-                    "x": tmpBox[1],
-                    "y": tmpBox[3]}
-            })
-        return boxesInfo
+        predictions = list()
+        for net_out, (h, w) in zip(out, sizes):
+            boxes = self.framework.findboxes(net_out)
+            boxesInfo = list()
+            for tmpBox in self.framework.process_box(boxes, h, w, threshold):
+                boxesInfo.append({
+                    "label": tmpBox[4],
+                    "confidence": tmpBox[6],
+                    "topleft": {
+                        "x": tmpBox[0],
+                        "y": tmpBox[2]},
+                    "bottomright": {
+                        "x": tmpBox[1],
+                        "y": tmpBox[3]}
+                })
+            predictions.append(boxesInfo)
+        return predictions
 
     def predict(self):
         self.flags = self.read_flags()
         inp_path = self.flags.imgdir
-        all_inps = os.listdir(inp_path)
-        all_inps = [i for i in all_inps if self.framework.is_inp(i)]
-        if not all_inps:
+        # the directory is walked lazily, as the first stage asks for more
+        all_inps = (entry.path for entry in os.scandir(inp_path)
+                    if entry.is_file() and self.framework.is_inp(entry.name))
+        first = next(all_inps, None)
+        if first is None:
             msg = 'Failed to find any images in {} .'
             exit('Error: {}'.format(msg.format(inp_path)))
 
-        batch = min(self.flags.batch, len(all_inps))
-
-        # predict in batches
-        n_batch = int(math.ceil(len(all_inps) / batch))
-        for j in range(n_batch):
-            self.logger.info(range(n_batch))
-            from_idx = j * batch
-            to_idx = min(from_idx + batch, len(all_inps))
-
-            # collect images input in the batch
-            this_batch = all_inps[from_idx:to_idx]
-            inp_feed = pool.map(lambda inp: (
-                np.expand_dims(self.framework.preprocess(
-                    os.path.join(inp_path, inp)), 0)), this_batch)
-
-            # Feed to the net
-            feed_dict = {self.inp: np.concatenate(inp_feed, 0)}
-            self.logger.info('Forwarding {} inputs ...'.format(len(inp_feed)))
-            start = time.time()
-            out = self.sess.run(self.out, feed_dict)
-            stop = time.time()
-            last = stop - start
-            self.logger.info('Total time = {}s / {} inps = {} ips'.format(
-                last, len(inp_feed), len(inp_feed) / last))
-
-            # Post processing
-            self.logger.info(
-                'Post processing {} inputs ...'.format(len(inp_feed)))
-            start = time.time()
-            pool.map(lambda p: (lambda i, prediction:
-                                self.framework.postprocess(
-                                    prediction,
-                                    os.path.join(inp_path, this_batch[i])))(*p),
-                     enumerate(out))
-            stop = time.time()
-            last = stop - start
-
-            # Timing
-            self.logger.info('Total time = {}s / {} inps = {} ips'.format(
-                last, len(inp_feed), len(inp_feed) / last))
+        batch = max(self.flags.batch, 1)
+        workers = os.cpu_count() or 1
+
+        def read(inp):
+            # the handle keeps what preprocess decodes for postprocess
+            handle = ImageHandle(inp)
+            return handle, self.framework.preprocess(handle)
+
+        def forward(inps):
+            paths, feed = zip(*inps)
+            out = self.sess.run(self.out, {self.inp: np.stack(feed)})
+            return list(zip(paths, out))
+
+        # reading, the net and post processing all run at once
+        stages = [
+            Stage('preprocess', read, workers=workers),
+            Stage('forward', forward, batch=batch),
+            Stage('postprocess',
+                  lambda p: self.framework.postprocess(p[1], p[0]),
+                  workers=workers)]
+        pipeline = Pipeline(stages, depth=batch * max(self.flags.prefetch, 1))
+        self.logger.info('Predicting in batches of {} ...'.format(batch))
+        n = 0
+        for n, _ in enumerate(pipeline(itertools.chain([first], all_inps)),
+                              1):
+            if n % batch == 0:
+                self.logger.info('{} inputs done'.format(n))
+
+        # Timing
+        self.logger.info('Total time = {}s / {} inps = {} ips'.format(
+            pipeline.wall, n, n / pipeline.wall))
+        for stage in stages:
+            self.logger.info('{} = {}s busy / {} inps = {} ips'.format(
+                stage.name, stage.busy, stage.items, stage.throughput()))
+
+    def threading(self):
+        """
+        returns (intra, inter) op threads for flags.threads or None for
+        tensorflow's defaults, tuning them first if asked to
+        """
+        if self.flags.threads not in ('auto', 'tune'):
+            return thread_profile(self.flags.threads)
+        key = '{}@{}'.format(self.meta['name'], socket.gethostname())
+        try:
+            with open(self.flags.threads_file) as f:
+                tuned = json.load(f)
+        except (OSError, ValueError):
+            tuned = dict()
+        if self.flags.threads == 'tune' or key not in tuned:
+            tuned[key] = self.autotune()
+            temp = '{}.{}.tmp'.format(self.flags.threads_file, os.getpid())
+            with open(temp, 'w') as f:
+                json.dump(tuned, f, indent=2, sort_keys=True)
+            os.replace(temp, self.flags.threads_file)
+        best = tuned[key]
+        if not self.flags.train:
+            self.flags.batch = best['batch']
+        return best['intra'], best['inter']
+
+    def autotune(self, passes=3):
+        """
+        Times forward passes of the net at several thread and batch size
+        combinations, returns the one with the most images per second.
+        TF sizes the thread pools of a process once, with its first
+        session, so every combination is timed in a process of its own.
+        """
+        cores = os.cpu_count() or 1
+        intras = sorted({1, 2, 4, cores // 4, cores // 2, cores} - {0})
+        batches = sorted({1, self.flags.batch, 2 * self.flags.batch})
+        init = tf.global_variables_initializer()
+        graph_def = self.graph.as_graph_def().SerializeToString()
+        names = init.name, self.inp.name, self.out.name
+        best = None
+        for intra in intras:
+            for inter in (1, 2):
+                config = dict(
+                    intra_op_parallelism_threads=intra,
+                    inter_op_parallelism_threads=inter,
+                    device_count={'GPU': int(self.flags.gpu > 0.0)})
+                rates = self._time_trial(graph_def, names, config, batches,
+                                         passes)
+                for batch, ips in zip(batches, rates):
+                    self.logger.info(
+                        'intra {} inter {} batch {}: {:.2f} ips'.format(
+                            intra, inter, batch, ips))
+                    if best is None or ips > best['ips']:
+                        best = {'intra': intra, 'inter': inter,
+                                'batch': batch, 'ips': ips}
+        self.logger.info('Tuned {}: {}'.format(self.meta['name'], best))
+        return best
+
+    @staticmethod
+    def _time_trial(*args):
+        """_time_threads in a fresh process"""
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            return pool.apply(_time_threads, args)
 
     def build_train_op(self):
         def _l2_norm(t):
             t = tf.sqrt(tf.reduce_sum(tf.pow(t, 2)))
             return t
-        self.framework.loss(self.out)
+        if self.flags.towers > 1:
+            losses = self.build_towers()
+        else:
+            self.framework.loss(self.out)
+            losses = [self.framework.loss]
+        if self.flags.tfdata:
+            self.reroute_inputs()
         self.logger.info('Building {} train op'.format(self.meta['model']))
         self.global_step = tf.Variable(0, trainable=False)
 
@@ -457,9 +895,10 @@ class TFNet(FlagIO):
         if self.flags.trainer == 'nesterov':
             kwargs.update({'use_nesterov': True})
 
-        # setup trainer
+        # setup trainer, the schedule counts applied (accumulated) updates
+        update_size = self.flags.batch * max(1, self.flags.accumulate)
         step_size = int(self.flags.step_size_coefficient *
-                        (len(self.framework.parse()) // self.flags.batch))
+                        (len(self.framework.parse()) // update_size))
         self.optimizer = self._TRAINER[self.flags.trainer](
             self.cyclic_learning_rate(
                 global_step=self.global_step,
@@ -469,8 +908,14 @@ class TFNet(FlagIO):
                 max_lr=self.flags.max_lr), **kwargs)
 
         # setup gradients
-        self.gradients, self.variables = zip(
-            *self.optimizer.compute_gradients(self.framework.loss))
+        tower_grads = list()
+        for k, loss in enumerate(losses):
+            with tf.device(self._tower_device(k)):
+                tower_grads.append(self.optimizer.compute_gradients(loss))
+        grads_and_vars = self._sum_gradients(tower_grads)
+        if self.flags.accumulate > 1:
+            grads_and_vars = self.build_accumulation(grads_and_vars)
+        self.gradients, self.variables = zip(*grads_and_vars)
         if self.flags.clip:
             self.gradients, _ = tf.clip_by_global_norm(self.gradients,
                                                     self.flags.clip_norm)
@@ -478,13 +923,78 @@ class TFNet(FlagIO):
         for grad, var in zip(self.gradients, self.variables):
             name = var.name.split('/')
             with tf.variable_scope(name[0] + '/'):
-                tf.summary.histogram("gradients/" + name[1], _l2_norm(grad))
+                tf.summary.histogram("gradients/" + name[1], _l2_norm(grad),
+                                     collections=[HISTOGRAMS])
                 # tf.summary.histogram("variables/" + name[1], _l2_norm(var))
 
         # create train op
         self.train_op = self.optimizer.apply_gradients(
             zip(self.gradients, self.variables),
             global_step=self.global_step)
+        if self.flags.accumulate > 1:
+            with tf.control_dependencies([self.train_op]):
+                self.train_op = tf.group(*[
+                    accum.assign(tf.zeros_like(accum))
+                    for accum in self.accumulators])
+        self.build_snapshot_op()
+
+    def build_accumulation(self, grads_and_vars):
+        """
+        Sums the gradients of flags.accumulate micro-batches in local
+        variables. accum_op adds one micro-batch's gradients, the pairs
+        returned add the last one and average them for apply_gradients
+        """
+        k = self.flags.accumulate
+        pairs = [(tf.convert_to_tensor(grad), var)
+                 for grad, var in grads_and_vars if grad is not None]
+        with tf.name_scope('accumulate'):
+            self.accumulators = [
+                tf.Variable(tf.zeros(var.shape, var.dtype.base_dtype),
+                            trainable=False, name=var.op.name,
+                            collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                for _, var in pairs]
+            self.accum_op = tf.group(*[
+                accum.assign_add(grad)
+                for accum, (grad, _) in zip(self.accumulators, pairs)])
+            return [(accum.assign_add(grad) / k, var)
+                    for accum, (grad, var) in zip(self.accumulators, pairs)]
+
+    def build_snapshot_op(self):
+        """
+        Shadow every variable with a local copy that snapshot_op fills
+        between steps, so a checkpoint can be written from the copies by
+        snapshot_saver, under the original names, while training goes on
+        """
+        variables = tf.global_variables()
+        with tf.name_scope('snapshot'):
+            self.shadows = [
+                tf.Variable(tf.zeros(var.shape, var.dtype.base_dtype),
+                            trainable=False, name=var.op.name,
+                            collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                for var in variables]
+            self.snapshot_op = tf.group(*[
+                shadow.assign(var)
+                for shadow, var in zip(self.shadows, variables)])
+        self.snapshot_saver = tf.train.Saver(
+            {var.op.name: shadow
+             for shadow, var in zip(self.shadows, variables)},
+            max_to_keep=self.flags.keep)
+        self.ckpt_thread = None
+        self.ckpt_error = None
+
+    def reroute_inputs(self):
+        """
+        Points every consumer of the input and loss placeholders at the
+        framework's tf.data pipeline so train steps need no feed_dict
+        """
+        loss_ph = self.framework.placeholders
+        keys = sorted(loss_ph)
+        inp, targets = self.framework.pipeline(self.inp, loss_ph)
+        graph_editor.reroute_ts([inp] + [targets[key] for key in keys],
+                                [self.inp] + [loss_ph[key] for key in keys])
+        # the pipeline settled the dataset size and batch size
+        self.flags.size = self.framework.flags.size
+        self.flags.batch = self.framework.flags.batch
 
     def load_from_ckpt(self):
         if self.flags.load < 0:  # load lastest ckpt
@@ -531,8 +1041,9 @@ class TFNet(FlagIO):
                                    'exec'))
         return cmdlist
 
-    def camera_exec(self, cmdlist):
+    def camera_exec(self, cmdlist, **names):
         localdict = {'cv2': cv2, 'os': os, 'self': self, 'c': None}
+        localdict.update(names)
         for cmd in cmdlist:
             exec(cmd, globals(), localdict)
 
@@ -561,18 +1072,24 @@ class TFNet(FlagIO):
             "global stopped{0}\n"
             "ret{0}, frame{0} = cap{0}.read()\n"
             "stopped{0} = False")
-        # get boxing and convert to 3-channel grayscale
-        get_boxing = self.camera_compile(
+        # convert to 3-channel grayscale and gather one batch of frames
+        get_inputs = self.camera_compile(
             'if ret{0}:\n'
-            '    global res{0}\n'
-            '    global new_frame{0}\n'
+            '    global frame{0}\n'
             '    if self.flags.grayscale:\n'
             '        frame{0} = cv2.cvtColor(frame{0}, cv2.COLOR_BGR2GRAY)\n'
             '        frame{0} = cv2.cvtColor(frame{0}, cv2.COLOR_GRAY2BGR)\n'
             '    frame{0} = np.asarray(frame{0})\n'
-            '    res{0} = self.return_predict(frame{0})\n'
+            '    frames[{0}] = frame{0}\n')
+        # get boxing from the batch predictions
+        get_boxing = self.camera_compile(
+            'if ret{0}:\n'
+            '    global res{0}\n'
+            '    global new_frame{0}\n'
+            '    res{0} = results[{0}]\n'
             '    new_frame{0} = self.draw_box(frame{0}, res{0})\n'
-            '    self.write_annotations(annotation{0}, res{0})\n')
+            '    self.write_annotations(annotation{0}, res{0},\n'
+            '                           time.time() - begin, begin)\n')
         init_writer = self.camera_compile(
             'global out{0}\n'
             'fourcc = cv2.VideoWriter_fourcc(*"mp4v")\n'
@@ -592,7 +1109,13 @@ class TFNet(FlagIO):
         timeout = begin + self.flags.timeout
         self.logger.info("Camera capture started on devices {}".format(self.flags.capdevs))
         while True:
-            for i in [get_frames, get_boxing, write_frame, show_frame]:
+            self.camera_exec(get_frames)
+            frames = dict()
+            self.camera_exec(get_inputs, frames=frames)
+            results = dict(zip(frames, self.return_predict_batch(
+                list(frames.values()))))
+            self.camera_exec(get_boxing, results=results, begin=begin)
+            for i in [write_frame, show_frame]:
                 t = Thread(target=self.camera_exec(i))
                 t.start()
                 t.join()
@@ -809,16 +1332,22 @@ class TFNet(FlagIO):
         self.logger.info('Annotating ' + INPUT_VIDEO)
 
         start_time = time.time()
-
-        while True:  # Capture frame-by-frame
-            FRAME_NUMBER += 1
-            ret, frame = cap.read()
-            if ret:
+        batch = max(self.flags.batch, 1)
+
+        ret = True
+        while ret:  # Capture up to a batch of frames at a time
+            frames = list()
+            while len(frames) < batch:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frames.append(np.asarray(frame))
+            for frame, result in zip(frames,
+                                     self.return_predict_batch(frames)):
+                FRAME_NUMBER += 1
                 self.flags.progress = round((100 * FRAME_NUMBER / total_frames), 0)
                 if FRAME_NUMBER % 10 == 0:
                     self.io_flags()
-                frame = np.asarray(frame)
-                result = self.return_predict(frame)
                 new_frame = self.draw_box(frame, result)
                 epoch = datetime(1970, 1, 1, 0, 0).timestamp()
                 time_elapsed = time.time() - start_time
@@ -827,9 +1356,7 @@ class TFNet(FlagIO):
                                        time_elapsed,
                                        epoch)
                 out.write(new_frame)
-                if self.flags.kill:
-                    break
-            else:
+            if self.flags.kill:
                 break
         # When everything done, release the capture
         out.release()
@@ -3,6 +3,7 @@ from . import yolov2
 from . import vanilla
 from ..utils.flags import FlagIO
 from os.path import basename
+import logging
 
 
 class framework(FlagIO, object):
@@ -20,11 +21,23 @@ class framework(FlagIO, object):
     def is_inp(self, file_name):
         return True
 
+    def __getstate__(self):
+        # only what batch assembly needs crosses into worker processes,
+        # log handlers and graph tensors cannot be pickled
+        return {'meta': self.meta, 'flags': self.flags}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger(type(self).__name__)
+
 
 class YOLO(framework):
     constructor = yolo.constructor
     parse = yolo.data.parse
     shuffle = yolo.data.shuffle
+    shuffle_features = yolo.data.shuffle_features
+    assemble = yolo.data.assemble
+    pipeline = yolo.dataset.pipeline
     preprocess = yolo.predict.preprocess
     postprocess = yolo.predict.postprocess
     loss = yolo.train.loss
@@ -32,6 +45,12 @@ class YOLO(framework):
     profile = yolo.misc.profile
     # noinspection PyProtectedMember
     _batch = yolo.data._batch
+    # noinspection PyProtectedMember
+    _encode = yolo.data._encode
+    # noinspection PyProtectedMember
+    _targets = yolo.data._targets
+    # noinspection PyProtectedMember
+    _grid = yolo.data._grid
     resize_input = yolo.predict.resize_input
     findboxes = yolo.predict.findboxes
     process_box = yolo.predict.process_box
@@ -41,12 +60,21 @@ class YOLOv2(framework):
     constructor = yolo.constructor
     parse = yolo.data.parse
     shuffle = yolo.data.shuffle
+    shuffle_features = yolo.data.shuffle_features
+    assemble = yolo.data.assemble
+    pipeline = yolo.dataset.pipeline
     preprocess = yolo.predict.preprocess
     loss = yolov2.train.loss
     is_inp = yolo.misc.is_inp
     postprocess = yolov2.predict.postprocess
     # noinspection PyProtectedMember
-    _batch = yolov2.data._batch
+    _batch = yolo.data._batch
+    # noinspection PyProtectedMember
+    _encode = yolo.data._encode
+    # noinspection PyProtectedMember
+    _targets = yolov2.data._targets
+    # noinspection PyProtectedMember
+    _grid = yolov2.data._grid
     resize_input = yolo.predict.resize_input
     findboxes = yolov2.predict.findboxes
     process_box = yolo.predict.process_box
@@ -56,6 +84,8 @@ class YOLOv3(framework):
     constructor = yolo.constructor
     parse = yolo.data.parse
     shuffle = yolov2.data.shuffle
+    assemble = yolo.data.assemble
+    pipeline = yolo.dataset.pipeline
     preprocess = yolo.predict.preprocess
     # loss = yolov3.train.loss  # TODO: yolov3.train
     is_inp = yolo.misc.is_inp
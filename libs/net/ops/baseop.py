@@ -55,6 +55,8 @@ class BaseOp(object):
     def wrap_variable(self, var):
         """wrap layer.w into variables"""
         val = self.lay.w.get(var, None)
+        if val is not None and not isinstance(val, np.ndarray):
+            return  # already wrapped while building an earlier tower
         if val is None:
             shape = self.lay.wshape[var]
             args = [0., 1e-2, shape]
@@ -2,6 +2,7 @@ from . import train
 from . import predict
 from . import data
 from . import misc
+from . import dataset
 from ...utils.flags import FlagIO
 import numpy as np
 import time
@@ -44,3 +45,9 @@ def constructor(self, meta, flags):
     # over-ride the threshold in meta if flags has it.
     if flags.threshold > 0.0:
         self.meta['thresh'] = flags.threshold
+
+    # NMS overlap from flags, else the cfg's nms=, else 0.4
+    if flags.nms_iou > 0.0:
+        self.meta['nms_iou'] = flags.nms_iou
+    self.meta.setdefault('nms_iou', self.meta.get('nms', .4))
+    self.meta['nms_mode'] = flags.nms_mode
@@ -1,99 +1,245 @@
 from ...utils.pascal_voc_clean_xml import pascal_voc_clean_xml
-from numpy.random import permutation as perm
+from ...utils.feeder import BatchFeeder
+from ...utils.imcache import ImageCache
+from ...utils.shards import ShardReader
+from ...utils.featcache import FeatureCache
 from .predict import preprocess
 # from .misc import show
-from copy import deepcopy
+import itertools
 import pickle
 import numpy as np
+import cv2
 import os 
 
 
 def parse(self, exclusive = False):
     meta = self.meta
     ext = '.parsed'
+    if self.flags.shards:
+        return _parse_shards(self)
     ann = self.flags.annotation
     if not os.path.isdir(ann):
         msg = 'Annotation directory not found {} .'
         exit('Error: {}'.format(msg.format(ann)))
     self.logger.info('{} parsing {}'.format(meta['model'], ann))
-    dumps = pascal_voc_clean_xml(self, ann, meta['labels'], exclusive)
+    index = os.path.join(ann, '.annotations' + ext)
+    dumps = pascal_voc_clean_xml(self, ann, meta['labels'], exclusive, index)
     return dumps
 
 
-def _batch(self, chunk):
+def _parse_shards(self):
+    """
+    Takes the annotations stored with the shards in flags.shards
+    returns them in the same form as parse, keeping only known labels
+    """
+    labels = self.meta['labels']
+    self.logger.info('{} reading shards in {}'.format(
+        self.meta['model'], self.flags.shards))
+    dumps = list()
+    for jpg, (w, h, allobj) in ShardReader(self.flags.shards).records():
+        allobj = [list(obj) for obj in allobj if obj[0] in labels]
+        dumps += [[jpg, [w, h, allobj]]]
+    self.logger.info('Dataset size: {}'.format(len(dumps)))
+    return dumps
+
+
+def _compact(allobj, labels, w, h, W, H):
+    """
+    Takes preprocessed objects of a w x h image
+    returns rows of [cell, class, x, y, sqrt(w), sqrt(h)]
+    relative to a W x H grid, or None if a centre is off the grid.
+    Only the last object of each cell is kept since it is the one
+    that ends up in the loss targets.
+    """
+    if not allobj:
+        return np.zeros((0, 6))
+    boxes = np.array([obj[1:5] for obj in allobj], dtype=np.float64)
+    cellx = 1. * w / W
+    celly = 1. * h / H
+    cx = .5 * (boxes[:, 0] + boxes[:, 2]) / cellx
+    cy = .5 * (boxes[:, 1] + boxes[:, 3]) / celly
+    if np.any(cx >= W) or np.any(cy >= H):
+        return None
+    objs = np.empty((len(allobj), 6))
+    objs[:, 0] = np.floor(cy) * W + np.floor(cx)
+    objs[:, 1] = [labels.index(obj[0]) for obj in allobj]
+    objs[:, 2] = cx - np.floor(cx)
+    objs[:, 3] = cy - np.floor(cy)
+    objs[:, 4] = np.sqrt((boxes[:, 2] - boxes[:, 0]) / w)
+    objs[:, 5] = np.sqrt((boxes[:, 3] - boxes[:, 1]) / h)
+    _, last = np.unique(objs[::-1, 0], return_index=True)
+    return objs[np.sort(len(objs) - 1 - last)]
+
+
+def _scatter(objs, HW, B, W, H):
+    """
+    Takes a list of compact object arrays, one per sample
+    returns sample, cell & class indices of every object
+    and the loss targets shared by the yolo and yolov2 losses
+    """
+    n = len(objs)
+    rows = np.concatenate([np.zeros((0, 6))] + list(objs))
+    s = np.repeat(np.arange(n), [len(o) for o in objs])
+    cell = rows[:, 0].astype(np.intp)
+    cls = rows[:, 1].astype(np.intp)
+
+    xy, sqwh = rows[:, 2:4], rows[:, 4:6]
+    half = sqwh ** 2 * .5 * np.array([W, H])
+    upleft, botright = xy - half, xy + half
+    wh = botright - upleft
+
+    confs = np.zeros([n, HW, B], np.float32)
+    coord = np.zeros([n, HW, B, 4], np.float32)
+    areas = np.zeros([n, HW, B], np.float32)
+    upleft_ = np.zeros([n, HW, B, 2], np.float32)
+    botright_ = np.zeros([n, HW, B, 2], np.float32)
+    confs[s, cell] = 1.
+    coord[s, cell] = rows[:, None, 2:6]
+    areas[s, cell] = (wh[:, 0] * wh[:, 1])[:, None]
+    upleft_[s, cell] = upleft[:, None]
+    botright_[s, cell] = botright[:, None]
+
+    return s, cell, cls, {
+        'confs': confs, 'coord': coord,
+        'areas': areas, 'upleft': upleft_,
+        'botright': botright_
+    }
+
+
+def _frame(self, jpg, allobj, w, h):
+    """
+    Takes a frame name and its parsed objects
+    returns the frame's cached pixels if flags.frame_cache is set,
+    otherwise its path, along with the frame's width and height.
+    Objects are rescaled in place if the cached frame was shrunk.
+    """
+    path = os.path.join(self.flags.dataset, jpg)
+    if not self.flags.frame_cache:
+        return path, w, h
+    if getattr(self, 'imcache', None) is None:
+        self.imcache = ImageCache(self.flags.dataset,
+                                  self.flags.frame_cache_side)
+    im = self.imcache.get(jpg)
+    if im is None:
+        return path, w, h
+    ch, cw = im.shape[:2]
+    if (cw, ch) != (w, h):
+        sx, sy = 1. * cw / w, 1. * ch / h
+        for obj in allobj:
+            obj[1], obj[3] = obj[1] * sx, obj[3] * sx
+            obj[2], obj[4] = obj[2] * sy, obj[4] * sy
+    return im, cw, ch
+
+
+def _decode(self, chunk, allobj, w, h):
+    """
+    Takes a chunk of parsed annotations, read from shards
+    if it carries the encoded image as a third item
+    returns the frame or its path along with its width and height
+    """
+    if len(chunk) < 3:
+        return _frame(self, chunk[0], allobj, w, h)
+    im = cv2.imdecode(np.frombuffer(chunk[2], np.uint8), cv2.IMREAD_COLOR)
+    return im, w, h
+
+
+def _grid(self):
+    """returns the width and height of the net's output grid"""
+    S = self.meta['side']
+    return S, S
+
+
+def _encode(self, chunk, augment=True):
     """
     Takes a chunk of parsed annotations
-    returns value for placeholders of net's 
-    input & loss layer correspond to this chunk
+    returns the preprocessed image, augmented unless told
+    otherwise, and its compact object array,
+    or None, None if it can't be used
     """
     meta = self.meta
-    S, B = meta['side'], meta['num']
-    C, labels = meta['classes'], meta['labels']
+    W, H = self._grid()
 
     # preprocess
     jpg = chunk[0]; w, h, allobj_ = chunk[1]
-    allobj = deepcopy(allobj_)
-    path = os.path.join(self.flags.dataset, jpg)
-    img = self.preprocess(path, allobj)
-
-    # Calculate regression target
-    cellx = 1. * w / S
-    celly = 1. * h / S
-    for obj in allobj:
-        centerx = .5*(obj[1]+obj[3]) #xmin, xmax
-        centery = .5*(obj[2]+obj[4]) #ymin, ymax
-        cx = centerx / cellx
-        cy = centery / celly
-        if cx >= S or cy >= S: return None, None
-        obj[3] = float(obj[3]-obj[1]) / w
-        obj[4] = float(obj[4]-obj[2]) / h
-        obj[3] = np.sqrt(obj[3])
-        obj[4] = np.sqrt(obj[4])
-        obj[1] = cx - np.floor(cx) # centerx
-        obj[2] = cy - np.floor(cy) # centery
-        obj += [int(np.floor(cy) * S + np.floor(cx))]
-
-    # show(im, allobj, S, w, h, cellx, celly) # unit test
-
-    # Calculate placeholders' values
-    probs = np.zeros([S*S,C])
-    confs = np.zeros([S*S,B])
-    coord = np.zeros([S*S,B,4])
-    proid = np.zeros([S*S,C])
-    prear = np.zeros([S*S,4])
-    for obj in allobj:
-        probs[obj[5], :] = [0.] * C
-        probs[obj[5], labels.index(obj[0])] = 1.
-        proid[obj[5], :] = [1] * C
-        coord[obj[5], :, :] = [obj[1:5]] * B
-        prear[obj[5],0] = obj[1] - obj[3]**2 * .5 * S # xleft
-        prear[obj[5],1] = obj[2] - obj[4]**2 * .5 * S # yup
-        prear[obj[5],2] = obj[1] + obj[3]**2 * .5 * S # xright
-        prear[obj[5],3] = obj[2] + obj[4]**2 * .5 * S # ybot
-        confs[obj[5], :] = [1.] * B
-
-    # Finalise the placeholders' values
-    upleft   = np.expand_dims(prear[:,0:2], 1)
-    botright = np.expand_dims(prear[:,2:4], 1)
-    wh = botright - upleft; 
-    area = wh[:,:,0] * wh[:,:,1]
-    upleft   = np.concatenate([upleft] * B, 1)
-    botright = np.concatenate([botright] * B, 1)
-    areas = np.concatenate([area] * B, 1)
-
-    # value for placeholder at input layer
-    inp_feed_val = img
-    # value for placeholder at loss layer 
-    loss_feed_val = {
-        'probs': probs, 'confs': confs, 
-        'coord': coord, 'proid': proid,
-        'areas': areas, 'upleft': upleft, 
-        'botright': botright
-    }
+    allobj = [list(obj) for obj in allobj_]
+    im, w, h = _decode(self, chunk, allobj, w, h)
+    img = self.preprocess(im, allobj if augment else None)
 
-    return inp_feed_val, loss_feed_val
+    objs = _compact(allobj, meta['labels'], w, h, W, H)
+    if objs is None:
+        return None, None
+    return img, objs
+
+
+def _targets(self, objs):
+    """
+    Takes a list of compact object arrays
+    returns value for placeholders of net's
+    loss layer, batched in the same order
+    """
+    meta = self.meta
+    S, B, C = meta['side'], meta['num'], meta['classes']
+
+    s, cell, cls, feed = _scatter(objs, S*S, B, S, S)
+    probs = np.zeros([len(objs), S*S, C], np.float32)
+    proid = np.zeros([len(objs), S*S, C], np.float32)
+    probs[s, cell, cls] = 1.
+    proid[s, cell] = 1.
+    feed.update({'probs': probs, 'proid': proid})
+    return feed
+
+
+def _batch(self, chunk):
+    """
+    Takes a chunk of parsed annotations
+    returns value for placeholders of net's 
+    input & loss layer correspond to this chunk
+    """
+    inp, objs = self._encode(chunk)
+    if inp is None:
+        return None, None
+    feed = self._targets([objs])
+    return inp, {key: feed[key][0] for key in feed}
 
-def shuffle(self):
+
+def assemble(self, chunks):
+    """
+    Takes a list of parsed annotations
+    returns the input batch & loss placeholder values
+    for the annotations in chunks that could be used
+    """
+    x_batch = None
+    objs = list()
+
+    for train_instance in chunks:
+        self.logger.debug(train_instance[0])
+        try:
+            inp, new_objs = self._encode(train_instance)
+        except ZeroDivisionError:
+            self.logger.error("This image's width or height are zeros: ", train_instance[0])
+            self.logger.error('train_instance:', train_instance)
+            self.logger.error('Please remove or fix it then try again.')
+            raise
+
+        if inp is None:
+            continue
+        if x_batch is None:
+            x_batch = np.empty((len(chunks),) + inp.shape, np.float32)
+        x_batch[len(objs)] = inp
+        objs += [new_objs]
+
+    if x_batch is None:
+        raise ValueError('None of {} in this batch can be used'.format(
+            [train_instance[0] for train_instance in chunks]))
+    return x_batch[:len(objs)], self._targets(objs)
+
+
+def _prepare(self):
+    """
+    Parses the dataset, fits the batch size to it
+    and builds the frame cache if flags.frame_cache is set
+    returns the parsed annotations and the number of batches per epoch
+    """
     batch = self.flags.batch
     data = self.parse()
     self.flags.size = len(data)
@@ -103,38 +249,205 @@ def shuffle(self):
         self.flags.batch = batch = self.flags.size
     batch_per_epoch = int(self.flags.size / batch)
 
-    for i in range(self.flags.epoch):
-        shuffle_idx = perm(np.arange(self.flags.size))
-        for b in range(batch_per_epoch):
+    if self.flags.frame_cache and not self.flags.shards:
+        self.imcache = ImageCache(self.flags.dataset,
+                                  self.flags.frame_cache_side)
+        self.imcache.build([chunk[0] for chunk in data], self.logger)
+    return data, batch_per_epoch
+
+
+def _epoch_rng(seed, epoch):
+    """returns the RandomState ordering an epoch, unseeded if seed is None"""
+    return np.random.RandomState(None if seed is None else [seed, epoch])
+
+
+def _indices(self, batch_per_epoch, start=(0, 0), seed=None):
+    """
+    Yields arrays of dataset indices, one per batch, for every epoch
+    from batch start[1] of epoch start[0]. Each epoch is ordered by its
+    own RandomState so a run can pick up anywhere without replaying
+    the batches before it.
+    """
+    batch = self.flags.batch
+    first, skip = start
+    for i in range(first, self.flags.epoch):
+        shuffle_idx = _epoch_rng(seed, i).permutation(self.flags.size)
+        for b in range(skip if i == first else 0, batch_per_epoch):
+            yield shuffle_idx[b*batch:b*batch+batch]
+
+
+def _stream_epoch(self, reader, rng, batch_per_epoch):
+    """Yields one epoch of chunks from reader, shuffled with rng"""
+    labels = self.meta['labels']
+    batch = self.flags.batch
+    size = max(batch, self.flags.shuffle_buffer)
+
+    def frames():
+        for name, image, w, h, boxes in reader(
+                rng.permutation(len(reader.manifest['shards']))):
+            allobj = [[reader.labels[b[0]]] + b[1:].tolist()
+                      for b in boxes if reader.labels[b[0]] in labels]
+            yield [name, [w, h, allobj], image]
+
+    pool = list()
+    chunks = list()
+    n = 0
+    for frame in frames():
+        if len(pool) < size:
+            pool.append(frame)
+            continue
+        j = rng.randint(size)
+        chunks.append(pool[j])
+        pool[j] = frame
+        if len(chunks) == batch:
+            yield chunks
+            chunks, n = list(), n + 1
+    pool = [pool[j] for j in rng.permutation(len(pool))]
+    while n < batch_per_epoch and len(chunks) + len(pool) >= batch:
+        need = batch - len(chunks)
+        chunks, pool = chunks + pool[:need], pool[need:]
+        yield chunks
+        chunks, n = list(), n + 1
+
+
+def _stream(self, batch_per_epoch, start=(0, 0), seed=None):
+    """
+    Yields chunks read sequentially from flags.shards with their encoded
+    images, a batch at a time for every epoch from batch start[1] of
+    epoch start[0]. Shards are visited in a new random order each epoch
+    and frames are mixed across shards by a buffer of flags.shuffle_buffer
+    frames. Skipped batches are read but their images are not decoded.
+    """
+    reader = ShardReader(self.flags.shards)
+    first, skip = start
+    for i in range(first, self.flags.epoch):
+        epoch = _stream_epoch(self, reader, _epoch_rng(seed, i),
+                              batch_per_epoch)
+        yield from itertools.islice(epoch, skip if i == first else 0, None)
+
+
+def _chunks(self, data, batch_per_epoch, start=(0, 0), seed=None):
+    """Yields the chunks of parsed annotations making up each batch"""
+    if self.flags.shards:
+        yield from _stream(self, batch_per_epoch, start, seed)
+        return
+    for idx in _indices(self, batch_per_epoch, start, seed):
+        yield [data[j] for j in idx]
+
+
+def _batches(self, data, batch_per_epoch, start=(0, 0), seed=None):
+    """Yields assembled batches, from worker processes if flags.workers"""
+    feeder = None
+    chunks = _chunks(self, data, batch_per_epoch, start, seed)
+    if self.flags.workers > 0:
+        # resumed runs must not replay the augmentation they started with
+        feeder = BatchFeeder(self, None, self.flags.workers,
+                             self.flags.prefetch,
+                             None if seed is None else [seed, *start])
+        batches = feeder(chunks)
+    else:
+        batches = (self.assemble(chunk) for chunk in chunks)
+
+    done = start[0] * batch_per_epoch + start[1]
+    try:
+        for n, (x_batch, feed_batch) in enumerate(batches, done + 1):
             # yield these
-            x_batch = list()
-            feed_batch = dict()
-
-            for j in range(b*batch, b*batch+batch):
-                train_instance = data[shuffle_idx[j]]
-                self.logger.debug(train_instance[0])
-                try:
-                    inp, new_feed = self._batch(train_instance)
-                except ZeroDivisionError:
-                    self.logger.error("This image's width or height are zeros: ", train_instance[0])
-                    self.logger.error('train_instance:', train_instance)
-                    self.logger.error('Please remove or fix it then try again.')
-                    raise
-
-                if inp is None:
-                    continue
-                x_batch += [np.expand_dims(inp, 0)]
-
-                for key in new_feed:
-                    new = new_feed[key]
-                    old_feed = feed_batch.get(key, 
-                        np.zeros((0,) + new.shape))
-                    feed_batch[key] = np.concatenate([ 
-                        old_feed, [new] 
-                    ])      
-            
-            x_batch = np.concatenate(x_batch, 0)
             yield x_batch, feed_batch
-        
-        self.logger.info('Finish {} epoch(es)'.format(i + 1))
+            if n % batch_per_epoch:
+                continue
+            self.logger.info('Finish {} epoch(es)'.format(
+                n // batch_per_epoch))
+            if feeder is not None:
+                self.logger.info(
+                    'Waited on input for {} of {} batches ({:.2f}s)'.format(
+                        feeder.waits, feeder.fetched, feeder.wait_time))
+    finally:
+        if feeder is not None:
+            feeder.close()
+
+
+def shuffle(self, start=(0, 0), seed=None):
+    """
+    Yields batches of assembled frames and targets for flags.epoch
+    epochs, starting at batch start[1] of epoch start[0]. With a seed
+    every epoch's order is reproducible, so a resumed run carries on
+    with the batches an interrupted one never reached.
+    """
+    data, batch_per_epoch = _prepare(self)
+    yield from _batches(self, data, batch_per_epoch, start, seed)
+
+
+def _stamp(self, jpg):
+    """returns what tells a changed frame apart, None for shards"""
+    if self.flags.shards:
+        return None
+    st = os.stat(os.path.join(self.flags.dataset, jpg))
+    return st.st_mtime_ns, st.st_size
+
+
+def _cache_features(self, data, cache, extract):
+    """
+    Runs extract over a batch of un-augmented frames at a time for
+    every frame in data that cache is missing and stores the results
+    """
+    stamps = {chunk[0]: _stamp(self, chunk[0]) for chunk in data}
+    todo = set(cache.missing(stamps))
+    if not todo:
+        return
+    self.logger.info('Caching frozen layer outputs of {} frame(s) in {}'
+                     .format(len(todo), cache.path))
+    if self.flags.shards:
+        reader = ShardReader(self.flags.shards)
+        chunks = ([name, [w, h, list()], image]
+                  for name, image, w, h, _ in reader() if name in todo)
+    else:
+        chunks = (chunk for chunk in data if chunk[0] in todo)
+
+    names, ims = list(), list()
+    for chunk in chunks:
+        im = _decode(self, chunk, list(), *chunk[1][:2])[0]
+        if type(im) is not np.ndarray:
+            im = cv2.imread(im)
+        if im is None:
+            self.logger.warning('Could not decode {}'.format(chunk[0]))
+            continue
+        names.append(chunk[0])
+        ims.append(self.preprocess(im))
+        if len(ims) == self.flags.batch:
+            cache.put(names, stamps, extract(np.stack(ims)))
+            names, ims = list(), list()
+    if ims:
+        cache.put(names, stamps, extract(np.stack(ims)))
+    cache.save()
+
+
+def shuffle_features(self, cache, extract, start=(0, 0), seed=None):
+    """
+    Like shuffle, but yields the frozen layers' outputs of un-augmented
+    frames in place of the frames. The outputs come from cache, those it
+    is missing are computed first with extract, a function taking a batch
+    of preprocessed frames. Frames are never decoded after that.
+    start and seed work as they do for shuffle.
+    """
+    data, batch_per_epoch = _prepare(self)
+    _cache_features(self, data, cache, extract)
+    labels = self.meta['labels']
+    W, H = self._grid()
 
+    done = start[0] * batch_per_epoch + start[1]
+    for n, idx in enumerate(_indices(self, batch_per_epoch, start, seed),
+                            done + 1):
+        names, objs = list(), list()
+        for j in idx:
+            jpg, (w, h, allobj) = data[j][:2]
+            new_objs = _compact(allobj, labels, w, h, W, H)
+            if new_objs is None or jpg not in cache:
+                continue
+            names.append(jpg)
+            objs.append(new_objs)
+        if not names:
+            continue
+        yield cache.get(names), self._targets(objs)
+        if not n % batch_per_epoch:
+            self.logger.info('Finish {} epoch(es)'.format(
+                n // batch_per_epoch))
@@ -0,0 +1,50 @@
+import os
+import tensorflow as tf
+from .data import _prepare, _indices, _batches
+
+
+def pipeline(self, inp, placeholders):
+    """
+    Takes the net's input placeholder and the loss placeholders
+    returns a tensor standing in for inp and a dict of tensors
+    standing in for the loss placeholders, all fed by a tf.data
+    pipeline that assembles, batches and prefetches training data.
+
+    With flags.workers > 0 or flags.shards batches come from the same
+    generator as shuffle(), otherwise they are assembled by a parallel
+    map over batches of dataset indices. Either way they are prefetched
+    into the session so train() no longer copies them through feed_dict.
+    """
+    keys = sorted(placeholders)
+    refs = [inp] + [placeholders[key] for key in keys]
+    dtypes = tuple(ref.dtype for ref in refs)
+    shapes = tuple(ref.shape for ref in refs)
+
+    def _flatten(x_batch, feed_batch):
+        return (x_batch,) + tuple(feed_batch[key] for key in keys)
+
+    data, batch_per_epoch = _prepare(self)
+    if self.flags.workers > 0 or self.flags.shards:
+        dataset = tf.data.Dataset.from_generator(
+            lambda: (_flatten(*batch)
+                     for batch in _batches(self, data, batch_per_epoch)),
+            dtypes, shapes)
+    else:
+        def _assemble(idx):
+            return _flatten(*self.assemble([data[j] for j in idx]))
+
+        dataset = tf.data.Dataset.from_generator(
+            lambda: _indices(self, batch_per_epoch),
+            tf.int64, tf.TensorShape([None]))
+        # cv2 decoding and warping release the GIL so threads overlap
+        dataset = dataset.map(
+            lambda idx: tf.py_func(_assemble, [idx], dtypes, stateful=True),
+            num_parallel_calls=os.cpu_count() or 1)
+    dataset = dataset.prefetch(max(1, self.flags.prefetch))
+    self.logger.info('Feeding {} from a tf.data pipeline'.format(
+        ', '.join(ref.op.name for ref in refs)))
+
+    tensors = dataset.make_one_shot_iterator().get_next()
+    for tensor, shape in zip(tensors, shapes):
+        tensor.set_shape(shape)
+    return tensors[0], dict(zip(keys, tensors[1:]))
@@ -1,11 +1,11 @@
-from ...utils.im_transform import imcv2_recolor, imcv2_affine_trans
-from ...utils.box import BoundBox, box_iou, prob_compare
+from ...utils.im_transform import imcv2_augment
 import numpy as np
 import cv2
 import os
 import json
 from ...cython_utils.cy_yolo_findboxes import yolo_box_constructor
 from ...pascal_voc_io import PascalVocWriter, XML_EXT
+from ...utils.imhandle import as_handle
 
 
 def _fix(obj, dims, scale, offs):
@@ -24,22 +24,24 @@ def resize_input(self, im):
     return imsz
 
 
-def process_box(self, b, h, w, threshold):
-    max_indx = np.argmax(b.probs)
-    max_prob = b.probs[max_indx]
-    label = self.meta['labels'][max_indx]
-    if max_prob > threshold:
-        left = int((b.x - b.w / 2.) * w)
-        right = int((b.x + b.w / 2.) * w)
-        top = int((b.y - b.h / 2.) * h)
-        bot = int((b.y + b.h / 2.) * h)
-        if left < 0:  left = 0
-        if right > w - 1: right = w - 1
-        if top < 0:   top = 0
-        if bot > h - 1:   bot = h - 1
-        mess = '{}'.format(label)
-        return (left, right, top, bot, mess, max_indx, max_prob)
-    return None
+def process_box(self, boxes, h, w, threshold):
+    """
+    Takes the DETECTION array findboxes returns and the image size
+    returns (left, right, top, bot, label, class, score) in pixels
+    for each detection scoring over threshold
+    """
+    boxes = boxes[boxes['score'] > threshold]
+    x, y = boxes['x'].astype(np.float64), boxes['y'].astype(np.float64)
+    half_w, half_h = boxes['w'] / 2., boxes['h'] / 2.
+    left = np.maximum(((x - half_w) * w).astype(int), 0)
+    right = np.minimum(((x + half_w) * w).astype(int), w - 1)
+    top = np.maximum(((y - half_h) * h).astype(int), 0)
+    bot = np.minimum(((y + half_h) * h).astype(int), h - 1)
+    labels = self.meta['labels']
+    mess = ['{}'.format(labels[c]) for c in boxes['class']]
+    return list(zip(left.tolist(), right.tolist(), top.tolist(),
+                    bot.tolist(), mess, boxes['class'].tolist(),
+                    boxes['score'].tolist()))
 
 
 def findboxes(self, net_out):
@@ -60,12 +62,16 @@ def preprocess(self, im, allobj=None):
     image will be transformed with random noise to augment training data,
     using scale, translation, flipping and recolor. The accompanied
     parsed annotation (allobj) will also be modified accordingly.
+    The augmented image already has the net's input size.
+    im may be a path, pixels or an ImageHandle, which keeps the pixels
+    it decodes for postprocess.
     """
     if type(im) is not np.ndarray:
-        im = cv2.imread(im)
+        im = as_handle(im).pixels
 
     if allobj is not None:  # in training mode
-        result = imcv2_affine_trans(im)
+        h, w, _ = self.meta['inp_size']
+        result = imcv2_augment(im, (w, h))
         im, dims, trans_param = result
         scale, offs, flip = trans_param
         for obj in allobj:
@@ -75,7 +81,6 @@ def preprocess(self, im, allobj=None):
             obj_1_ = obj[1]
             obj[1] = dims[0] - obj[3]
             obj[3] = dims[0] - obj_1_
-        im = imcv2_recolor(im)
 
     im = self.resize_input(im)
     if allobj is None:
@@ -88,7 +93,8 @@ def postprocess(self, net_out, im, save=True):
     Takes net output, draw predictions, save to disk
     Args:
         net_out: A single fetch from tf session.run
-        im: A path or pathlike object to an image file
+        im: A path or pathlike object to an image file, its pixels
+            or an ImageHandle, which is only decoded if boxes are drawn
         save: A boolean. Whether to save predictions to disk
             Default True
     Returns:
@@ -102,18 +108,15 @@ def postprocess(self, net_out, im, save=True):
 
     boxes = self.findboxes(net_out)
 
-    if type(im) is not np.ndarray:
-        imgcv = cv2.imread(im)
-    else:
-        imgcv = im
-
-    h, w, c = imgcv.shape
-    writer = PascalVocWriter(self.flags.img_out, im, [h, w, c])
+    handle = as_handle(im)
+    h, w, c = handle.shape
+    # boxes are only drawn without an output type
+    imgcv = None
+    if not flags.output_type or not save:
+        imgcv = handle.pixels
+    writer = PascalVocWriter(self.flags.img_out, handle.path, [h, w, c])
     resultsForJSON = []
-    for b in boxes:
-        boxResults = self.process_box(b, h, w, threshold)
-        if boxResults is None:
-            continue
+    for boxResults in self.process_box(boxes, h, w, threshold):
         left, right, top, bot, mess, max_indx, confidence = boxResults
         thick = int((h + w) // 300)
         if self.flags.output_type:
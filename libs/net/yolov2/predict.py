@@ -7,10 +7,10 @@ import json
 #from scipy.special import expit
 #from utils.box import BoundBox, box_iou, prob_compare
 #from utils.box import prob_compare2, box_intersection
-from ...utils.box import BoundBox
 from ...cython_utils.cy_yolo2_findboxes import box_constructor
 from ...yolo_io import YOLOWriter
 from ...pascal_voc_io import PascalVocWriter, XML_EXT
+from ...utils.imhandle import as_handle
 
 
 def expit(x):
@@ -36,7 +36,8 @@ def postprocess(self, net_out, im, save=True):
     Takes net output, draw net_out, save to disk
     Args:
         net_out: A single fetch from tf session.run
-        im: A path or pathlike object to an image file
+        im: A path or pathlike object to an image file, its pixels
+            or an ImageHandle that already holds them
         save: A boolean. Whether to save predictions to disk
             Default True
     Returns:
@@ -51,18 +52,13 @@ def postprocess(self, net_out, im, save=True):
     threshold = meta['thresh']
     colors = meta['colors']
     labels = meta['labels']
-    if type(im) is not np.ndarray:
-        imgcv = cv2.imread(im)
-    else:
-        imgcv = im
+    handle = as_handle(im)
+    imgcv = handle.pixels
     h, w, c = imgcv.shape
 
-    writer = PascalVocWriter(self.flags.img_out, im, [h, w, c])
+    writer = PascalVocWriter(self.flags.img_out, handle.path, [h, w, c])
     resultsForJSON = []
-    for b in boxes:
-        boxResults = self.process_box(b, h, w, threshold)
-        if boxResults is None:
-            continue
+    for boxResults in self.process_box(boxes, h, w, threshold):
         left, right, top, bot, mess, max_indx, confidence = boxResults
         thick = int((h + w) // 300)
         if self.flags.output_type:
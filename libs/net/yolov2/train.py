@@ -11,6 +11,36 @@ def expit_tensor(x):
     return 1. / (1. + tf.exp(-x))
 
 
+def densify(objs, n, HW, B, C, W, H):
+    """
+    Takes a [k, 7] tensor of (sample, cell, class, x, y, sqrt w, sqrt h)
+    rows, at most one per sample and cell, and the batch size n
+    returns the dense loss targets yolov2.data._targets would feed
+    """
+    idx = tf.cast(objs[:, :2], tf.int32)
+    cls = tf.cast(objs[:, 2], tf.int32)
+    xy, sqwh = objs[:, 3:5], objs[:, 5:7]
+    half = tf.pow(sqwh, 2) * .5 * np.array([W, H], np.float32)
+    upleft, botright = xy - half, xy + half
+    wh = botright - upleft
+    onehot = tf.one_hot(cls, C)
+
+    def scatter(rows, *tail):
+        # every anchor of an object's cell gets the same target
+        updates = tf.tile(tf.expand_dims(rows, 1), [1, B] + [1] * len(tail))
+        return tf.scatter_nd(idx, updates, tf.stack([n, HW, B] + list(tail)))
+
+    return {
+        'probs': scatter(onehot, C),
+        'proid': scatter(tf.ones_like(onehot), C),
+        'confs': scatter(tf.ones_like(objs[:, 0])),
+        'coord': scatter(objs[:, 3:7], 4),
+        'areas': scatter(wh[:, 0] * wh[:, 1]),
+        'upleft': scatter(upleft, 2),
+        'botright': scatter(botright, 2)
+    }
+
+
 def loss(self, net_out):
     """
     Takes net.out and placeholders value
@@ -40,21 +70,31 @@ def loss(self, net_out):
     size1 = [None, HW, B, C]
     size2 = [None, HW, B]
 
-    # return the below placeholders
-    _probs = tf.placeholder(tf.float32, size1)
-    _confs = tf.placeholder(tf.float32, size2)
-    _coord = tf.placeholder(tf.float32, size2 + [4])
-    # weights term for L2 loss
-    _proid = tf.placeholder(tf.float32, size1)
-    # material calculating IOU
-    _areas = tf.placeholder(tf.float32, size2)
-    _upleft = tf.placeholder(tf.float32, size2 + [2])
-    _botright = tf.placeholder(tf.float32, size2 + [2])
-
-    self.placeholders = {
-        'probs': _probs, 'confs': _confs, 'coord': _coord, 'proid': _proid,
-        'areas': _areas, 'upleft': _upleft, 'botright': _botright
-    }
+    if self.flags.sparse:
+        # only the objects are fed, targets are scattered in the graph
+        _objs = tf.placeholder(tf.float32, [None, 7])
+        self.placeholders = {'objs': _objs}
+        dense = densify(_objs, tf.shape(net_out)[0], HW, B, C, W, H)
+        _probs, _confs, _coord, _proid, _areas, _upleft, _botright = [
+            dense[key] for key in ['probs', 'confs', 'coord', 'proid',
+                                   'areas', 'upleft', 'botright']]
+    else:
+        # return the below placeholders
+        _probs = tf.placeholder(tf.float32, size1)
+        _confs = tf.placeholder(tf.float32, size2)
+        _coord = tf.placeholder(tf.float32, size2 + [4])
+        # weights term for L2 loss
+        _proid = tf.placeholder(tf.float32, size1)
+        # material calculating IOU
+        _areas = tf.placeholder(tf.float32, size2)
+        _upleft = tf.placeholder(tf.float32, size2 + [2])
+        _botright = tf.placeholder(tf.float32, size2 + [2])
+
+        self.placeholders = {
+            'probs': _probs, 'confs': _confs, 'coord': _coord,
+            'proid': _proid, 'areas': _areas, 'upleft': _upleft,
+            'botright': _botright
+        }
 
     # Extract the coordinate prediction from net.out
     net_out_reshape = tf.reshape(net_out, [-1, H, W, B, (4 + 1 + C)])
@@ -62,19 +102,16 @@ def loss(self, net_out):
     coords = tf.reshape(coords, [-1, H*W, B, 4])
     adjusted_coords_xy = expit_tensor(coords[:, :, :, 0:2])
     adjusted_coords_wh = tf.sqrt(tf.exp(coords[:, :, :, 2:4]) * np.reshape(anchors, [1, 1, B, 2]) / np.reshape([W, H], [1, 1, 1, 2]))
-    coords = tf.concat([adjusted_coords_xy, adjusted_coords_wh], 3)
 
     adjusted_c = expit_tensor(net_out_reshape[:, :, :, :, 4])
-    adjusted_c = tf.reshape(adjusted_c, [-1, H*W, B, 1])
+    adjusted_c = tf.reshape(adjusted_c, [-1, H*W, B])
 
     adjusted_prob = tf.nn.softmax(net_out_reshape[:, :, :, :, 5:])
     adjusted_prob = tf.reshape(adjusted_prob, [-1, H*W, B, C])
 
-    adjusted_net_out = tf.concat([adjusted_coords_xy, adjusted_coords_wh, adjusted_c, adjusted_prob], 3)
-
-    wh = tf.pow(coords[:, :, :, 2:4], 2) * np.reshape([W, H], [1, 1, 1, 2])
+    wh = tf.pow(adjusted_coords_wh, 2) * np.reshape([W, H], [1, 1, 1, 2])
     area_pred = wh[:, :, :, 0] * wh[:, :, :, 1]
-    centers = coords[:, :, :, 0:2]
+    centers = adjusted_coords_xy
     floor = centers - (wh * .5)
     ceil  = centers + (wh * .5)
 
@@ -91,22 +128,25 @@ def loss(self, net_out):
     best_box = tf.cast(best_box, tf.float32)
     confs = tf.multiply(best_box, _confs)
 
-    # take care of the weight terms
+    # take care of the weight terms, every coordinate and class of a box
+    # shares its weight so those stay [..., 1] and broadcast
     conid = snoob * (1. - confs) + sconf * confs
-    weight_coo = tf.concat(4 * [tf.expand_dims(confs, -1)], 3)
-    cooid = scoor * weight_coo
-    weight_pro = tf.concat(C * [tf.expand_dims(confs, -1)], 3)
-    proid = sprob * weight_pro
+    cooid = scoor * tf.expand_dims(confs, -1)
+    proid = sprob * tf.expand_dims(confs, -1)
 
     self.fetch += [_probs, confs, conid, cooid, proid]
-    true = tf.concat([_coord, tf.expand_dims(confs, 3), _probs], 3)
-    wght = tf.concat([cooid, tf.expand_dims(conid, 3), proid], 3)
 
+    # the same terms as (adjusted_net_out - true) ** 2 * wght, reduced
+    # per box without concatenating either side to H*W*B*(5+C)
     self.logger.info('Building {} loss'.format(m['model']))
-    loss = tf.pow(adjusted_net_out - true, 2)
-    loss = tf.multiply(loss, wght)
-    loss = tf.reshape(loss, [-1, H*W*B*(4 + 1 + C)])
-    loss = tf.reduce_sum(loss, 1)
+    loss_coo = tf.reduce_sum(cooid * (
+        tf.squared_difference(adjusted_coords_xy, _coord[:, :, :, 0:2]) +
+        tf.squared_difference(adjusted_coords_wh, _coord[:, :, :, 2:4])), 3)
+    loss_con = conid * tf.squared_difference(adjusted_c, confs)
+    loss_pro = tf.reduce_sum(
+        proid * tf.squared_difference(adjusted_prob, _probs), 3)
+    loss = loss_coo + loss_con + loss_pro
+    loss = tf.reduce_sum(loss, [1, 2])
     self.loss = .5 * tf.reduce_mean(loss)
     tf.summary.scalar("/".join([os.path.basename(m['model']),
                                 self.flags.trainer,
@@ -0,0 +1,47 @@
+'''
+This script packs committed frames and their PascalVOC xml into size
+bounded binary shards that training can read sequentially (--shards)
+'''
+
+import argparse
+import logging
+import glob
+import sys
+import os
+
+try:
+    from libs.utils.flags import Flags
+    from libs.utils.shards import export_shards, MANIFEST
+except ModuleNotFoundError:
+    sys.path.append(os.path.abspath(os.path.join(
+        os.path.dirname(__file__), '..', '..')))
+    from libs.utils.flags import Flags
+    from libs.utils.shards import export_shards, MANIFEST
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dataset', default=Flags().dataset,
+                        help='path to the directory of frames')
+    parser.add_argument('--annotation', default=Flags().annotation,
+                        help='path to the directory of xml annotations')
+    parser.add_argument('--out', default='./data/shards/',
+                        help='path to write the shards and their manifest')
+    parser.add_argument('--shard_size', default=256, type=int, metavar='MB',
+                        help='approximate size of each shard')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='discard existing shards and write them again')
+    args = parser.parse_args(argv[1:])
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.rebuild:
+        stale = glob.glob(os.path.join(args.out, 'shard-*.rec'))
+        for path in stale + [os.path.join(args.out, MANIFEST)]:
+            if os.path.isfile(path):
+                os.remove(path)
+    export_shards(args.dataset, args.annotation, args.out,
+                  args.shard_size << 20, logging.getLogger('export_shards'))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,97 @@
+'''
+This script loads a frozen .pb and .meta pair once and answers predictions
+for images posted to localhost, batching requests that arrive together
+into one session run
+
+    curl --data-binary @frame.jpg http://127.0.0.1:8000/predict
+    curl http://127.0.0.1:8000/stats
+'''
+
+import argparse
+import logging
+import sys
+import os
+import numpy as np
+
+try:
+    from libs.utils.flags import Flags, FlagIO
+    from libs.utils.batcher import DynamicBatcher
+    from libs.utils.server import make_server
+except ModuleNotFoundError:
+    sys.path.append(os.path.abspath(os.path.join(
+        os.path.dirname(__file__), '..', '..')))
+    from libs.utils.flags import Flags, FlagIO
+    from libs.utils.batcher import DynamicBatcher
+    from libs.utils.server import make_server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pb_load', required=True, metavar='*.pb',
+                        help='name of protobuf file to load')
+    parser.add_argument('--meta_load', required=True, metavar='*.meta',
+                        help='path to .meta file corresponding to .pb file')
+    parser.add_argument('--port', default=8000, type=int,
+                        help='port to listen on at 127.0.0.1')
+    parser.add_argument('--socket', default='', metavar='PATH',
+                        help='listen on this Unix socket instead')
+    parser.add_argument('--max_batch', default=8, type=int, metavar='N',
+                        help='most requests run through the net at once')
+    parser.add_argument('--max_latency', default=10., type=float,
+                        metavar='MS',
+                        help='longest a request waits for others to '
+                             'batch with')
+    parser.add_argument('--threshold', default=Flags().threshold,
+                        type=float, help='threshold of confidence')
+    parser.add_argument('--nms_iou', default=Flags().nms_iou, type=float,
+                        metavar='IOU',
+                        help='overlap at which NMS suppresses a box')
+    parser.add_argument('--nms_mode', default=Flags().nms_mode,
+                        choices=['class', 'agnostic', 'soft'],
+                        help='how NMS treats overlapping boxes')
+    parser.add_argument('--gpu', default=Flags().gpu, type=float,
+                        metavar='[0 .. 1.0]', help='amount of GPU to use')
+    args = parser.parse_args(argv[1:])
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logger = logging.getLogger('serve')
+
+    # TFNet reads its flags from a flags file, this one is the server's
+    # own so an app running next to it keeps its flags
+    FlagIO.flagfile = '.serve.{}.flags.pkl'.format(os.getpid())
+    flagio = FlagIO()
+    flags = Flags()
+    for key in ['pb_load', 'meta_load', 'threshold', 'nms_iou', 'nms_mode',
+                'gpu']:
+        flags[key] = getattr(args, key)
+    flags.cli = True
+    flagio.flags = flags
+    flagio.send_flags()
+
+    # tensorflow is only imported once the arguments are known to be good
+    from libs.net.build import TFNet
+    net = TFNet(flags)
+    # the first run pays for graph setup, not the first request
+    net.return_predict_batch([np.zeros(net.meta['inp_size'], np.uint8)])
+
+    batcher = DynamicBatcher(net.return_predict_batch, args.max_batch,
+                             args.max_latency / 1e3)
+    server = make_server(batcher, port=args.port, socket_path=args.socket,
+                         logger=logger)
+    logger.info('Serving {} on {}'.format(
+        os.path.basename(args.pb_load), args.socket or
+        'http://127.0.0.1:{}'.format(server.server_address[1])))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopping')
+    finally:
+        server.server_close()
+        batcher.close()
+        flagio.cleanup_ramdisk()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -16,13 +16,13 @@ else:
     EXEC_PATH = os.getcwd()
 try:
     from libs.net.build import TFNet
-    from libs.utils.flags import Flags, FlagIO
+    from libs.utils.flags import Flags, FlagIO, THREAD_PROFILES
 except ModuleNotFoundError:
     # Move to the top level dir since flag paths are relative to slgrSuite.py
     sys.path.append(EXEC_PATH)
 finally:
     from libs.net.build import TFNet
-    from libs.utils.flags import Flags, FlagIO
+    from libs.utils.flags import Flags, FlagIO, THREAD_PROFILES
     os.chdir(EXEC_PATH)
 
 
@@ -72,6 +72,16 @@ class DarkWrapper(FlagIO):
                                 help='path to the annotation directory')
             parser.add_argument('--summary', default=Flags().summary,
                                 help='path to Tensorboard summaries directory')
+            parser.add_argument('--summary_every',
+                                default=Flags().summary_every, type=int,
+                                metavar='N',
+                                help='write scalar summaries every N steps '
+                                     '(0 never)')
+            parser.add_argument('--histogram_every',
+                                default=Flags().histogram_every, type=int,
+                                metavar='N',
+                                help='write gradient histograms every N '
+                                     'steps (0 never)')
             parser.add_argument('--log', default=Flags().log,
                                 help='path to log directory')
             parser.add_argument('--trainer', default=Flags().trainer,
@@ -90,6 +100,78 @@ class DarkWrapper(FlagIO):
             parser.add_argument('--save', default=Flags().save, metavar='N',
                                 help='save a checkpoint ever N training '
                                      'examples')
+            parser.add_argument('--threads', default=Flags().threads,
+                                choices=list(THREAD_PROFILES) +
+                                ['auto', 'tune'],
+                                help='session threading profile, auto uses '
+                                     'the setting tuned for this model and '
+                                     'host (tuning it if there is none), '
+                                     'tune always tunes again')
+            parser.add_argument('--resume', default=Flags().resume,
+                                action='store_true',
+                                help='carry on an interrupted run from the '
+                                     'loaded checkpoint\'s place in the '
+                                     'data instead of starting over')
+            parser.add_argument('--seed', default=Flags().seed, type=int,
+                                metavar='N',
+                                help='seed for the order of training data '
+                                     '(0 picks one)')
+            parser.add_argument('--accumulate', default=Flags().accumulate,
+                                type=int, metavar='K',
+                                help='apply gradients summed over K batches '
+                                     'for an effective batch of K * batch')
+            parser.add_argument('--towers', default=Flags().towers,
+                                type=int, metavar='N',
+                                help='split each batch over N copies of the '
+                                     'net on their own CPU devices, each '
+                                     'with its own thread pool (TF sets '
+                                     'this up once per process, for the '
+                                     'first session)')
+            parser.add_argument('--workers', default=Flags().workers,
+                                type=int, metavar='N',
+                                help='number of processes assembling '
+                                     'training batches (0 assembles them '
+                                     'between training steps)')
+            parser.add_argument('--prefetch', default=Flags().prefetch,
+                                type=int, metavar='N',
+                                help='number of ready batches to queue '
+                                     'ahead of the training step')
+            parser.add_argument('--frame_cache', default=Flags().frame_cache,
+                                action='store_true',
+                                help='decode training frames once into a '
+                                     'memory-mapped cache')
+            parser.add_argument('--frame_cache_side',
+                                default=Flags().frame_cache_side, type=int,
+                                metavar='PIXELS',
+                                help='longest side of cached frames '
+                                     '(0 keeps full size)')
+            parser.add_argument('--trainable', default=Flags().trainable,
+                                type=int, metavar='N',
+                                help='train only the last N layers and keep '
+                                     'the others frozen (0 trains all)')
+            parser.add_argument('--feature_cache',
+                                default=Flags().feature_cache,
+                                action='store_true',
+                                help='run the frozen layers once per frame '
+                                     'and train the rest from their cached '
+                                     'outputs, without augmentation')
+            parser.add_argument('--tfdata', default=Flags().tfdata,
+                                action='store_true',
+                                help='feed training batches from a tf.data '
+                                     'pipeline instead of feed_dict')
+            parser.add_argument('--sparse', default=Flags().sparse,
+                                action='store_true',
+                                help='feed only object rows and build the '
+                                     'YOLOv2 loss targets in the graph')
+            parser.add_argument('--shards', default=Flags().shards,
+                                metavar='',
+                                help='path to shards written by '
+                                     'export_shards.py to train from')
+            parser.add_argument('--shuffle_buffer',
+                                default=Flags().shuffle_buffer, type=int,
+                                metavar='N',
+                                help='number of frames mixed together when '
+                                     'reading shards')
             parser.add_argument('--pb_load', default=Flags().pb_load,
                                 metavar='*.pb',
                                 help='name of protobuf file to load')
@@ -111,6 +193,14 @@ class DarkWrapper(FlagIO):
                                 type=float, choices=np.arange(0.01, 1.0, 0.01),
                                 metavar='[0.01 .. 0.99]',
                                 help='threshold of confidence')
+            parser.add_argument('--nms_iou', default=Flags().nms_iou,
+                                type=float, metavar='IOU',
+                                help='overlap at which NMS suppresses a box '
+                                     '(0 takes nms= from the cfg or 0.4)')
+            parser.add_argument('--nms_mode', default=Flags().nms_mode,
+                                choices=['class', 'agnostic', 'soft'],
+                                help='suppress overlaps within each class, '
+                                     'across classes, or decay their scores')
             parser.add_argument('--clip', default=Flags().clip,
                                 help="clip if gradient explodes")
             parser.add_argument('--lr', default=Flags().lr, metavar='N',
@@ -132,6 +222,9 @@ class DarkWrapper(FlagIO):
             self.send_flags()
         self.flags = self.read_flags()
         self.flags.started = True
+        self.control = self.open_control()
+        if not self.flags.kill:
+            self.control.reset()
         self.io_flags()
         try:
             if self.flags.train:
@@ -163,6 +256,8 @@ class DarkWrapper(FlagIO):
         self.read_flags()
         self.flags.progress = 100
         self.flags.done = True
+        self.control.progress = 100
+        self.control.done = True
         self.logger.info("Operation complete: exiting")
         self.io_flags()
         self.cleanup_ramdisk()
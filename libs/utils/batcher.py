@@ -0,0 +1,129 @@
+"""
+gather requests from many threads into batches for one call
+"""
+import collections
+import queue
+import threading
+import time
+import numpy as np
+
+
+class _Request(object):
+    __slots__ = ('item', 'arrived', 'done', 'result', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.arrived = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher(object):
+    """
+    Callable from any number of threads: each call hands one item to a
+    single worker thread and blocks until fn has run on a batch holding
+    it. fn takes a list of items and returns a list of results in the
+    same order.
+
+    The worker takes the oldest waiting request and waits at most
+    max_latency seconds from its arrival for more, so a batch is run as
+    soon as it holds max_batch items or its oldest one has waited long
+    enough. A lone request therefore costs at most max_latency on top of
+    fn, and under load batches fill up without waiting at all.
+
+    stats() reports the requests waiting, batch sizes and percentiles of
+    the time requests took from arrival to result over the last history
+    of them.
+    """
+
+    def __init__(self, fn, max_batch=8, max_latency=.01, history=1000):
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_latency = max(0., float(max_latency))
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.running = 0
+        self.latencies = collections.deque(maxlen=history)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def __call__(self, item, timeout=None):
+        """returns what fn returned for item, or raises what it raised"""
+        request = _Request(item)
+        self._queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError('No result within {}s'.format(timeout))
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _gather(self, first):
+        batch = [first]
+        deadline = first.arrived + self.max_latency
+        while len(batch) < self.max_batch:
+            wait = deadline - time.time()
+            try:
+                if wait > 0:
+                    request = self._queue.get(timeout=wait)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:  # closing, finish what was asked for
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _work(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._gather(first)
+            self.running = len(batch)
+            try:
+                results = self.fn([request.item for request in batch])
+                if len(results) != len(batch):
+                    raise ValueError('{} results for a batch of {}'.format(
+                        len(results), len(batch)))
+            except Exception as e:
+                results = [None] * len(batch)
+                for request in batch:
+                    request.error = e
+            finished = time.time()
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.errors += sum(r.error is not None for r in batch)
+                self.latencies.extend(finished - r.arrived for r in batch)
+            self.running = 0
+            for request, result in zip(batch, results):
+                request.result = result
+                request.done.set()
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1e3
+            stats = {'queue_depth': self._queue.qsize(),
+                     'running': self.running,
+                     'requests': self.requests,
+                     'batches': self.batches,
+                     'errors': self.errors,
+                     'mean_batch': self.requests / max(self.batches, 1),
+                     'max_batch': self.max_batch,
+                     'max_latency_ms': self.max_latency * 1e3}
+        stats['latency_ms'] = dict()
+        for p in (50, 90, 99):
+            stats['latency_ms']['p{}'.format(p)] = float(
+                np.percentile(latencies, p)) if len(latencies) else None
+        return stats
+
+    def close(self):
+        """Runs what was already submitted then stops the worker"""
+        self._queue.put(None)
+        self._thread.join()
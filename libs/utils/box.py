@@ -1,5 +1,12 @@
 import numpy as np
 
+# what the box constructors return, one row per detected box with
+# its best class and that class' score
+DETECTION = np.dtype([
+    ('x', np.float32), ('y', np.float32),
+    ('w', np.float32), ('h', np.float32),
+    ('conf', np.float32), ('class', np.int32), ('score', np.float32)])
+
 
 class BoundBox:
     def __init__(self, classes):
@@ -10,6 +17,23 @@ class BoundBox:
         self.probs = np.zeros((classes,))
 
 
+def bound_boxes(detections, classes):
+    """
+    Takes a DETECTION array
+    returns a BoundBox for each row, as box constructors used to,
+    with only the detected class' probability set
+    """
+    boxes = list()
+    for det in detections:
+        box = BoundBox(classes)
+        box.x, box.y = float(det['x']), float(det['y'])
+        box.w, box.h = float(det['w']), float(det['h'])
+        box.c = float(det['conf'])
+        box.probs[det['class']] = det['score']
+        boxes.append(box)
+    return boxes
+
+
 def overlap(x1,w1,x2,w2):
     l1 = x1 - w1 / 2.
     l2 = x2 - w2 / 2.
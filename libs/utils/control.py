@@ -0,0 +1,55 @@
+"""
+progress and stop requests shared through a small memory-mapped file
+"""
+import mmap
+import os
+import struct
+
+# field: (offset, format), each field is naturally aligned
+FIELDS = {
+    'progress': (0, '<d'),
+    'step': (8, '<Q'),
+    'kill': (16, '<B'),
+    'done': (17, '<B'),
+}
+SIZE = 24
+
+
+class ControlSlot(object):
+    """
+    A handful of numbers that the GUI, the wrapper and the trainer read
+    and write in place without locking, pickling or sleeping.
+
+    Every field is written with a single aligned store so readers see
+    either the old or the new value. Unlike the flags file the slot is
+    meant to be touched every training step.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < SIZE:
+                os.ftruncate(fd, SIZE)
+            self._map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+
+    def __getattr__(self, attr):
+        if attr not in FIELDS:
+            raise AttributeError(attr)
+        offset, fmt = FIELDS[attr]
+        value = struct.unpack_from(fmt, self._map, offset)[0]
+        return bool(value) if fmt == '<B' else value
+
+    def __setattr__(self, attr, value):
+        if attr not in FIELDS:
+            return object.__setattr__(self, attr, value)
+        offset, fmt = FIELDS[attr]
+        struct.pack_into(fmt, self._map, offset, value)
+
+    def reset(self):
+        self._map[:] = bytes(SIZE)
+
+    def close(self):
+        self._map.close()
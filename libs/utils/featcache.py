@@ -0,0 +1,90 @@
+"""
+frozen layer activations kept in one memory-mapped float32 file
+"""
+import os
+import pickle
+import numpy as np
+
+CACHE_VERSION = 1
+
+
+class FeatureCache(object):
+    """
+    The output of a net's frozen layers for every un-augmented frame,
+    appended as float32 rows of the same shape to a single file with an
+    index of {name: (row, stamp)}. get() gathers rows for a batch from a
+    memory map of that file so the frozen layers only run once per frame.
+
+    key names the frozen layers and their weights, a cache built for any
+    other key lives in another file. Frames whose stamp changes are
+    appended again, the rows they held before are only given back by
+    deleting the cache file.
+    """
+
+    def __init__(self, root, key, shape, name='.features'):
+        self.shape = tuple(int(d) for d in shape)
+        self.path = os.path.join(root, '{}-{}.cache'.format(name, key))
+        self.index_path = self.path + '.index'
+        self.row_size = int(np.prod(self.shape)) * 4
+        self._map = None
+        self.index = self._load_index()
+
+    def _load_index(self):
+        empty = {'version': CACHE_VERSION, 'shape': self.shape,
+                 'entries': dict()}
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return empty
+        if index.get('version') != CACHE_VERSION or \
+                index.get('shape') != self.shape or \
+                not os.path.isfile(self.path):
+            return empty
+        return index
+
+    def _save_index(self):
+        temp = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(self.index, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.index_path)
+
+    def __contains__(self, name):
+        return name in self.index['entries']
+
+    def __len__(self):
+        return len(self.index['entries'])
+
+    def missing(self, stamps):
+        """
+        Takes {name: stamp} for every frame to train on
+        returns the names that are not cached or whose stamp changed
+        """
+        entries = self.index['entries']
+        if not entries and os.path.isfile(self.path):
+            os.remove(self.path)  # rows from another shape
+        return [name for name, stamp in stamps.items()
+                if name not in entries or entries[name][1] != stamp]
+
+    def put(self, names, stamps, rows):
+        """Append a batch of rows, one per name, and index them"""
+        rows = np.ascontiguousarray(rows, np.float32)
+        assert rows.shape[1:] == self.shape, rows.shape
+        self._map = None
+        with open(self.path, 'ab') as f:
+            first = f.tell() // self.row_size
+            f.write(rows.data)
+        entries = self.index['entries']
+        for k, name in enumerate(names):
+            entries[name] = (first + k, stamps[name])
+
+    def save(self):
+        self._save_index()
+
+    def get(self, names):
+        """returns a [len(names), *shape] array of the cached rows"""
+        if self._map is None:
+            self._map = np.memmap(self.path, dtype=np.float32, mode='r')
+            self._map = self._map.reshape((-1,) + self.shape)
+        entries = self.index['entries']
+        return np.asarray(self._map[[entries[name][0] for name in names]])
@@ -0,0 +1,123 @@
+"""
+assemble training batches in worker processes ahead of the session
+"""
+import multiprocessing
+import queue
+import time
+import numpy as np
+
+
+def _work(framework, data, tasks, results, seed):
+    """
+    Worker loop: turn lists of dataset indices into ready batches,
+    or lists of chunks if there is no data to index
+    """
+    # forked workers would otherwise all draw the same augmentations
+    np.random.seed(seed)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, idx = task
+        try:
+            if data is not None:
+                idx = [data[i] for i in idx]
+            out = framework.assemble(idx)
+        except Exception as e:
+            results.put((seq, e))
+            continue
+        results.put((seq, out))
+
+
+class BatchFeeder(object):
+    """
+    Bounded queue of ready (x_batch, feed_batch) pairs filled by a pool of
+    worker processes. Processes are used because image decoding,
+    augmentation and loss target construction mostly hold the GIL.
+
+    Batches are handed back in the order their indices were submitted.
+    waits counts how many batches were not ready when the trainer asked
+    for them and wait_time is the total time spent blocked on them.
+
+    Every worker seeds NumPy's global generator, which augmentation draws
+    from, with its own seed drawn from seed, or from fresh entropy if
+    seed is None. Which worker assembles a batch is not fixed, so a seed
+    gives workers distinct streams but not repeatable augmentation.
+    """
+
+    def __init__(self, framework, data, workers, prefetch=4, seed=None):
+        self.workers = max(1, int(workers))
+        self.window = self.workers + max(1, int(prefetch))
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue(self.window)
+        self.waits = 0
+        self.wait_time = 0.
+        self.fetched = 0
+        self.procs = list()
+        seeds = np.random.RandomState(seed).randint(2 ** 31,
+                                                    size=self.workers)
+        for worker_seed in seeds:
+            proc = multiprocessing.Process(
+                target=_work,
+                args=(framework, data, self.tasks, self.results,
+                      int(worker_seed)),
+                daemon=True)
+            proc.start()
+            self.procs.append(proc)
+
+    def __call__(self, indices):
+        """
+        Yields assembled batches for each array of dataset indices,
+        or each list of chunks when data is None, while keeping
+        at most self.window batches in flight
+        """
+        indices = iter(indices)
+        ready = dict()
+        submitted = 0
+        for idx in indices:
+            self.tasks.put((submitted, idx))
+            submitted += 1
+            if submitted == self.window:
+                break
+        seq = 0
+        while seq < submitted:
+            if seq not in ready:
+                self._collect(seq, ready)
+            out = ready.pop(seq)
+            if isinstance(out, Exception):
+                raise out
+            idx = next(indices, None)
+            if idx is not None:
+                self.tasks.put((submitted, idx))
+                submitted += 1
+            seq += 1
+            self.fetched += 1
+            yield out
+
+    def _collect(self, seq, ready):
+        """Drain finished batches until seq arrives, counting any stall"""
+        try:
+            while seq not in ready:
+                done, out = self.results.get_nowait()
+                ready[done] = out
+            return
+        except queue.Empty:
+            pass
+        self.waits += 1
+        start = time.time()
+        while seq not in ready:
+            done, out = self.results.get()
+            ready[done] = out
+        self.wait_time += time.time() - start
+
+    def close(self):
+        for _ in self.procs:
+            self.tasks.put(None)
+        for proc in self.procs:
+            proc.join(timeout=1)
+            if proc.is_alive():
+                proc.terminate()
+        self.procs = list()
+        # unread batches must not keep the interpreter from exiting
+        self.tasks.cancel_join_thread()
+        self.results.cancel_join_thread()
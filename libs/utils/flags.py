@@ -6,10 +6,16 @@ import logging
 import sys
 import time
 import os
+from .control import ControlSlot
+
+FLAGFILE = ".flags.pkl"
 
 
 class FlagIO(object):
     """Base object for logging and shared memory flag read/write operations"""
+    # a process that must not touch the app's flags, like a prediction
+    # server, points this at a file of its own before making any FlagIO
+    flagfile = FLAGFILE
 
     def __init__(self, subprogram=False, delay=0.1):
         self.subprogram = subprogram
@@ -89,8 +95,17 @@ class FlagIO(object):
         self.send_flags()
         self.flags = self.read_flags()
 
+    def open_control(self):
+        """Map the control slot that lives next to the flags file"""
+        return ControlSlot(self.controlpath())
+
+    def controlpath(self):
+        """The control slot is named after the flags file it sits next to"""
+        return os.path.join(os.path.dirname(self.flagpath),
+                            self.flagfile.replace(".flags.pkl",
+                                                  ".control.slot"))
+
     def init_ramdisk(self):
-        flagfile = ".flags.pkl"
         if sys.platform == "darwin":
             ramdisk = "/Volumes/RAMDisk"
             if not self.subprogram:
@@ -105,11 +120,12 @@ class FlagIO(object):
                 time.sleep(self.delay)  # Give the OS time to finish
         else:
             ramdisk = "/dev/shm"
-        flagpath = os.path.join(ramdisk, flagfile)
+        flagpath = os.path.join(ramdisk, self.flagfile)
         return flagpath
 
     def cleanup_ramdisk(self):
-        if sys.platform == "darwin":
+        # the RAMDisk is the app's to unmount
+        if sys.platform == "darwin" and self.flagfile == FLAGFILE:
             proc = subprocess.Popen(['./libs/scripts/RAMDisk', 'unmount'],
                                     stdout=subprocess.PIPE,
                                     stderr=subprocess.STDOUT)
@@ -120,6 +136,30 @@ class FlagIO(object):
                 self.logger.debug(stderr.decode('utf-8'))
         else:
             os.remove(self.flagpath)
+            try:
+                os.remove(self.controlpath())
+            except FileNotFoundError:
+                pass
+
+
+# (share of the cores for intra op threads, inter op threads), None leaves
+# both to tensorflow. 'auto' and 'tune' pick a timed setting instead,
+# see TFNet.autotune
+THREAD_PROFILES = {
+    'default': None,
+    'exclusive': (1., 2),
+    'shared': (.25, 1),
+    'single': (0., 1),
+}
+
+
+def thread_profile(name, cores=None):
+    """returns (intra, inter) op threads of a named profile or None"""
+    profile = THREAD_PROFILES[name]
+    if profile is None:
+        return None
+    cores = cores or os.cpu_count() or 1
+    return max(1, int(cores * profile[0])), profile[1]
 
 
 class Flags(dict):
@@ -180,6 +220,27 @@ class Flags(dict):
             self.train = False
             self.pb_load = False
             self.meta_load = False
+            self.workers = 0
+            self.prefetch = 4
+            self.frame_cache = False
+            self.frame_cache_side = 0
+            self.tfdata = False
+            self.shards = ''
+            self.shuffle_buffer = 1024
+            self.sparse = False
+            self.progress_interval = 1.0
+            self.summary_every = 1
+            self.histogram_every = 100
+            self.towers = 1
+            self.accumulate = 1
+            self.threads = 'default'
+            self.threads_file = './data/threads.json'
+            self.trainable = 0
+            self.feature_cache = False
+            self.resume = False
+            self.seed = 0
+            self.nms_iou = 0.0
+            self.nms_mode = 'class'
 
     def __getattr__(self, attr):
         return self[attr]
@@ -31,3 +31,45 @@ def imcv2_affine_trans(im):
 	flip = np.random.binomial(1, .5)
 	if flip: im = cv2.flip(im, 1)
 	return im, [w, h, c], [scale, [offx, offy], flip]
+
+
+def imcv2_augment(im, size, a = .1):
+	"""
+	Same random scale, translation, flip and recolor as imcv2_affine_trans
+	followed by imcv2_recolor and a resize to size = (width, height), done
+	in one warpAffine and a per channel lookup table on the uint8 result.
+	Returns the image along with the dims and transform parameters that
+	imcv2_affine_trans returns so boxes can be fixed the same way.
+	"""
+	# Scale and translate
+	h, w, c = im.shape
+	scale = np.random.uniform() / 10. + 1.
+	max_offx = (scale-1.) * w
+	max_offy = (scale-1.) * h
+	offx = int(np.random.uniform() * max_offx)
+	offy = int(np.random.uniform() * max_offy)
+	flip = np.random.binomial(1, .5)
+
+	# scale, crop, flip and resize composed on pixel centres
+	kx, ky = size[0] / w, size[1] / h
+	if flip:
+		row_x = [-kx * scale, 0., kx * (w - .5 * scale + offx) - .5]
+	else:
+		row_x = [kx * scale, 0., kx * (.5 * scale - offx) - .5]
+	row_y = [0., ky * scale, ky * (.5 * scale - offy) - .5]
+	M = np.array([row_x, row_y])
+	im = cv2.warpAffine(im, M, tuple(size), flags = cv2.INTER_LINEAR,
+		borderMode = cv2.BORDER_REPLICATE)
+
+	# random amplify each channel then gamma, as imcv2_recolor
+	t = [np.random.uniform()]
+	t += [np.random.uniform()]
+	t += [np.random.uniform()]
+	t = np.array(t) * 2. - 1.
+	mx = 255. * (1 + a)
+	up = np.random.uniform() * 2 - 1
+	v = np.arange(256, dtype = np.float64)[:, None]
+	lut = np.power(v * (1 + t * a) / mx, 1. + up * .5) * 255.
+	lut = np.array(lut, np.uint8).reshape(256, 1, 3)
+	im = cv2.LUT(im, lut)
+	return im, [w, h, c], [scale, [offx, offy], flip]
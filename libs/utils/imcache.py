@@ -0,0 +1,116 @@
+"""
+decoded training frames kept in one memory-mapped uint8 file
+"""
+import os
+import pickle
+from multiprocessing import Pool
+import numpy as np
+import cv2
+
+CACHE_VERSION = 1
+
+
+def _decode(args):
+    """Decode one frame, shrinking it so its longest side is max_side"""
+    path, max_side = args
+    im = cv2.imread(path)
+    if im is None:
+        return None
+    h, w = im.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        im = cv2.resize(im, size, interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(im)
+
+
+class ImageCache(object):
+    """
+    Every frame in a dataset decoded once and appended as raw uint8 pixels to
+    a single file, with an index of {name: (offset, shape, mtime, size)}.
+    get() hands out read-only views into a memory map of that file so
+    training workers slice frames without decoding or copying them.
+
+    max_side of 0 stores frames at full size, otherwise frames are shrunk so
+    their longest side is at most max_side pixels. Frames that change on disk
+    are appended again, the space held by their old pixels is only given
+    back by deleting the cache file.
+    """
+
+    def __init__(self, dataset, max_side=0, name='.frames.cache'):
+        self.dataset = dataset
+        self.max_side = int(max_side)
+        self.path = os.path.join(dataset, name)
+        self.index_path = self.path + '.index'
+        self._map = None
+        self.index = self._load_index()
+
+    def _load_index(self):
+        empty = {'version': CACHE_VERSION, 'max_side': self.max_side,
+                 'entries': dict()}
+        try:
+            with open(self.index_path, 'rb') as f:
+                index = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return empty
+        if index.get('version') != CACHE_VERSION or \
+                index.get('max_side') != self.max_side or \
+                not os.path.isfile(self.path):
+            return empty
+        return index
+
+    def _save_index(self):
+        temp = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(self.index, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.index_path)
+
+    def build(self, names, logger=None, processes=None):
+        """
+        Decode and append every frame in names that is missing from the
+        cache or changed on disk since it was cached
+        returns the number of frames that were decoded
+        """
+        entries = self.index['entries']
+        if not entries and os.path.isfile(self.path):
+            os.remove(self.path)  # stale pixels from another max_side
+        todo = list()
+        for name in names:
+            st = os.stat(os.path.join(self.dataset, name))
+            entry = entries.get(name)
+            if entry is None or entry[2:] != (st.st_mtime_ns, st.st_size):
+                todo.append((name, st.st_mtime_ns, st.st_size))
+        if not todo:
+            return 0
+        if logger is not None:
+            logger.info('Caching {} decoded frame(s) in {}'.format(
+                len(todo), self.path))
+
+        self._map = None
+        args = [(os.path.join(self.dataset, name), self.max_side)
+                for name, _, _ in todo]
+        processes = processes or os.cpu_count() or 1
+        chunksize = max(1, len(args) // (processes * 4))
+        with Pool(processes) as pool, open(self.path, 'ab') as f:
+            offset = f.tell()
+            frames = pool.imap(_decode, args, chunksize)
+            for (name, mtime, size), im in zip(todo, frames):
+                if im is None:
+                    if logger is not None:
+                        logger.warning('Could not decode {}'.format(name))
+                    continue
+                f.write(im.data)
+                entries[name] = (offset, im.shape, mtime, size)
+                offset += im.nbytes
+        self._save_index()
+        return len(todo)
+
+    def get(self, name):
+        """returns a read-only view of a cached frame or None"""
+        entry = self.index['entries'].get(name)
+        if entry is None:
+            return None
+        if self._map is None:
+            self._map = np.memmap(self.path, dtype=np.uint8, mode='r')
+        offset, shape = entry[:2]
+        return np.ndarray(shape, np.uint8, buffer=self._map, offset=offset)
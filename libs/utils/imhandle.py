@@ -0,0 +1,144 @@
+"""
+an image file that is decoded at most once on its way through predict
+"""
+import os
+import struct
+import cv2
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# start of frame markers, the ones carrying the image size
+JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# EXIF orientations cv2.imread rotates by a quarter turn
+TRANSPOSED = (5, 6, 7, 8)
+
+
+def _exif_orientation(data):
+    """returns the orientation in an APP1 segment, 1 if it has none"""
+    if data[:6] != b'Exif\x00\x00':
+        return 1
+    tiff = data[6:]
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None:
+        return 1
+    ifd, = struct.unpack(order + 'I', tiff[4:8])
+    count, = struct.unpack(order + 'H', tiff[ifd:ifd + 2])
+    for i in range(count):
+        entry = tiff[ifd + 2 + 12 * i:ifd + 14 + 12 * i]
+        if len(entry) < 12:
+            break
+        tag, = struct.unpack(order + 'H', entry[:2])
+        if tag == 0x0112:
+            return struct.unpack(order + 'H', entry[8:10])[0]
+    return 1
+
+
+def _jpeg_size(f):
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        code = f.read(1)
+        while code == b'\xff':
+            code = f.read(1)
+        if not code:
+            return None
+        code = ord(code)
+        if code == 0x01 or 0xD0 <= code <= 0xD8:
+            continue  # markers without a segment
+        if code in (0xD9, 0xDA):
+            return None  # no frame header before the scan
+        length, = struct.unpack('>H', f.read(2))
+        if code in JPEG_SOF:
+            h, w = struct.unpack('>HH', f.read(5)[1:])
+            return (w, h) if orientation in TRANSPOSED else (h, w)
+        if code == 0xE1:
+            data = f.read(length - 2)
+            # XMP and other APP1 segments leave the orientation alone
+            if data.startswith(b'Exif\x00\x00'):
+                orientation = _exif_orientation(data)
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def probe_size(path):
+    """
+    returns the (height, width) cv2.imread would decode a JPEG or PNG to,
+    reading only its header, or None for anything else
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(24)
+            if head.startswith(PNG_SIGNATURE) and head[12:16] == b'IHDR':
+                w, h = struct.unpack('>II', head[16:24])
+                return h, w
+            if head.startswith(b'\xff\xd8'):
+                f.seek(2)
+                return _jpeg_size(f)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+class ImageHandle(object):
+    """
+    An image path along with its pixels once something decoded them.
+    pixels decodes the file the first time it is asked for and keeps the
+    result, so preprocess and postprocess share one decode. shape comes
+    from the pixels if there are any, otherwise from the file header, so
+    writers that only need the size never decode the image.
+
+    Handles stand in for their path with os.path functions and open().
+    """
+
+    def __init__(self, path, pixels=None):
+        self.path = path
+        self._pixels = pixels
+        self._shape = None if pixels is None else pixels.shape
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return str(self.path)
+
+    def __repr__(self):
+        return 'ImageHandle({!r}, decoded={})'.format(
+            self.path, self._pixels is not None)
+
+    @property
+    def decoded(self):
+        return self._pixels is not None
+
+    @property
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = cv2.imread(self.path)
+            if self._pixels is not None:
+                self._shape = self._pixels.shape
+        return self._pixels
+
+    @property
+    def shape(self):
+        """(height, width, channels) as cv2.imread decodes the image"""
+        if self._shape is None:
+            size = probe_size(self.path)
+            if size is None:
+                return self.pixels.shape
+            self._shape = size + (3,)
+        return self._shape
+
+    def release(self):
+        """Lets go of the pixels, keeping their shape"""
+        self._pixels = None
+
+
+def as_handle(im):
+    """wraps a path or pixels in an ImageHandle, handles are returned as is"""
+    if isinstance(im, ImageHandle):
+        return im
+    if isinstance(im, (str, os.PathLike)):
+        return ImageHandle(os.fspath(im))
+    return ImageHandle(None, im)
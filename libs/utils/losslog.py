@@ -0,0 +1,54 @@
+"""
+append-only training loss history
+"""
+import struct
+
+# step, loss, moving average loss
+RECORD = struct.Struct('<Qdd')
+
+
+class LossLog(object):
+    """
+    Appends one fixed size (step, loss, moving average) record per
+    training step to a binary file, so saving a checkpoint never has
+    to rewrite the history that came before it. A record torn by a
+    crash mid-write is cut off on open, so the records after it line up.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        torn = self.file.tell() % RECORD.size
+        if torn:
+            self.file.truncate(self.file.tell() - torn)
+
+    def append(self, step, loss, loss_mva):
+        self.file.write(RECORD.pack(step, loss, loss_mva))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_log(path):
+    """returns every (step, loss, moving average) record in path"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = len(data) - len(data) % RECORD.size  # ignore a torn last record
+    return list(RECORD.iter_unpack(data[:end]))
+
+
+def read_profile(path, step=None, start=0):
+    """
+    Rebuilds the [(loss, moving average), ...] list that used to be pickled
+    as <model>-<step>.profile, covering steps after start up to step.
+    When a run resumed from an earlier checkpoint the latest record for a
+    step wins, so the result follows the history that led to step.
+    """
+    latest = dict()
+    for record_step, loss, loss_mva in read_log(path):
+        latest[record_step] = (loss, loss_mva)
+    return [latest[s] for s in sorted(latest)
+            if s > start and (step is None or s <= step)]
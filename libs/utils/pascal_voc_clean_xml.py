@@ -2,63 +2,159 @@
 parse PASCAL VOC xml annotations
 """
 import os
+import pickle
+from multiprocessing import Pool
 import xml.etree.ElementTree as ET
-import glob
+from collections import Counter
 
+INDEX_VERSION = 1
+# below this many changed files a process pool costs more than it saves
+POOL_THRESHOLD = 64
 
-def pascal_voc_clean_xml(self, ANN, pick, exclusive=False):
+
+def _parse_xml(path):
+    """
+    Parse one annotation file into [jpg, [w, h, all]] where all holds every
+    object regardless of label so the result can be cached once and filtered
+    for any set of labels later.
+    """
+    with open(path) as in_file:
+        tree = ET.parse(in_file)
+    root = tree.getroot()
+    jpg = str(root.find('filename').text)
+    imsize = root.find('size')
+    w = int(imsize.find('width').text)
+    h = int(imsize.find('height').text)
+    all = list()
+
+    for obj in root.iter('object'):
+        name = obj.find('name').text
+        xmlbox = obj.find('bndbox')
+        xn = int(float(xmlbox.find('xmin').text))
+        xx = int(float(xmlbox.find('xmax').text))
+        yn = int(float(xmlbox.find('ymin').text))
+        yx = int(float(xmlbox.find('ymax').text))
+        all += [[name, xn, yn, xx, yx]]
+
+    return [jpg, [w, h, all]]
+
+
+def _load_index(path):
+    """Returns a previously saved annotation index or an empty one"""
+    empty = {'version': INDEX_VERSION, 'files': dict(), 'stat': Counter()}
+    if path is None:
+        return empty
+    try:
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return empty
+    if not isinstance(index, dict) or \
+            index.get('version') != INDEX_VERSION:
+        return empty
+    return index
+
+
+def _save_index(path, index):
+    """Write the index next to the annotations without leaving partial files"""
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp, 'wb') as f:
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def _names(record):
+    return Counter(obj[0] for obj in record[1][2])
+
+
+def _parse_all(paths, processes=None):
+    """Parse paths in a process pool returning records in the same order"""
+    if len(paths) < POOL_THRESHOLD or processes == 1:
+        return [_parse_xml(path) for path in paths]
+    processes = processes or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (processes * 4))
+    with Pool(processes) as pool:
+        return pool.map(_parse_xml, paths, chunksize)
+
+
+def pascal_voc_clean_xml(self, ANN, pick, exclusive=False, index=None,
+                         processes=None):
+    """
+    Parse every .xml file in ANN keeping only the objects labelled in pick.
+
+    Files are addressed by absolute path so the working directory is never
+    changed, which makes this safe to call from any thread. Parsing is fanned
+    out over a pool of processes (all cores unless processes is given) and
+    the results are merged in sorted file name order.
+
+    If index is a path, parsed annotations are cached there keyed by file
+    name, modification time and size so that only new or changed files are
+    parsed again and the per-class statistics are updated incrementally.
+    """
     self.logger.info('Parsing for {} {}'.format(
             pick, 'exclusively' * int(exclusive)))
 
+    ANN = os.path.abspath(ANN)
+    cache = _load_index(index)
+    files, stat = cache['files'], cache['stat']
+    with os.scandir(ANN) as it:
+        entries = {e.name: e for e in it
+                   if e.name.endswith('.xml') and e.is_file()}
+    annotations = sorted(entries)
+
+    # forget files that were removed since the index was written
+    dirty = False
+    for file in set(files).difference(annotations):
+        stat.subtract(_names(files.pop(file)[2]))
+        dirty = True
+
+    changed = list()
+    for file in annotations:
+        st = entries[file].stat()
+        key = (st.st_mtime_ns, st.st_size)
+        entry = files.get(file)
+        if entry is not None and entry[:2] == key:
+            continue
+        if entry is not None:
+            stat.subtract(_names(entry[2]))
+        files[file] = key
+        changed.append(file)
+
+    paths = [os.path.join(ANN, file) for file in changed]
+    for file, record in zip(changed, _parse_all(paths, processes)):
+        stat.update(_names(record))
+        files[file] = files[file] + (record,)
+        dirty = True
+
+    if index is not None:
+        self.logger.info('Parsed {} new or changed of {} annotation(s)'.format(
+            len(changed), len(annotations)))
+        if dirty:
+            # the index only saves work next time, a read-only annotation
+            # directory must not throw away what was just parsed
+            try:
+                _save_index(index, cache)
+            except OSError as e:
+                self.logger.warning(
+                    'Could not save the annotation index: {}'.format(e))
+
     dumps = list()
-    cur_dir = os.getcwd()
-    os.chdir(ANN)
-    annotations = os.listdir('.')
-    annotations = glob.glob(str(annotations)+'*.xml')
-    size = len(annotations)
-
-    for i, file in enumerate(annotations):
-        with open(file) as in_file:
-            tree = ET.parse(in_file)
-            root = tree.getroot()
-            jpg = str(root.find('filename').text)
-            imsize = root.find('size')
-            w = int(imsize.find('width').text)
-            h = int(imsize.find('height').text)
-            all = list()
-
-            for obj in root.iter('object'):
-                # noinspection PyUnusedLocal
-                current = list()
-                name = obj.find('name').text
-                if name not in pick:
-                    continue
-
-                xmlbox = obj.find('bndbox')
-                xn = int(float(xmlbox.find('xmin').text))
-                xx = int(float(xmlbox.find('xmax').text))
-                yn = int(float(xmlbox.find('ymin').text))
-                yx = int(float(xmlbox.find('ymax').text))
-                current = [name, xn, yn, xx, yx]
-                all += [current]
-
-            add = [[jpg, [w, h, all]]]
-            dumps += add
+    for file in annotations:
+        jpg, (w, h, all) = files[file][2]
+        all = [list(current) for current in all if current[0] in pick]
+        dumps += [[jpg, [w, h, all]]]
 
     # gather all stats
-    stat = dict()
-    for dump in dumps:
-        all = dump[1][2]
-        for current in all:
-            if current[0] in pick:
-                if current[0] in stat:
-                    stat[current[0]] += 1
-                else:
-                    stat[current[0]] = 1
     count = 0
-    for i in stat:
-        self.logger.info('{}: {}'.format(i, stat[i]))
-        count += stat[i]
+    for i in pick:
+        if stat[i] > 0:
+            self.logger.info('{}: {}'.format(i, stat[i]))
+            count += stat[i]
     try:
         assert count >= len(dumps), \
             "There are {} images but only {} annotations".format(
@@ -70,5 +166,4 @@ def pascal_voc_clean_xml(self, ANN, pick, exclusive=False):
         raise
     self.logger.info('Dataset size: {}'.format(len(dumps)))
 
-    os.chdir(cur_dir)
     return dumps
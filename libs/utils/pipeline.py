@@ -0,0 +1,153 @@
+"""
+run items through a chain of threaded stages joined by bounded queues
+"""
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Stage(object):
+    """
+    One step of a Pipeline: fn is applied by workers threads to each
+    item, or to lists of up to batch items when batch > 1, in which case
+    fn returns a list of items to pass on.
+
+    items counts the items the stage has finished and busy is the total
+    time its workers spent in fn, so items / busy is what the stage
+    could sustain on its own.
+    """
+
+    def __init__(self, name, fn, workers=1, batch=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.batch = max(1, int(batch))
+        self.items = 0
+        self.busy = 0.
+        self._lock = threading.Lock()
+
+    def throughput(self):
+        return self.items / self.busy if self.busy else 0.
+
+    def _count(self, items, busy):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+
+
+class Pipeline(object):
+    """
+    Feeds items from a source through each stage in turn, every stage
+    running in its own threads, with at most depth items waiting between
+    two stages so a slow stage holds the ones before it back instead of
+    piling up memory. Stages overlap: while one batch runs through the
+    net the next is being read and the last one post processed.
+
+    Outputs come out in the order they finish, which is the input order
+    only if every stage has a single worker. The first error raised by a
+    stage stops the pipeline and is raised again to the caller.
+    """
+
+    def __init__(self, stages, depth=4):
+        self.stages = stages
+        self.depth = max(1, int(depth))
+        self.wall = 0.
+        self._stop = threading.Event()
+        self._error = None
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fail(self, e):
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _feed(self, source, out):
+        try:
+            for item in source:
+                if not self._put(out, item):
+                    return
+        except Exception as e:
+            self._fail(e)
+            return
+        self._put(out, _DONE)
+
+    def _work(self, stage, inp, out, finished):
+        done = False
+        while not done:
+            items = list()
+            while len(items) < stage.batch:
+                item = self._get(inp)
+                if item is _DONE:
+                    done = True
+                    break
+                items.append(item)
+            if self._stop.is_set():
+                return
+            if items:
+                start = time.time()
+                try:
+                    if stage.batch > 1:
+                        results = stage.fn(items)
+                    else:
+                        results = [stage.fn(items[0])]
+                except Exception as e:
+                    self._fail(e)
+                    return
+                stage._count(len(items), time.time() - start)
+                for result in results:
+                    if not self._put(out, result):
+                        return
+        # let the other workers of this stage see the end too,
+        # the last one out passes it on
+        self._put(inp, _DONE)
+        if finished.acquire(blocking=False):
+            return
+        self._put(out, _DONE)
+
+    def __call__(self, source):
+        """Yields what the last stage returns for every item of source"""
+        queues = [queue.Queue(self.depth) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed,
+                                    args=(source, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            # released once per worker but the last
+            finished = threading.Semaphore(stage.workers - 1)
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], queues[i + 1], finished),
+                    daemon=True))
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall = time.time() - start
+        if self._error is not None:
+            raise self._error
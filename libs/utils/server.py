@@ -0,0 +1,89 @@
+"""
+serve predictions over localhost HTTP or a Unix socket
+"""
+import os
+import json
+import stat
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import numpy as np
+import cv2
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with an encoded image as the body answers with the
+    detections return_predict gives for it, as JSON.
+    GET /stats answers with the batcher's stats.
+    """
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._reply(200, self.server.batcher.stats())
+        else:
+            self._reply(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/predict':
+            self._reply(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        data = np.frombuffer(self.rfile.read(length), np.uint8)
+        im = cv2.imdecode(data, cv2.IMREAD_COLOR) if length else None
+        if im is None:
+            self._reply(400, {'error': 'Could not decode the image'})
+            return
+        try:
+            result = self.server.batcher(im)
+        except Exception as e:
+            self.server.logger.exception('Prediction failed')
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, result)
+
+    def log_message(self, format, *args):
+        # client_address is empty on a Unix socket
+        self.server.logger.debug(format % args)
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_server(batcher, host='127.0.0.1', port=0, socket_path=None,
+                logger=None):
+    """
+    returns a threaded server answering PredictHandler requests through
+    batcher, bound to socket_path if given or else host:port, port 0
+    picks a free one. Call serve_forever() on it to start answering.
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise FileExistsError(
+                    '{} exists and is not a socket'.format(socket_path))
+            os.remove(socket_path)  # left behind by a server that died
+        server = _UnixServer(socket_path, PredictHandler)
+    else:
+        server = _HTTPServer((host, port), PredictHandler)
+    server.batcher = batcher
+    server.logger = logger or logging.getLogger('server')
+    return server
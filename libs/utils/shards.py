@@ -0,0 +1,211 @@
+"""
+pack committed frames and their annotations into size bounded shards
+"""
+import os
+import pickle
+import struct
+import numpy as np
+from .pascal_voc_clean_xml import _parse_all
+
+MANIFEST = '.shards.manifest'
+MANIFEST_VERSION = 1
+MAGIC = b'SLGR'
+# magic, name length, image length, width, height, number of boxes
+HEADER = struct.Struct('<4sHIIII')
+
+
+def _load_manifest(path):
+    empty = {'version': MANIFEST_VERSION, 'labels': list(),
+             'shards': list(), 'frames': dict()}
+    try:
+        with open(path, 'rb') as f:
+            manifest = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return empty
+    if manifest.get('version') != MANIFEST_VERSION:
+        return empty
+    return manifest
+
+
+def _save_manifest(path, manifest):
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'wb') as f:
+        pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
+
+
+def _pack(name, image, w, h, boxes):
+    """Serialise one frame as header, name, encoded image and boxes"""
+    name = name.encode('utf-8')
+    boxes = np.ascontiguousarray(boxes, '<i4').reshape(-1, 5)
+    return b''.join([HEADER.pack(MAGIC, len(name), len(image), w, h,
+                                 len(boxes)), name, image, boxes.tobytes()])
+
+
+def _unpack(f):
+    """Read the record at f's position, returns None at the end of f"""
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    magic, n_name, n_image, w, h, n_boxes = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('Corrupt shard {} at {}'.format(
+            f.name, f.tell() - HEADER.size))
+    name = f.read(n_name).decode('utf-8')
+    image = f.read(n_image)
+    boxes = np.frombuffer(f.read(n_boxes * 20), '<i4').reshape(-1, 5)
+    return name, image, w, h, boxes
+
+
+def export_shards(dataset, annotation, out, shard_bytes=256 << 20,
+                  logger=None, processes=None):
+    """
+    Pack every annotated frame into shards of about shard_bytes in out.
+
+    Each record holds the frame name, the encoded image as it is on disk,
+    its width and height and an int32 [n, 5] array of (label, xmin, ymin,
+    xmax, ymax) rows, where label indexes the manifest's label table.
+    The manifest maps frame names to (shard, offset) and remembers the
+    annotation and image stats, so later exports only append new or
+    changed frames to the last shard and forget removed ones.
+    returns the number of frames written
+    """
+    def log(msg):
+        if logger is not None:
+            logger.info(msg)
+
+    os.makedirs(out, exist_ok=True)
+    manifest_path = os.path.join(out, MANIFEST)
+    manifest = _load_manifest(manifest_path)
+    labels, shards, frames = (manifest['labels'], manifest['shards'],
+                              manifest['frames'])
+
+    annotation = os.path.abspath(annotation)
+    with os.scandir(annotation) as it:
+        entries = {e.name: e for e in it
+                   if e.name.endswith('.xml') and e.is_file()}
+    for name in set(frames).difference(entries):
+        del frames[name]
+
+    # an image can change without its annotation so check both
+    candidates = list()
+    for name in sorted(entries):
+        st = entries[name].stat()
+        key = (st.st_mtime_ns, st.st_size)
+        frame = frames.get(name)
+        if frame is not None and frame['xml'] == key:
+            try:
+                st = os.stat(os.path.join(dataset, frame['record'][0]))
+            except FileNotFoundError:
+                del frames[name]
+                continue
+            if frame['image'] == (st.st_mtime_ns, st.st_size):
+                continue
+        candidates.append((name, key))
+
+    records = _parse_all([os.path.join(annotation, name)
+                          for name, _ in candidates], processes)
+    written = 0
+    f = None
+    try:
+        for (name, key), record in zip(candidates, records):
+            jpg, (w, h, allobj) = record
+            path = os.path.join(dataset, jpg)
+            try:
+                st = os.stat(path)
+                with open(path, 'rb') as image_file:
+                    image = image_file.read()
+            except FileNotFoundError:
+                log('Skipping {}, {} not found'.format(name, path))
+                frames.pop(name, None)
+                continue
+            for obj in allobj:
+                if obj[0] not in labels:
+                    labels.append(obj[0])
+            boxes = [[labels.index(obj[0])] + obj[1:5] for obj in allobj]
+            data = _pack(jpg, image, w, h, boxes)
+
+            full = f is not None and f.tell() and \
+                f.tell() + len(data) > shard_bytes
+            if f is None or full:
+                if f is not None:
+                    f.close()
+                if full or not shards or shards[-1]['bytes'] >= shard_bytes:
+                    shards.append({'file': 'shard-{:05}.rec'.format(
+                        len(shards)), 'bytes': 0})
+                f = open(os.path.join(out, shards[-1]['file']), 'ab')
+                # drop what an export killed mid-write left past the
+                # last record the manifest knows of
+                if f.tell() > shards[-1]['bytes']:
+                    f.truncate(shards[-1]['bytes'])
+                    f.seek(shards[-1]['bytes'])
+            offset = f.tell()
+            f.write(data)
+            # the manifest only learns of records written in full
+            frames[name] = {'shard': len(shards) - 1, 'offset': offset,
+                            'length': len(data), 'xml': key,
+                            'image': (st.st_mtime_ns, st.st_size),
+                            'record': record}
+            shards[-1]['bytes'] = f.tell()
+            written += 1
+    finally:
+        if f is not None:
+            f.close()
+        _save_manifest(manifest_path, manifest)
+
+    total = sum(shard['bytes'] for shard in shards)
+    stale = total - sum(frame['length'] for frame in frames.values())
+    log('Wrote {} new or changed of {} frame(s) to {} shard(s) in {}'.format(
+        written, len(frames), len(shards), out))
+    if stale * 2 > total:
+        log('{:.0f}% of the shards hold stale records, export with '
+            '--rebuild to reclaim the space'.format(100. * stale / total))
+    return written
+
+
+class ShardReader(object):
+    """
+    Reads frames back from the shards written by export_shards,
+    one shard at a time from start to end. Only the offsets in the
+    manifest are read, so stale records and anything a killed export
+    left behind are never looked at.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = _load_manifest(os.path.join(path, MANIFEST))
+        self.labels = self.manifest['labels']
+        self.offsets = dict()
+        for frame in self.manifest['frames'].values():
+            self.offsets.setdefault(frame['shard'], list()).append(
+                frame['offset'])
+        for offsets in self.offsets.values():
+            offsets.sort()
+
+    def __len__(self):
+        return sum(len(offsets) for offsets in self.offsets.values())
+
+    def records(self):
+        """returns the parsed annotation of every frame in sorted order"""
+        frames = self.manifest['frames']
+        return [frames[name]['record'] for name in sorted(frames)]
+
+    def read(self, shard):
+        """Yields (name, image bytes, w, h, boxes) for a shard's frames"""
+        file = self.manifest['shards'][shard]['file']
+        with open(os.path.join(self.path, file), 'rb',
+                  buffering=1 << 20) as f:
+            for offset in self.offsets.get(shard, ()):
+                f.seek(offset)
+                record = _unpack(f)
+                if record is None:
+                    raise ValueError('Truncated shard {} at {}'.format(
+                        f.name, offset))
+                yield record
+
+    def __call__(self, order=None):
+        """Yields every live frame, reading shards in the given order"""
+        if order is None:
+            order = range(len(self.manifest['shards']))
+        for shard in order:
+            yield from self.read(shard)
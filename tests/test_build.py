@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+from libs.utils.flags import Flags, FlagIO
+try:
+    from libs.net.build import TFNet
+except ImportError:  # needs tensorflow 1.x with contrib
+    TFNet = None
+
+
+def _fake_trial(graph_def, names, config, batches, passes):
+    """intra 2 inter 1 wins, the bigger its batch the better"""
+    fast = config['intra_op_parallelism_threads'] == 2 and \
+        config['inter_op_parallelism_threads'] == 1
+    return [float(batch) if fast else 0.5 for batch in batches]
+
+
+@unittest.skipIf(TFNet is None, 'tensorflow 1.x is not installed')
+class TestBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        os.chdir(self.root)
+        os.makedirs(os.path.join('data', 'logs'))
+        with open('labels.txt', 'w') as f:
+            f.write('a\nb\nc\nd\n')
+        self.flagfile = FlagIO.flagfile
+        FlagIO.flagfile = '.test.{}.flags.pkl'.format(os.getpid())
+
+    def tearDown(self):
+        FlagIO.flagfile = self.flagfile
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def _net(self, **kwargs):
+        flags = Flags()
+        flags.model = os.path.join(dir_name, '..', 'data', 'cfg',
+                                   'tiny-yolov2.cfg')
+        flags.labels = 'labels.txt'
+        flags.load = 0
+        flags.batch = 4
+        flags.threads = 'tune'
+        flags.threads_file = 'threads.json'
+        flags.update(kwargs)
+        io = FlagIO()
+        io.flags = flags
+        io.send_flags()
+        self.addCleanup(io.cleanup_ramdisk)
+        return TFNet(flags)
+
+    def test_session_gets_winner(self):
+        with mock.patch.object(TFNet, '_time_trial',
+                               staticmethod(_fake_trial)):
+            net = self._net()
+        config = net.sess._config
+        self.assertEqual(config.intra_op_parallelism_threads, 2)
+        self.assertEqual(config.inter_op_parallelism_threads, 1)
+        self.assertEqual(net.flags.batch, 8)
+        with open('threads.json') as f:
+            tuned, = json.load(f).values()
+        self.assertEqual((tuned['intra'], tuned['inter'], tuned['batch']),
+                         (2, 1, 8))
+
+    def test_trial(self):
+        with mock.patch.object(TFNet, '_time_trial',
+                               staticmethod(_fake_trial)):
+            net = self._net()
+        init = net.graph.get_operation_by_name('init')
+        graph_def = net.graph.as_graph_def().SerializeToString()
+        config = dict(intra_op_parallelism_threads=1,
+                      inter_op_parallelism_threads=1)
+        rates = TFNet._time_trial(graph_def, (init.name, net.inp.name,
+                                              net.out.name),
+                                  config, [1, 2], 1)
+        self.assertEqual(len(rates), 2)
+        self.assertTrue(all(rate > 0 for rate in rates))
+
+    def test_empty_tower(self):
+        with self.assertRaises(ValueError):
+            self._net(train=True, towers=4, batch=3, threads='default')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.control import ControlSlot
+
+
+class TestControlSlot(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_shared(self):
+        trainer, gui = ControlSlot(self.path), ControlSlot(self.path)
+        self.assertEqual((gui.progress, gui.step, gui.kill, gui.done),
+                         (0., 0, False, False))
+        trainer.step = 1234
+        trainer.progress = 42.5
+        gui.kill = True
+        self.assertEqual((gui.step, gui.progress), (1234, 42.5))
+        self.assertTrue(trainer.kill)
+        trainer.reset()
+        self.assertEqual((gui.progress, gui.kill), (0., False))
+        with self.assertRaises(AttributeError):
+            gui.speed
+        trainer.close()
+        gui.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.featcache import FeatureCache
+
+
+class TestFeatureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.names = ['{}.jpg'.format(i) for i in range(5)]
+        self.rows = rng.rand(5, 3, 3, 4).astype(np.float32)
+        self.stamps = {name: (i, 10) for i, name in enumerate(self.names)}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_put_get(self):
+        cache = FeatureCache(self.root, 'abc', (3, 3, 4))
+        self.assertEqual(sorted(cache.missing(self.stamps)), self.names)
+        cache.put(self.names[:2], self.stamps, self.rows[:2])
+        cache.put(self.names[2:], self.stamps, self.rows[2:])
+        cache.save()
+
+        cache = FeatureCache(self.root, 'abc', (3, 3, 4))
+        self.assertEqual(cache.missing(self.stamps), [])
+        self.assertEqual(len(cache), 5)
+        np.testing.assert_array_equal(
+            cache.get(['4.jpg', '0.jpg', '2.jpg']), self.rows[[4, 0, 2]])
+
+    def test_stale(self):
+        cache = FeatureCache(self.root, 'abc', (3, 3, 4))
+        cache.put(self.names, self.stamps, self.rows)
+        self.stamps['1.jpg'] = (1, 11)
+        self.assertEqual(cache.missing(self.stamps), ['1.jpg'])
+        cache.put(['1.jpg'], self.stamps, self.rows[:1])
+        np.testing.assert_array_equal(cache.get(['1.jpg']), self.rows[:1])
+        np.testing.assert_array_equal(cache.get(['2.jpg']), self.rows[2:3])
+
+    def test_key(self):
+        cache = FeatureCache(self.root, 'abc', (3, 3, 4))
+        cache.put(self.names, self.stamps, self.rows)
+        cache.save()
+        # other frozen weights get a cache of their own
+        other = FeatureCache(self.root, 'def', (3, 3, 4))
+        self.assertEqual(len(other.missing(self.stamps)), 5)
+        self.assertNotEqual(other.path, cache.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+import numpy as np
+from utils.feeder import BatchFeeder
+from utils.im_transform import imcv2_augment
+
+
+class _Framework(object):
+    """Assembles a batch by summing its chunks, slowly for odd batches"""
+    def assemble(self, chunks):
+        if sum(chunks) % 2:
+            time.sleep(0.05)
+        if -1 in chunks:
+            raise ValueError('bad chunk')
+        return sum(chunks), len(chunks)
+
+
+class _Augmenter(object):
+    """Augments the same frame for every index, noting which worker did"""
+    def assemble(self, chunks):
+        time.sleep(0.05)
+        im = np.full((16, 16, 3), 128, np.uint8)
+        scale, offs, flip = imcv2_augment(im, (8, 8))[2]
+        return os.getpid(), (scale, tuple(offs), flip)
+
+
+class TestBatchFeeder(unittest.TestCase):
+
+    def test_order(self):
+        data = list(range(100))
+        indices = [[i, i + 1] for i in range(0, 100, 2)]
+        feeder = BatchFeeder(_Framework(), data, workers=3, prefetch=2)
+        try:
+            out = list(feeder(indices))
+        finally:
+            feeder.close()
+        self.assertEqual(out, [(2 * i + 1, 2) for i in range(0, 100, 2)])
+        self.assertEqual(feeder.fetched, 50)
+        self.assertGreater(feeder.waits, 0)
+        self.assertLessEqual(feeder.waits, 50)
+
+    def test_error(self):
+        feeder = BatchFeeder(_Framework(), [0, 1, -1], workers=2)
+        try:
+            with self.assertRaises(ValueError):
+                list(feeder([[0], [1], [2]]))
+        finally:
+            feeder.close()
+
+    def test_worker_seeds(self):
+        for seed in (None, 7):
+            feeder = BatchFeeder(_Augmenter(), None, workers=2, seed=seed)
+            try:
+                out = list(feeder([[0]] * 8))
+            finally:
+                feeder.close()
+            first = dict()
+            for pid, params in out:
+                first.setdefault(pid, params)
+            self.assertEqual(len(first), 2)
+            # the first draw of each worker is its own
+            self.assertNotEqual(*first.values())
+
+
+if __name__ == '__main__':
+    unittest.main()
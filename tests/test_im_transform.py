@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.im_transform import imcv2_affine_trans, imcv2_recolor, imcv2_augment
+
+
+class TestAugment(unittest.TestCase):
+
+    def setUp(self):
+        noise = np.random.RandomState(0).rand(375, 500, 3) * 255
+        self.im = cv2.GaussianBlur(noise.astype(np.uint8), (31, 31), 8)
+
+    def test_matches_separate_passes(self):
+        for seed in range(4):
+            np.random.seed(seed)
+            old, dims, param = imcv2_affine_trans(self.im)
+            old = cv2.resize(imcv2_recolor(old), (416, 320))
+            np.random.seed(seed)
+            new, new_dims, new_param = imcv2_augment(self.im, (416, 320))
+            self.assertEqual(new.shape, (320, 416, 3))
+            self.assertEqual(new.dtype, np.uint8)
+            self.assertEqual((dims, param), (new_dims, new_param))
+            diff = np.abs(old.astype(np.float64) - new)
+            self.assertLess(diff.mean(), 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import cv2
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.imcache import ImageCache
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = dict()
+        for i, (h, w) in enumerate([(48, 64), (30, 20), (64, 64)]):
+            name = '{}.png'.format(i)
+            im = rng.randint(0, 256, (h, w, 3)).astype(np.uint8)
+            cv2.imwrite(os.path.join(self.dataset, name), im)
+            self.frames[name] = im
+
+    def tearDown(self):
+        shutil.rmtree(self.dataset)
+
+    def test_full_size(self):
+        cache = ImageCache(self.dataset)
+        self.assertEqual(cache.build(sorted(self.frames)), 3)
+        cache = ImageCache(self.dataset)
+        for name, im in self.frames.items():
+            cached = cache.get(name)
+            self.assertIs(type(cached), np.ndarray)
+            self.assertFalse(cached.flags.writeable)
+            np.testing.assert_array_equal(cached, im)
+        self.assertIsNone(cache.get('missing.png'))
+
+    def test_incremental(self):
+        cache = ImageCache(self.dataset)
+        cache.build(['0.png', '1.png'])
+        self.assertEqual(cache.build(['0.png', '1.png', '2.png']), 1)
+        self.assertEqual(cache.build(sorted(self.frames)), 0)
+        for name, im in self.frames.items():
+            np.testing.assert_array_equal(cache.get(name), im)
+
+    def test_max_side(self):
+        cache = ImageCache(self.dataset, max_side=32)
+        cache.build(sorted(self.frames))
+        self.assertEqual(cache.get('0.png').shape, (24, 32, 3))
+        self.assertEqual(cache.get('1.png').shape, (30, 20, 3))
+        self.assertEqual(cache.get('2.png').shape, (32, 32, 3))
+        # a different max_side starts the cache over
+        cache = ImageCache(self.dataset)
+        self.assertEqual(cache.build(sorted(self.frames)), 3)
+        np.testing.assert_array_equal(cache.get('0.png'), self.frames['0.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+import cv2
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.imhandle import ImageHandle, as_handle, probe_size
+
+
+def _rotated(jpeg, orientation):
+    """returns the jpeg with an EXIF orientation tag in front"""
+    ifd = struct.pack('>H', 1) + struct.pack('>HHIHH', 0x0112, 3, 1,
+                                             orientation, 0)
+    exif = b'Exif\x00\x00MM' + struct.pack('>HI', 42, 8) + ifd + bytes(4)
+    return jpeg[:2] + b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + \
+        exif + jpeg[2:]
+
+
+class TestImageHandle(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pixels = np.random.RandomState(0).randint(
+            0, 255, (30, 50, 3)).astype(np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, name):
+        path = os.path.join(self.root, name)
+        cv2.imwrite(path, self.pixels)
+        return path
+
+    def test_probe(self):
+        for name in ['a.jpg', 'a.png']:
+            path = self._write(name)
+            self.assertEqual(probe_size(path), cv2.imread(path).shape[:2])
+        self.assertIsNone(probe_size(self._write('a.bmp')))
+
+    def test_exif_orientation(self):
+        with open(self._write('a.jpg'), 'rb') as f:
+            jpeg = f.read()
+        for orientation, size in [(1, (30, 50)), (6, (50, 30))]:
+            path = os.path.join(self.root, 'r{}.jpg'.format(orientation))
+            with open(path, 'wb') as f:
+                f.write(_rotated(jpeg, orientation))
+            self.assertEqual(probe_size(path), size)
+            self.assertEqual(cv2.imread(path).shape[:2], size)
+        # camera JPEGs often carry XMP in a later APP1 segment
+        xmp = b'http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>'
+        rotated = _rotated(jpeg, 6)
+        at = len(rotated) - len(jpeg) + 2
+        path = os.path.join(self.root, 'xmp.jpg')
+        with open(path, 'wb') as f:
+            f.write(rotated[:at] + b'\xff\xe1' +
+                    struct.pack('>H', len(xmp) + 2) + xmp + rotated[at:])
+        self.assertEqual(probe_size(path), (50, 30))
+        self.assertEqual(cv2.imread(path).shape[:2], (50, 30))
+
+    def test_decode_once(self):
+        handle = ImageHandle(self._write('a.png'))
+        self.assertEqual(handle.shape, (30, 50, 3))
+        self.assertFalse(handle.decoded)
+        pixels = handle.pixels
+        np.testing.assert_array_equal(pixels, self.pixels)
+        self.assertIs(handle.pixels, pixels)
+        handle.release()
+        self.assertFalse(handle.decoded)
+        self.assertEqual(handle.shape, (30, 50, 3))
+        # unknown headers are decoded for their shape
+        handle = ImageHandle(self._write('a.bmp'))
+        self.assertEqual(handle.shape, (30, 50, 3))
+        self.assertTrue(handle.decoded)
+
+    def test_as_handle(self):
+        path = self._write('a.png')
+        handle = as_handle(path)
+        self.assertIs(as_handle(handle), handle)
+        self.assertEqual(os.path.basename(handle), 'a.png')
+        self.assertIs(as_handle(self.pixels).pixels, self.pixels)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.losslog import LossLog, read_log, read_profile
+
+
+class TestLossLog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'model.losslog')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, steps):
+        log = LossLog(self.path)
+        for step in steps:
+            log.append(step, step * 2., step * 3.)
+        log.close()
+
+    def test_profile(self):
+        self.write(range(1, 11))
+        self.assertEqual(len(read_log(self.path)), 10)
+        self.assertEqual(read_profile(self.path, 4),
+                         [(2., 3.), (4., 6.), (6., 9.), (8., 12.)])
+        self.assertEqual(len(read_profile(self.path)), 10)
+        self.assertEqual(read_profile(self.path, 10, start=8),
+                         [(18., 27.), (20., 30.)])
+
+    def test_resumed_run(self):
+        self.write(range(1, 6))
+        # a second run resumed from step 3 overwrites steps 4 and 5
+        log = LossLog(self.path)
+        for step in range(4, 7):
+            log.append(step, -1., -1.)
+        log.close()
+        self.assertEqual(read_profile(self.path, 6)[3:],
+                         [(-1., -1.)] * 3)
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * 5)
+        self.assertEqual(len(read_log(self.path)), 8)
+
+    def test_torn_record(self):
+        self.write(range(1, 4))
+        with open(self.path, 'ab') as f:
+            f.write(b'\1' * 5)  # a crash mid-write
+        self.write(range(4, 6))
+        self.assertEqual(read_log(self.path),
+                         [(step, step * 2., step * 3.)
+                          for step in range(1, 6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+from libs.utils.box import BoundBox, DETECTION, bound_boxes, box_iou
+try:
+    from libs.cython_utils.nms import NMS, suppress
+except ImportError:  # extensions not built
+    suppress = None
+
+
+def candidates(rng, n, classes):
+    probs = rng.rand(n, classes).astype(np.float32)
+    probs[probs < .8] = 0.
+    bbox = np.empty((n, 5), np.float32)
+    bbox[:, :2] = rng.rand(n, 2)
+    bbox[:, 2:4] = rng.uniform(.05, .3, (n, 2))
+    bbox[:, 4] = rng.rand(n)
+    return probs, bbox
+
+
+def as_box(row):
+    box = BoundBox(1)
+    box.x, box.y, box.w, box.h = row[:4]
+    return box
+
+
+def greedy(scores, bbox, iou_threshold):
+    """returns the rows kept, highest score first, one pair at a time"""
+    keep = list()
+    for i in sorted(np.flatnonzero(scores), key=lambda i: -scores[i]):
+        if all(box_iou(as_box(bbox[i]), as_box(bbox[j])) < iou_threshold
+               for j in keep):
+            keep.append(i)
+    return sorted(keep)
+
+
+@unittest.skipIf(suppress is None, 'cython_utils are not built')
+class TestNMS(unittest.TestCase):
+
+    def setUp(self):
+        self.probs, self.bbox = candidates(np.random.RandomState(0), 200, 4)
+
+    def test_class_aware(self):
+        out = suppress(self.probs, self.bbox, .4)
+        for c in range(4):
+            kept = np.flatnonzero(out[:, c])
+            self.assertEqual(list(kept), greedy(self.probs[:, c], self.bbox,
+                                                .4))
+            np.testing.assert_array_equal(out[kept, c], self.probs[kept, c])
+
+    def test_agnostic(self):
+        out = suppress(self.probs, self.bbox, .4, 'agnostic')
+        kept = np.flatnonzero(out.any(1))
+        self.assertEqual(list(kept), greedy(self.probs.max(1), self.bbox, .4))
+        np.testing.assert_array_equal(out[kept], self.probs[kept])
+
+    def test_soft(self):
+        out = suppress(self.probs, self.bbox, mode='soft', threshold=.5)
+        # scores only ever decay and the best of each class is untouched
+        self.assertTrue(np.all(out <= self.probs))
+        for c in range(4):
+            best = np.argmax(self.probs[:, c])
+            self.assertEqual(out[best, c], self.probs[best, c])
+        self.assertTrue(np.all((out == 0) | (out > .5)))
+        # a lone box keeps its score
+        lone = np.zeros((1, 4), np.float32)
+        lone[0, 2] = .9
+        np.testing.assert_array_equal(
+            suppress(lone, self.bbox[:1], mode='soft', threshold=.5), lone)
+
+    def test_detections(self):
+        dets = NMS(self.probs, self.bbox, .4)
+        out = suppress(self.probs, self.bbox, .4)
+        rows = np.flatnonzero(out.any(1))
+        self.assertEqual(dets.dtype, DETECTION)
+        self.assertEqual(len(dets), len(rows))
+        np.testing.assert_array_equal(dets['x'], self.bbox[rows, 0])
+        np.testing.assert_array_equal(dets['conf'], self.bbox[rows, 4])
+        np.testing.assert_array_equal(dets['class'], out[rows].argmax(1))
+        np.testing.assert_array_equal(dets['score'], out[rows].max(1))
+        self.assertEqual(len(NMS(np.zeros((5, 4), np.float32),
+                                 self.bbox[:5])), 0)
+
+    def test_bound_boxes(self):
+        dets = NMS(self.probs, self.bbox, .4)
+        boxes = bound_boxes(dets, 4)
+        self.assertEqual(len(boxes), len(dets))
+        for box, det in zip(boxes, dets):
+            self.assertAlmostEqual(box.w, det['w'], places=6)
+            self.assertEqual(np.argmax(box.probs), det['class'])
+            self.assertAlmostEqual(box.probs.max(), det['score'], places=6)
+
+    def test_mode(self):
+        with self.assertRaises(ValueError):
+            suppress(self.probs, self.bbox, mode='fast')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.pipeline import Pipeline, Stage
+
+
+def _slow_square(x):
+    if x % 3 == 0:
+        time.sleep(0.01)
+    if x < 0:
+        raise ValueError('bad item')
+    return x * x
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_outputs(self):
+        batches = list()
+
+        def add_one(items):
+            batches.append(len(items))
+            return [x + 1 for x in items]
+
+        stages = [Stage('square', _slow_square, workers=3),
+                  Stage('add', add_one, batch=4),
+                  Stage('str', str, workers=2)]
+        pipeline = Pipeline(stages, depth=2)
+        out = list(pipeline(iter(range(50))))
+        self.assertEqual(sorted(out), sorted(str(x * x + 1)
+                                             for x in range(50)))
+        self.assertEqual(batches, [4] * 12 + [2])
+        self.assertEqual([stage.items for stage in stages], [50] * 3)
+        self.assertGreater(stages[0].throughput(), 0)
+
+    def test_order(self):
+        pipeline = Pipeline([Stage('square', _slow_square),
+                             Stage('str', str)], depth=1)
+        self.assertEqual(list(pipeline(range(20))),
+                         [str(x * x) for x in range(20)])
+
+    def test_empty(self):
+        stage = Stage('square', _slow_square, workers=2)
+        self.assertEqual(list(Pipeline([stage])(iter([]))), [])
+
+    def test_error(self):
+        pipeline = Pipeline([Stage('square', _slow_square, workers=2),
+                             Stage('str', str)])
+        with self.assertRaises(ValueError):
+            list(pipeline([1, 2, -1] + list(range(100))))
+
+    def test_close(self):
+        def endless():
+            while True:
+                yield 1
+        stage = Stage('square', _slow_square)
+        out = Pipeline([stage], depth=2)(endless())
+        self.assertEqual(next(out), 1)
+        out.close()
+        self.assertLessEqual(stage.items, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import socket
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import http.client
+import numpy as np
+import cv2
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from utils.batcher import DynamicBatcher
+from utils.server import make_server
+
+
+class _Net(object):
+    """Stands in for return_predict_batch, one box the size of each image"""
+
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.batches = list()
+
+    def __call__(self, images):
+        self.batches.append(len(images))
+        time.sleep(self.delay)
+        out = list()
+        for im in images:
+            if im.shape[0] == 13:
+                raise ValueError('unlucky image')
+            h, w = im.shape[:2]
+            out.append([{"label": "thing", "confidence": 0.5,
+                         "topleft": {"x": 0, "y": 0},
+                         "bottomright": {"x": w - 1, "y": h - 1}}])
+        return out
+
+
+class _UnixConnection(http.client.HTTPConnection):
+
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def _concurrently(fn, args):
+    results = [None] * len(args)
+
+    def run(i):
+        results[i] = fn(args[i])
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(len(args))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestDynamicBatcher(unittest.TestCase):
+
+    def test_batches(self):
+        net = _Net(delay=.02)
+        batcher = DynamicBatcher(net, max_batch=4, max_latency=.05)
+        try:
+            images = [np.zeros((20 + i, 20, 3)) for i in range(12)]
+            results = _concurrently(batcher, images)
+        finally:
+            batcher.close()
+        for i, result in enumerate(results):
+            self.assertEqual(result[0]['bottomright']['y'], 19 + i)
+        self.assertEqual(sum(net.batches), 12)
+        self.assertLessEqual(max(net.batches), 4)
+        self.assertLess(len(net.batches), 12)
+        stats = batcher.stats()
+        self.assertEqual(stats['requests'], 12)
+        self.assertEqual(stats['batches'], len(net.batches))
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertGreater(stats['latency_ms']['p99'], 0)
+
+    def test_latency_window(self):
+        batcher = DynamicBatcher(_Net(), max_batch=8, max_latency=.01)
+        try:
+            start = time.time()
+            batcher(np.zeros((4, 4, 3)))
+            self.assertLess(time.time() - start, .5)
+        finally:
+            batcher.close()
+
+    def test_error(self):
+        batcher = DynamicBatcher(_Net(), max_batch=8, max_latency=.01)
+        try:
+            with self.assertRaises(ValueError):
+                batcher(np.zeros((13, 4, 3)))
+            self.assertEqual(len(batcher(np.zeros((4, 4, 3)))), 1)
+        finally:
+            batcher.close()
+        self.assertEqual(batcher.stats()['errors'], 1)
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.batcher = DynamicBatcher(_Net(delay=.01), max_batch=4,
+                                      max_latency=.02)
+        im = np.zeros((30, 50, 3), np.uint8)
+        self.jpeg = cv2.imencode('.jpg', im)[1].tobytes()
+
+    def tearDown(self):
+        self.batcher.close()
+        shutil.rmtree(self.root)
+
+    def _serve(self, **kwargs):
+        server = make_server(self.batcher, **kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    @staticmethod
+    def _request(conn, method, path, body=None):
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        out = response.status, json.loads(response.read().decode('utf-8'))
+        conn.close()
+        return out
+
+    def test_http(self):
+        port = self._serve(port=0).server_address[1]
+
+        def post(body):
+            return self._request(http.client.HTTPConnection(
+                '127.0.0.1', port), 'POST', '/predict', body)
+        results = _concurrently(post, [self.jpeg] * 8)
+        for status, result in results:
+            self.assertEqual(status, 200)
+            self.assertEqual(result[0]['bottomright'], {'x': 49, 'y': 29})
+        self.assertEqual(post(b'not an image')[0], 400)
+
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        status, stats = self._request(conn, 'GET', '/stats')
+        self.assertEqual(status, 200)
+        self.assertEqual(stats['requests'], 8)
+        self.assertLess(stats['batches'], 8)
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        self.assertEqual(self._request(conn, 'GET', '/nothing')[0], 404)
+
+    def test_unix_socket(self):
+        path = os.path.join(self.root, 'serve.sock')
+        self._serve(socket_path=path)
+        status, result = self._request(_UnixConnection(path), 'POST',
+                                       '/predict', self.jpeg)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(result), 1)
+        status, stats = self._request(_UnixConnection(path), 'GET', '/stats')
+        self.assertEqual(stats['requests'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
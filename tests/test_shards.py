@@ -0,0 +1,108 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from pascal_voc_io import PascalVocWriter
+from utils.shards import export_shards, ShardReader
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = tempfile.mkdtemp()
+        self.out = os.path.join(self.frames, 'shards')
+
+    def tearDown(self):
+        shutil.rmtree(self.frames)
+
+    def write(self, name, boxes, value=0):
+        im = np.full((48, 64, 3), value, np.uint8)
+        cv2.imwrite(os.path.join(self.frames, name + '.jpg'), im)
+        writer = PascalVocWriter('frames', name + '.jpg', im.shape)
+        for box in boxes:
+            writer.addBndBox(*box)
+        writer.save(os.path.join(self.frames, name + '.xml'))
+
+    def export(self):
+        return export_shards(self.frames, self.frames, self.out,
+                             shard_bytes=2048, processes=1)
+
+    def read(self):
+        reader = ShardReader(self.out)
+        return {name: (cv2.imdecode(np.frombuffer(image, np.uint8), 1),
+                       w, h, [[reader.labels[b[0]]] + b[1:].tolist()
+                              for b in boxes])
+                for name, image, w, h, boxes in reader()}
+
+    def test_round_trip(self):
+        for i in range(10):
+            self.write('{:02}'.format(i), [(i, 2, 30, 40, 'face', 0),
+                                           (1, i, 20, 10, 'hand', 0)], i)
+        self.assertEqual(self.export(), 10)
+        frames = self.read()
+        self.assertEqual(sorted(frames), ['{:02}.jpg'.format(i)
+                                          for i in range(10)])
+        im, w, h, objs = frames['03.jpg']
+        self.assertEqual((w, h), (64, 48))
+        self.assertEqual(im.shape, (48, 64, 3))
+        self.assertLessEqual(np.abs(im.astype(int) - 3).max(), 1)
+        self.assertEqual(objs, [['face', 3, 2, 30, 40],
+                                ['hand', 1, 3, 20, 10]])
+        reader = ShardReader(self.out)
+        self.assertGreater(len(reader.manifest['shards']), 1)
+        self.assertEqual(reader.records()[0],
+                         ['00.jpg', [64, 48, [['face', 0, 2, 30, 40],
+                                              ['hand', 1, 0, 20, 10]]]])
+
+    def test_incremental(self):
+        for i in range(3):
+            self.write(str(i), [(1, 2, 30, 40, 'face', 0)])
+        self.export()
+        self.write('1', [(5, 6, 7, 8, 'hand', 0)])
+        path = os.path.join(self.frames, '1.xml')
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        os.remove(os.path.join(self.frames, '2.xml'))
+        self.write('3', [(9, 9, 19, 19, 'face', 0)])
+        self.assertEqual(self.export(), 2)
+        self.assertEqual(self.export(), 0)
+        frames = self.read()
+        self.assertEqual(sorted(frames), ['0.jpg', '1.jpg', '3.jpg'])
+        self.assertEqual(frames['1.jpg'][3], [['hand', 5, 6, 7, 8]])
+
+    def test_torn_export(self):
+        for i in range(2):
+            self.write(str(i), [(1, 2, 30, 40, 'face', 0)])
+        self.export()
+        shard = os.path.join(self.out, 'shard-00000.rec')
+        with open(shard, 'rb') as f:
+            data = f.read()
+        # an export killed mid-write leaves part of a record behind
+        with open(shard, 'ab') as f:
+            f.write(data[:30])
+        self.write('2', [(5, 6, 7, 8, 'hand', 0)])
+        self.assertEqual(self.export(), 1)
+        frames = self.read()
+        self.assertEqual(sorted(frames), ['0.jpg', '1.jpg', '2.jpg'])
+        self.assertEqual(frames['2.jpg'][3], [['hand', 5, 6, 7, 8]])
+        self.assertEqual(os.path.getsize(shard),
+                         ShardReader(self.out).manifest['shards'][0]['bytes'])
+
+    def test_unlisted_bytes(self):
+        self.write('0', [(1, 2, 30, 40, 'face', 0)])
+        self.export()
+        with open(os.path.join(self.out, 'shard-00000.rec'), 'ab') as f:
+            f.write(b'\0' * 64)
+        self.assertEqual(sorted(self.read()), ['0.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+libs_path = os.path.join(dir_name, '..', 'libs')
+sys.path.insert(0, libs_path)
+from pascal_voc_io import PascalVocWriter
+from utils.flags import Flags
+from utils.pascal_voc_clean_xml import pascal_voc_clean_xml
+
+
+class _Parser(object):
+    """Stands in for the framework object pascal_voc_clean_xml expects"""
+    def __init__(self):
+        self.logger = logging.getLogger('TestVocCleanXml')
+        self.flags = Flags()
+
+    def send_flags(self):
+        pass
+
+
+class TestPascalVocCleanXml(unittest.TestCase):
+
+    def setUp(self):
+        self.ann = tempfile.mkdtemp()
+        self.index = os.path.join(self.ann, '.annotations.parsed')
+        self.parser = _Parser()
+
+    def tearDown(self):
+        shutil.rmtree(self.ann)
+
+    def write(self, name, boxes):
+        writer = PascalVocWriter('frames', name + '.jpg', (480, 640, 3))
+        for box in boxes:
+            writer.addBndBox(*box)
+        writer.save(os.path.join(self.ann, name + '.xml'))
+
+    def parse(self, pick=('person', 'face')):
+        return pascal_voc_clean_xml(self.parser, self.ann, list(pick),
+                                    index=self.index)
+
+    def test_parse(self):
+        self.write('a', [(1, 2, 30, 40, 'person', 0),
+                         (5, 6, 70, 80, 'dog', 0)])
+        self.write('b', [(10, 20, 300, 400, 'face', 0)])
+        dumps = self.parse()
+        self.assertEqual(dumps, [
+            ['a.jpg', [640, 480, [['person', 1, 2, 30, 40]]]],
+            ['b.jpg', [640, 480, [['face', 10, 20, 300, 400]]]]])
+        self.assertTrue(os.path.isfile(self.index))
+        self.assertEqual(self.parse(), dumps)
+
+    def test_index_not_saved(self):
+        self.write('a', [(1, 2, 30, 40, 'person', 0)])
+        os.mkdir(self.index)  # the index can't be written in its place
+        with self.assertLogs('TestVocCleanXml', 'WARNING'):
+            dumps = self.parse()
+        self.assertEqual(dumps,
+                         [['a.jpg', [640, 480, [['person', 1, 2, 30, 40]]]]])
+        self.assertEqual(sorted(os.listdir(self.ann)),
+                         ['.annotations.parsed', 'a.xml'])
+
+    def test_incremental(self):
+        self.write('a', [(1, 2, 30, 40, 'person', 0)])
+        self.write('b', [(10, 20, 300, 400, 'face', 0)])
+        self.parse()
+        # make sure the rewrite is seen as a change on coarse clocks
+        path = os.path.join(self.ann, 'a.xml')
+        self.write('a', [(3, 4, 50, 60, 'face', 0),
+                         (7, 8, 90, 100, 'face', 0)])
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        os.remove(os.path.join(self.ann, 'b.xml'))
+        self.write('c', [(11, 12, 13, 14, 'person', 0)])
+        with self.assertLogs('TestVocCleanXml') as logs:
+            dumps = self.parse()
+        self.assertEqual([d[0] for d in dumps], ['a.jpg', 'c.jpg'])
+        self.assertEqual(dumps[0][1][2], [['face', 3, 4, 50, 60],
+                                          ['face', 7, 8, 90, 100]])
+        self.assertIn('Parsed 2 new or changed of 2 annotation(s)',
+                      '\n'.join(logs.output))
+        self.assertIn('face: 2', '\n'.join(logs.output))
+        self.assertIn('person: 1', '\n'.join(logs.output))
+
+    def test_process_pool(self):
+        for i in range(70):
+            self.write('{:03}'.format(i), [(i, i, i + 10, i + 20, 'face', 0)])
+        cwd = os.getcwd()
+        pooled = pascal_voc_clean_xml(self.parser, self.ann, ['face'],
+                                      processes=2)
+        self.assertEqual(os.getcwd(), cwd)
+        serial = pascal_voc_clean_xml(self.parser, self.ann, ['face'],
+                                      processes=1)
+        self.assertEqual(pooled, serial)
+        self.assertEqual([d[0] for d in pooled],
+                         ['{:03}.jpg'.format(i) for i in range(70)])
+
+    def test_too_few_annotations(self):
+        self.write('a', [(1, 2, 30, 40, 'person', 0)])
+        self.write('b', [(10, 20, 300, 400, 'cat', 0)])
+        with self.assertRaises(AssertionError):
+            self.parse()
+
+
+if __name__ == '__main__':
+    unittest.main()
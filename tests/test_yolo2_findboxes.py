@@ -0,0 +1,89 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+try:
+    from libs.cython_utils.cy_yolo2_findboxes import decode, box_constructor
+except ImportError:  # extensions not built
+    decode = None
+
+
+def expit(x):
+    return 1. / (1. + np.exp(-x))
+
+
+def _softmax(x):
+    e_x = np.exp(x - np.max(x))
+    out = e_x / e_x.sum()
+    return out
+
+
+def reference(meta, net_out):
+    """One anchor at a time, as the region layer is defined"""
+    H, W, _ = meta['out_size']
+    C, B = meta['classes'], meta['num']
+    anchors = meta['anchors']
+    net_out = net_out.reshape([H, W, B, 5 + C]).astype(np.float64)
+    probs, bbox = list(), list()
+    for row in range(H):
+        for col in range(W):
+            for b in range(B):
+                out = net_out[row, col, b]
+                conf = expit(out[4])
+                prob = _softmax(out[5:]) * conf
+                prob[prob <= meta['thresh']] = 0.
+                if not prob.any():
+                    continue
+                probs.append(prob)
+                bbox.append([(col + expit(out[0])) / W,
+                             (row + expit(out[1])) / H,
+                             np.exp(out[2]) * anchors[2 * b] / W,
+                             np.exp(out[3]) * anchors[2 * b + 1] / H,
+                             conf])
+    return np.array(probs).reshape(-1, C), np.array(bbox).reshape(-1, 5)
+
+
+@unittest.skipIf(decode is None, 'cython_utils are not built')
+class TestRegionDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.meta = {'out_size': [13, 11, 5 * 25], 'classes': 20, 'num': 5,
+                     'thresh': .3,
+                     'anchors': [1.08, 1.19, 3.42, 4.41, 6.63, 11.38,
+                                 9.42, 5.11, 16.62, 10.52]}
+        rng = np.random.RandomState(0)
+        self.net_out = rng.randn(13, 11, 5 * 25).astype(np.float32)
+        # a few confident anchors with a clear class
+        out = self.net_out.reshape(-1, 25)
+        hot = rng.choice(len(out), 40, replace=False)
+        out[hot, 4] += 4.
+        out[hot, 5 + rng.randint(20, size=40)] += 6.
+
+    def test_matches_reference(self):
+        before = self.net_out.copy()
+        probs, bbox = decode(self.meta, self.net_out)
+        ref_probs, ref_bbox = reference(self.meta, self.net_out)
+        np.testing.assert_array_equal(self.net_out, before)
+        self.assertGreater(len(ref_probs), 0)
+        self.assertEqual(probs.shape, ref_probs.shape)
+        np.testing.assert_allclose(probs, ref_probs, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(bbox, ref_bbox, rtol=1e-5, atol=1e-6)
+
+    def test_nothing_above_threshold(self):
+        self.meta['thresh'] = 1.
+        probs, bbox = decode(self.meta, self.net_out)
+        self.assertEqual(probs.shape, (0, 20))
+        self.assertEqual(len(box_constructor(self.meta, self.net_out)), 0)
+
+    def test_boxes(self):
+        boxes = box_constructor(self.meta, self.net_out)
+        self.assertGreater(len(boxes), 0)
+        self.assertTrue(np.all(boxes['score'] > self.meta['thresh']))
+        self.assertTrue(np.all((boxes['x'] > 0) & (boxes['x'] < 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()